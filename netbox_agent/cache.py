@@ -0,0 +1,48 @@
+"""
+Run-scoped caches
+
+Most of what the agent collects or fetches (mount points, command outputs,
+NetBox reference objects...) doesn't change during a run, so it is computed
+once and shared by every consumer.
+
+Functions decorated with `run_cache` and objects registered with `register`
+are kept for the duration of a run and flushed all at once by `clear()`.
+
+NetBox reference objects (roles, types, platforms, tags, choices...) are
+cached with `reference=True`: the daemon (see `daemon.py`) flushes the
+other caches before each of its runs but keeps these warm, only flushing
+them every `daemon.references_ttl` seconds.
+"""
+import functools
+
+_clearers = []
+_reference_clearers = []
+
+
+def register(obj, reference=False):
+    """
+    Register an object exposing a `clear()` method (ie: a dict) so that
+    it is flushed at the end of the run
+    """
+    (_reference_clearers if reference else _clearers).append(obj.clear)
+    return obj
+
+
+def run_cache(func=None, reference=False):
+    """
+    Memoize `func` for the duration of the run
+    """
+    if func is None:
+        return functools.partial(run_cache, reference=reference)
+    cached = functools.lru_cache(maxsize=None)(func)
+    (_reference_clearers if reference else _clearers).append(cached.cache_clear)
+    return cached
+
+
+def clear(references=True):
+    """
+    Flush every run-scoped cache, but the NetBox references if not
+    `references`
+    """
+    for clearer in _clearers + (_reference_clearers if references else []):
+        clearer()
@@ -0,0 +1,93 @@
+"""
+Change sets
+
+Changes to a Netbox object are accumulated during the run and flushed as
+a single PATCH holding only the fields which differ from the fetched
+record: fewer writes, fewer changelog entries and fewer webhooks.
+"""
+import logging
+
+from pynetbox.core.response import Record
+
+
+def serialize(value):
+    """
+    Return the value a PATCH would carry for a field of a fetched record:
+    nested objects become their id, choices their value and lists of
+    nested objects (ie: tags) their sorted ids
+    """
+    if isinstance(value, Record):
+        # look at parsed attributes only, to avoid lazy fetches
+        if 'id' in value.__dict__:
+            return value.id
+        return value.__dict__.get('value')
+    if isinstance(value, list):
+        value = [serialize(v) for v in value]
+        if all(isinstance(v, int) for v in value):
+            value = sorted(value)
+    return value
+
+
+def same(current, value):
+    if current == value:
+        return True
+    # ie: rack positions are returned as 12.0 but configured as "12"
+    try:
+        return float(current) == float(value)
+    except (TypeError, ValueError):
+        return False
+
+
+class ChangeSet():
+    def __init__(self, endpoint, record):
+        self.endpoint = endpoint
+        self.record = record
+        self.changes = {}
+        self._after_flush = []
+
+    def set(self, field, value):
+        """
+        Set `field` to `value` (ids for nested objects) if it differs from
+        the fetched record, return True if the field will be updated
+        """
+        if same(serialize(getattr(self.record, field, None)), value):
+            self.changes.pop(field, None)
+            return False
+        self.changes[field] = value
+        return True
+
+    def set_custom_fields(self, custom_fields):
+        """
+        Update the given custom fields only, others are left untouched
+        """
+        current = getattr(self.record, 'custom_fields', None) or {}
+        changed = dict(
+            (k, v) for k, v in custom_fields.items() if not same(current.get(k), v)
+        )
+        if changed:
+            self.changes.setdefault('custom_fields', {}).update(changed)
+        return bool(changed)
+
+    def after_flush(self, callback):
+        """
+        Run `callback` once the changes are written, ie: to delete an
+        object the record no longer references
+        """
+        self._after_flush.append(callback)
+
+    def flush(self):
+        """
+        Write the changes in a single PATCH and return the updated record
+        """
+        if self.changes:
+            logging.debug('Updating {} {}: {}'.format(
+                self.endpoint.name, self.record.id, ', '.join(sorted(self.changes))
+            ))
+            payload = dict(self.changes)
+            payload['id'] = self.record.id
+            self.record = self.endpoint.update([payload])[0]
+            self.changes = {}
+        for callback in self._after_flush:
+            callback()
+        self._after_flush = []
+        return self.record
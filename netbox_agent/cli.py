@@ -1,55 +1,226 @@
-from packaging import version
+import copy
+import importlib
+import sys
+
+import netbox_agent.command as command
 import netbox_agent.dmidecode as dmidecode
+import netbox_agent.state as state
 from netbox_agent.config import config
+from netbox_agent.config import metrics as netbox_metrics
 from netbox_agent.config import netbox_instance as nb
-from netbox_agent.logging import logging  # NOQA
-from netbox_agent.vendors.dell import DellHost
-from netbox_agent.vendors.generic import GenericHost
-from netbox_agent.vendors.hp import HPHost
-from netbox_agent.vendors.qct import QCTHost
-from netbox_agent.vendors.supermicro import SupermicroHost
+from netbox_agent.logging import logging, setup_logging
 from netbox_agent.virtualmachine import VirtualMachine, is_vm
-from netbox_agent.inputdriver import InputDriver
+from netbox_agent.inputdriver import get_input
 
+# vendor modules are only imported once selected, see `get_host_class`
 MANUFACTURERS = {
-    'Dell Inc.': DellHost,
-    'HP': HPHost,
-    'HPE': HPHost,
-    'Supermicro': SupermicroHost,
-    'Quanta Cloud Technology Inc.': QCTHost,
-    'Generic': GenericHost,
+    'Dell Inc.': 'netbox_agent.vendors.dell.DellHost',
+    'HP': 'netbox_agent.vendors.hp.HPHost',
+    'HPE': 'netbox_agent.vendors.hp.HPHost',
+    'Supermicro': 'netbox_agent.vendors.supermicro.SupermicroHost',
+    'Quanta Cloud Technology Inc.': 'netbox_agent.vendors.qct.QCTHost',
+    'Generic': 'netbox_agent.vendors.generic.GenericHost',
 }
 
 
-def run(config):
-    dmi = dmidecode.parse()
+# sub-commands, ie: `netbox_agent push`, imported once selected too
+COMMANDS = {
+    'push': 'netbox_agent.push.run',
+    'serve': 'netbox_agent.serve.run',
+    'daemon': 'netbox_agent.daemon.run',
+}
+
+
+def import_path(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def get_host_class(manufacturer):
+    return import_path(MANUFACTURERS.get(manufacturer, MANUFACTURERS['Generic']))
+
+
+# options requesting a sync, the scopes queued in the spool
+SYNC_OPTIONS = (
+    'register', 'update_all', 'update_network', 'update_location', 'update_inventory',
+    'update_psu',
+)
+
+
+def get_spool(config):
+    if not config.spool.path:
+        return None
+    from netbox_agent.spool import Spool
+    return Spool(
+        config.spool.path,
+        backoff=config.spool.backoff,
+        max_backoff=config.spool.max_backoff,
+        max_size=config.spool.max_size,
+    )
+
+
+def report_spool(spool, config):
+    metrics = spool.metrics()
+    if metrics['depth']:
+        logging.info('Spool: {depth} scope(s) queued for {oldest_age:.0f}s, '
+                     'retry in {retry_in:.0f}s'.format(**metrics))
+    if config.spool.metrics_file:
+        spool.export_metrics(config.spool.metrics_file)
+
+
+def get_snapshot(server):
+    """
+    Return the snapshot of `server`, None if it can't be synced from one
+    """
+    from netbox_agent.snapshot import build, collect, collect_measurements
+
+    if isinstance(server, VirtualMachine):
+        return None
+    try:
+        return build(collect(server), measurements=collect_measurements(server))
+    except Exception:
+        logging.exception('Cannot collect the snapshot, only the scopes are spooled')
+        return None
+
+
+def spool_run(spool, server, scopes):
+    """
+    Queue `scopes`, and the snapshot of what `server` holds now
+    """
+    for scope in scopes:
+        spool.put(scope)
+    snapshot = get_snapshot(server)
+    if snapshot is not None:
+        spool.put_snapshot(snapshot)
+
 
+def replay_snapshot(snapshot, scopes):
+    """
+    Sync `scopes` from the spooled `snapshot`
+    """
+    from netbox_agent.push import sync_snapshot
+    from netbox_agent.spool import is_unreachable
+
+    serial = snapshot['data']['identity']['service_tag']
+    logging.info('Replaying spooled {} from the snapshot of {}'.format(', '.join(scopes), serial))
+    try:
+        sync_snapshot(snapshot, scopes=scopes)
+    except Exception as e:
+        if is_unreachable(e):
+            raise
+        # the next runs would fail the same
+        logging.exception('Cannot replay the spooled snapshot of {}, dropping it'.format(serial))
+
+
+def sync(server, config):
+    """
+    Sync the server with Netbox, return False if Netbox couldn't be
+    reached and the requested scopes were queued in the spool instead
+    """
+    from packaging import version
+
+    # the scopes replayed are requested on a copy of the options
+    config = copy.copy(config)
+    spool = get_spool(config)
+    scopes = [x for x in SYNC_OPTIONS if getattr(config, x)]
+    # the queued scopes the run doesn't sync itself, and their snapshots
+    replayed = []
+    snapshots = []
+    if spool is not None:
+        if spool.retry_at() is not None and not spool.is_due():
+            # Netbox was unreachable recently, wait for the backoff
+            spool_run(spool, server, scopes)
+            report_spool(spool, config)
+            return False
+        replayed = [x['scope'] for x in spool.entries() if x['scope'] not in scopes]
+        snapshots = spool.snapshots() if replayed else []
+        if replayed and not snapshots:
+            # replayed on the live server, along with the requested ones
+            for scope in replayed:
+                logging.info('Replaying spooled {}'.format(scope))
+                setattr(config, scope, True)
+            scopes += replayed
+            replayed = []
+    if not scopes and not replayed:
+        return True
+
+    try:
+        if version.parse(nb.version) < version.parse('2.9'):
+            print('netbox-agent is not compatible with Netbox prior to verison 2.9')
+            return False
+        for snapshot in snapshots:
+            replay_snapshot(snapshot, replayed)
+        if scopes:
+            server.netbox_create_or_update(config)
+    except Exception as e:
+        from netbox_agent.spool import is_unreachable
+
+        if spool is None or not is_unreachable(e):
+            raise
+        logging.error('Netbox is unreachable, spooling {}: {}'.format(
+            ', '.join(scopes + replayed), e,
+        ))
+        spool_run(spool, server, scopes)
+        spool.failed()
+        report_spool(spool, config)
+        return False
+
+    # what was read is only kept once the run succeeded
+    state.save()
+    if spool is not None:
+        for scope in scopes + replayed:
+            spool.remove(scope)
+        # replayed, or superseded by what the run synced itself
+        spool.remove_snapshots()
+        report_spool(spool, config)
+    return True
+
+
+def get_server(dmi, config):
+    """
+    Return the virtual machine, or the server of its vendor's class, `dmi`
+    describes
+    """
     if config.virtual.enabled or is_vm(dmi):
-        config.virtual.cluster_name = InputDriver("cluster").get()
+        if config.collect_only:
+            raise Exception('--collect-only is not supported for virtual machines')
+        config.virtual.cluster_name = get_input("cluster")
         if not config.virtual.cluster_name:
             raise Exception('cluster parameter is mandatory because it\'s a VM')
-        server = VirtualMachine(dmi=dmi)
-    else:
-        manufacturer = dmidecode.get_by_type(dmi, 'Chassis')[0].get('Manufacturer')
-        try:
-            server = MANUFACTURERS[manufacturer](dmi=dmi)
-        except KeyError:
-            server = GenericHost(dmi=dmi)
-
-    if version.parse(nb.version) < version.parse('2.9'):
-        print('netbox-agent is not compatible with Netbox prior to verison 2.9')
-        return False
+        return VirtualMachine(dmi=dmi)
+    manufacturer = dmidecode.get_by_type(dmi, 'Chassis')[0].get('Manufacturer')
+    return get_host_class(manufacturer)(dmi=dmi)
+
 
-    if config.register or config.update_all or config.update_network or \
-       config.update_location or config.update_inventory or config.update_psu:
-        server.netbox_create_or_update(config)
+def run(config):
+    dmi = dmidecode.parse()
+    server = get_server(dmi, config)
+
+    if config.collect_only:
+        from netbox_agent.snapshot import collect_only
+
+        collect_only(server, config)
+        logging.debug('Ran {commands} commands in {duration:.2f}s ({output_size} bytes, '
+                      '{cache_hits} served from cache)'.format(**command.metrics()))
+        return True
+
+    synced = sync(server, config)
     if config.debug:
         server.print_debug()
-    return True
+    logging.debug('Ran {commands} commands in {duration:.2f}s ({output_size} bytes, '
+                  '{cache_hits} served from cache)'.format(**command.metrics()))
+    logging.debug('Fetched {lazy_fetches} Netbox records lazily '
+                  '{lazy_fetches_by_endpoint}'.format(**netbox_metrics()))
+    return synced
 
 
 def main():
-    return run(config)
+    command = run
+    # the options are parsed without the sub-command
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        command = import_path(COMMANDS[sys.argv.pop(1)])
+    setup_logging(config)
+    return command(config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,306 @@
+"""
+Run external commands
+
+Collectors shell out to system and vendor tools whose output can be
+large (storcli's JSON for a hundred drives easily exceeds the pipe
+buffer). Output is always read while the command runs, so the child can
+never block on a full pipe while we wait for it, and commands exceeding
+their timeout are killed.
+
+`run_json` can stream-parse the output with `ijson` when it is
+installed, instead of buffering the whole document first.
+
+Outputs are memoized for the duration of the run, keyed by argv (or
+command line), so a command used by several collectors or location
+drivers only runs once.
+"""
+import collections
+import json
+import logging
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from netbox_agent.cache import register
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+DEFAULT_TIMEOUT = 300
+# seconds to wait for the output of a killed command
+KILL_TIMEOUT = 5
+
+# every command run during the run, for metrics
+history = register([])
+
+_memo = register({})
+_memo_locks = register({})
+_memo_lock = threading.Lock()
+_hits = register(collections.Counter())
+
+
+class CommandError(Exception):
+    pass
+
+
+class CommandTimeout(CommandError):
+    pass
+
+
+class CommandResult():
+    def __init__(self, command, returncode, output, duration, size, data=None, stderr=None):
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+        self.duration = duration
+        self.size = size
+        self.data = data
+        self.stderr = stderr
+
+    def check(self):
+        """
+        Raise `CommandError` if the command failed, return the result otherwise
+        """
+        if self.returncode != 0:
+            raise CommandError('Command `{}` failed (rc={}):\n{}'.format(
+                _format(self.command), self.returncode, self.stderr or self.output or ''
+            ))
+        return self
+
+    def __repr__(self):
+        return '<CommandResult `{}` rc={} {:.3f}s {} bytes>'.format(
+            _format(self.command), self.returncode, self.duration, self.size
+        )
+
+
+class _CountingReader():
+    """
+    Wraps a binary stream and counts the bytes read from it
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, n=-1):
+        data = self.stream.read(n)
+        self.size += len(data)
+        return data
+
+
+def _format(command):
+    if isinstance(command, str):
+        return command
+    return ' '.join(command)
+
+
+def _record(result):
+    history.append(result)
+    logging.debug('Ran `{}` in {:.3f}s (rc={}, {} bytes)'.format(
+        _format(result.command), result.duration, result.returncode, result.size
+    ))
+    return result
+
+
+def _popen(command, stderr):
+    # a string is a shell command line, as found in configuration files;
+    # the command runs in its own session so `_kill` reaches its children
+    return subprocess.Popen(
+        command,
+        shell=isinstance(command, str),
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        start_new_session=True,
+    )
+
+
+def _kill(p):
+    """
+    Kill the process group of `p`: killing the shell of a command line
+    would leave its children holding the pipes
+    """
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _memoize(key, func):
+    """
+    Return the memoized result for `key`, calling `func` to compute it
+    the first time; concurrent callers of the same key wait for it
+    """
+    with _memo_lock:
+        lock = _memo_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key in _memo:
+            _hits[key] += 1
+        else:
+            _memo[key] = func()
+        return _memo[key]
+
+
+def _key(command):
+    if isinstance(command, str):
+        return command
+    return tuple(command)
+
+
+def run(command, timeout=DEFAULT_TIMEOUT, cache=True, stderr=subprocess.STDOUT):
+    """
+    Run `command`, either a list of arguments or a shell command line,
+    and return a `CommandResult` holding its merged stdout and stderr,
+    or only its stdout if `stderr` is `subprocess.PIPE`: stderr is then
+    returned apart, in the result's `stderr` (ie: for outputs parsed)
+
+    The result is reused by later calls with the same command unless
+    `cache` is False. Raises `CommandTimeout` if the command is killed
+    after `timeout` seconds.
+    """
+    if cache:
+        return _memoize(
+            ('run', _key(command), stderr),
+            lambda: run(command, timeout=timeout, cache=False, stderr=stderr),
+        )
+    start = time.monotonic()
+    p = _popen(command, stderr)
+    try:
+        output, errors = p.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(p)
+        try:
+            p.communicate(timeout=KILL_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # a child escaped the process group, and holds the pipe
+            p.stdout.close()
+            p.wait()
+        raise CommandTimeout('Command `{}` timed out after {}s'.format(
+            _format(command), timeout
+        ))
+    return _record(CommandResult(
+        command,
+        p.returncode,
+        output.decode('utf-8', 'replace'),
+        time.monotonic() - start,
+        len(output),
+        stderr=errors.decode('utf-8', 'replace') if errors is not None else None,
+    ))
+
+
+def _select(data, items):
+    # fallback for ijson prefixes, ie: `Controllers.item`
+    for key in items.split('.'):
+        if key != 'item':
+            data = data[key]
+    return data
+
+
+def run_json(command, timeout=DEFAULT_TIMEOUT, items=None, cache=True):
+    """
+    Run `command` and parse its stdout as JSON into the result's `data`
+
+    If `items` is an ijson prefix (ie: `Controllers.item`), only the items
+    of the designated array are returned, and they are parsed one by one
+    while the command runs when `ijson` is available.
+
+    stderr is kept apart, in a temporary file so it can't fill a pipe, and
+    returned in the result's `stderr`.
+    Raises `CommandError` if the output can't be parsed and
+    `CommandTimeout` if the command is killed after `timeout` seconds.
+    """
+    if cache:
+        return _memoize(
+            ('run_json', _key(command), items),
+            lambda: run_json(command, timeout=timeout, items=items, cache=False),
+        )
+    start = time.monotonic()
+    with tempfile.TemporaryFile() as stderr:
+        p = _popen(command, stderr)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            _kill(p)
+
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        stdout = _CountingReader(p.stdout)
+        error = None
+        try:
+            if items and ijson is not None:
+                data = list(ijson.items(stdout, items, use_float=True))
+            else:
+                data = json.load(stdout)
+                if items:
+                    data = _select(data, items)
+        except Exception as e:
+            error = e
+            # drain the pipe so the command can exit
+            while stdout.read(65536):
+                pass
+        finally:
+            p.stdout.close()
+            p.wait()
+            watchdog.cancel()
+
+        if timed_out.is_set():
+            raise CommandTimeout('Command `{}` timed out after {}s'.format(
+                _format(command), timeout
+            ))
+        stderr.seek(0)
+        result = _record(CommandResult(
+            command,
+            p.returncode,
+            None,
+            time.monotonic() - start,
+            stdout.size,
+            stderr=stderr.read().decode('utf-8', 'replace'),
+        ))
+        if error is not None:
+            raise CommandError('Failed to parse `{}` output (rc={}): {}\n{}'.format(
+                _format(command),
+                p.returncode,
+                error,
+                result.stderr,
+            ))
+        result.data = data
+    return result
+
+
+def getoutput(command, **kwargs):
+    """
+    Like `subprocess.getoutput`: return the output of `command`, without
+    its trailing newline
+    """
+    output = run(command, **kwargs).output
+    if output[-1:] == '\n':
+        output = output[:-1]
+    return output
+
+
+def getstatusoutput(command, **kwargs):
+    """
+    Like `subprocess.getstatusoutput`: return `(returncode, output)`
+    """
+    res = run(command, **kwargs)
+    output = res.output
+    if output[-1:] == '\n':
+        output = output[:-1]
+    return res.returncode, output
+
+
+def metrics():
+    """
+    Return counters about the commands run so far
+    """
+    return {
+        'commands': len(history),
+        'cache_hits': sum(_hits.values()),
+        'duration': sum(r.duration for r in history),
+        'output_size': sum(r.size for r in history),
+    }
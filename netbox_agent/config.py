@@ -1,10 +1,26 @@
+"""
+Configuration and Netbox client
+
+Both are created on first use rather than at import time: importing a
+module of the package neither parses the command line nor imports
+jsonargparse and pynetbox, which keeps the startup of the agent fast and
+lets the package be used as a library.
+
+`config` and `netbox_instance` are proxies to the objects returned by
+`get_config()` and `get_netbox_instance()`. The options are parsed from
+the command line, unless `get_config(args)` parsed them from `args`
+first (ie: when used as a library, or by the tests).
+"""
+import collections
+import copy
+import functools
 import logging
 import sys
 
-import jsonargparse
-import pynetbox
-import requests
-import urllib3
+from netbox_agent.cache import register
+
+# pynetbox records fetched lazily during the run, by endpoint
+lazy_fetches = register(collections.Counter())
 
 
 def add_location_argument(argument_parser, argument):
@@ -18,7 +34,36 @@ def add_location_argument(argument_parser, argument):
                                  help=argument_name + " regex to extract Netbox tenant slug")
 
 
-def get_config():
+class _Lazy():
+    """
+    Proxy to the object returned by `factory`, called on first access;
+    `resolved()` tells if it was already called
+    """
+
+    def __init__(self, factory, resolved):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_resolved', resolved)
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._factory(), name, value)
+
+    def __copy__(self):
+        # a copy of the object, not of the proxy
+        return copy.copy(self._factory())
+
+    def __repr__(self):
+        # never resolves: parsing the options may exit
+        if self._resolved():
+            return repr(self._factory())
+        return '<unresolved {}>'.format(self._factory.__name__)
+
+
+def get_parser():
+    import jsonargparse
+
     p = jsonargparse.ArgumentParser(
         default_config_files=[
             '/etc/netbox_agent.yaml',
@@ -44,12 +89,74 @@ def get_config():
     p.add_argument('--expansion-as-device', action='store_true',
                    help='Manage blade expansions as external devices')
 
+    p.add_argument('--collect-only', action='store_true',
+                   help='Only run the collectors and write a snapshot, without contacting Netbox')
+    p.add_argument('--snapshot-file', default='-',
+                   help='File to write the snapshot to, - for stdout, or URL to POST it to '
+                        '(ie: http://receiver:8080/snapshots, see netbox_agent serve)')
+
+    p.add_argument('--serve.host', default='127.0.0.1',
+                   help='serve: address to receive the snapshots on')
+    p.add_argument('--serve.port', type=int, default=8080,
+                   help='serve: port to receive the snapshots on')
+    p.add_argument('--serve.token',
+                   help='serve: token the agents authenticate with, sent by --snapshot-file '
+                        'to an URL')
+    p.add_argument('--serve.window', type=int, default=60,
+                   help='serve: seconds a snapshot waits for a newer one of the same server')
+    p.add_argument('--serve.batch_size', type=int, default=50,
+                   help='serve: maximum number of snapshots synced at once')
+    p.add_argument('--serve.max_pending', type=int, default=10000,
+                   help='serve: maximum number of queued snapshots, others are refused')
+    p.add_argument('--serve.max_attempts', type=int, default=3,
+                   help='serve: attempts to sync a snapshot before dropping it')
+    p.add_argument('--daemon.network_interval', type=int, default=300,
+                   help='daemon: seconds between the updates of the network')
+    p.add_argument('--daemon.location_interval', type=int, default=3600,
+                   help='daemon: seconds between the updates of the location')
+    p.add_argument('--daemon.inventory_interval', type=int, default=86400,
+                   help='daemon: seconds between the updates of the inventory')
+    p.add_argument('--daemon.psu_interval', type=int, default=86400,
+                   help='daemon: seconds between the updates of the PSUs')
+    p.add_argument('--daemon.references_ttl', type=int, default=3600,
+                   help='daemon: seconds the Netbox reference objects (roles, types, '
+                        'platforms, tags...) are cached')
+    p.add_argument('--daemon.lock_file', default='/run/netbox_agent.lock',
+                   help='daemon: lock file, only one daemon runs at once')
+    p.add_argument('--push.path', default='-',
+                   help='push: directory of snapshots, or file holding one snapshot per line, '
+                        '- for stdin')
+    p.add_argument('--push.workers', type=int, default=4,
+                   help='push, serve: number of worker processes syncing the snapshots')
+    p.add_argument('--push.max_requests', type=int, default=8,
+                   help='push, serve: maximum number of concurrent Netbox requests, '
+                        'for all workers')
+
     p.add_argument('--log_level', default='debug')
     p.add_argument('--netbox.ssl_ca_certs_file', help='SSL CA certificates file')
     p.add_argument('--netbox.url', help='Netbox URL')
     p.add_argument('--netbox.token', help='Netbox API Token')
     p.add_argument('--netbox.ssl_verify', default=True, action='store_true',
                    help='Disable SSL verification')
+    p.add_argument('--netbox.graphql', action='store_true',
+                   help='Read the device state with a single GraphQL query (Netbox 3.0+)')
+    p.add_argument('--state.path',
+                   help='Local state file, Netbox objects read by the previous run are '
+                        'only fetched again once updated')
+    p.add_argument('--state.max_age', type=int, default=86400,
+                   help='Seconds after which the objects are all fetched again')
+    p.add_argument('--spool.path',
+                   help='Spool directory: the scopes to sync, and the snapshot of what was '
+                        'collected, are queued there and retried later when Netbox is '
+                        'unreachable')
+    p.add_argument('--spool.backoff', type=int, default=60,
+                   help='Seconds before the first retry, doubled by each failed one')
+    p.add_argument('--spool.max_backoff', type=int, default=3600,
+                   help='Maximum seconds between retries')
+    p.add_argument('--spool.max_size', type=int, default=64 * 2 ** 20,
+                   help='Maximum bytes of spooled snapshots, the oldest are dropped')
+    p.add_argument('--spool.metrics_file',
+                   help='File to export the spool metrics to, in the Prometheus text format')
     p.add_argument('--virtual.enabled', action='store_true', help='Is a virtual machine or not')
     add_location_argument(p, "cluster")
     p.add_argument('--hostname_cmd', default=None,
@@ -94,22 +201,89 @@ def get_config():
     p.add_argument('--dump-disks-map',
                    help='File path to dump physical/virtual disks map')
 
-    options = p.parse_args()
-    return options
+    return p
+
 
+_config = {}
 
-config = get_config()
 
+def get_config(args=None):
+    """
+    Return the options, parsed from the command line on first use, or
+    from the list of arguments `args`, which then replace them
+    """
+    if args is not None or 'options' not in _config:
+        _config['options'] = get_parser().parse_args(args)
+    return _config['options']
 
+
+config = _Lazy(get_config, resolved=lambda: 'options' in _config)
+
+
+def count_lazy_fetches(record_class):
+    """
+    Count the full GETs pynetbox records issue when an attribute they
+    don't hold is accessed (ie: `interface.lag.description`): each one is
+    a round trip, easily hidden in a loop
+    """
+    full_details = record_class.full_details
+    if getattr(full_details, 'counted', False):
+        return
+
+    @functools.wraps(full_details)
+    def counted_full_details(record):
+        if record.url and not record.has_details:
+            endpoint = getattr(record.endpoint, 'name', None)
+            lazy_fetches[endpoint] += 1
+            logging.debug('Lazy fetch of {}'.format(record.url))
+        return full_details(record)
+
+    counted_full_details.counted = True
+    record_class.full_details = counted_full_details
+
+
+def limit_concurrent_requests(session, semaphore):
+    """
+    Make every request of the `requests` session `session` hold `semaphore`
+    (ie: shared by several processes), capping the concurrent requests
+    """
+    request = session.request
+
+    @functools.wraps(request)
+    def limited_request(*args, **kwargs):
+        with semaphore:
+            return request(*args, **kwargs)
+
+    session.request = limited_request
+
+
+def metrics():
+    """
+    Return counters about the Netbox records fetched so far
+    """
+    return {
+        'lazy_fetches': sum(lazy_fetches.values()),
+        'lazy_fetches_by_endpoint': dict(lazy_fetches),
+    }
+
+
+@functools.lru_cache(maxsize=None)
 def get_netbox_instance():
+    import pynetbox
+    import requests
+    import urllib3
+    from pynetbox.core.response import Record
+
+    config = get_config()
     if config.netbox.url is None or config.netbox.token is None:
         logging.error('Netbox URL and token are mandatory')
         sys.exit(1)
 
     nb = pynetbox.api(
-        url=get_config().netbox.url,
-        token=get_config().netbox.token,
+        url=config.netbox.url,
+        token=config.netbox.token,
     )
+    count_lazy_fetches(Record)
     ca_certs_file = config.netbox.ssl_ca_certs_file
     if ca_certs_file is not None:
         session = requests.Session()
@@ -124,4 +298,6 @@ def get_netbox_instance():
     return nb
 
 
-netbox_instance = get_netbox_instance()
+netbox_instance = _Lazy(
+    get_netbox_instance, resolved=lambda: get_netbox_instance.cache_info().currsize > 0,
+)
@@ -0,0 +1,197 @@
+"""
+Daemon mode
+
+`netbox_agent daemon` replaces the cron job: a single long-running agent
+syncs each scope of the server on its own interval (`daemon.*_interval`),
+network every 5 minutes, location hourly, inventory and PSUs daily by
+default. The `--update-*` options are ignored, the inventory is only
+synced with `--inventory`.
+
+Each run goes through the code of the one-shot agent (`cli.get_server`
+and `cli.sync`, the spool included) with the due scopes requested. What
+the one-shot agent pays on every run is only paid once: the interpreter
+and the imports, the options, the Netbox session and the state store.
+The collectors, dmidecode included, run again for each run, but the Netbox
+reference objects (roles, types, platforms, tags, choices) are kept for
+`daemon.references_ttl` seconds.
+
+The runs of a scope are spread over its interval by a delay derived from
+the serial number of the server: the runs of a fleet don't all hit Netbox
+at once, yet a server always runs at the same time. A lock file
+(`daemon.lock_file`) keeps a second daemon from running.
+"""
+import copy
+import fcntl
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+import netbox_agent.cache as cache
+import netbox_agent.cli as cli
+import netbox_agent.command as command
+import netbox_agent.dmidecode as dmidecode
+from netbox_agent.config import get_config
+
+# option requesting the update of each scope
+SCOPES = (
+    ('network', 'update_network'),
+    ('location', 'update_location'),
+    ('inventory', 'update_inventory'),
+    ('psu', 'update_psu'),
+)
+
+
+class LockError(Exception):
+    pass
+
+
+def acquire_lock(path):
+    """
+    Lock `path`, raise `LockError` if another process holds it; the lock
+    is held until the returned file is closed
+    """
+    f = open(path, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.seek(0)
+        pid = f.read().strip()
+        f.close()
+        raise LockError('Another netbox_agent daemon (pid {}) holds {}'.format(pid or '?', path))
+    f.truncate(0)
+    f.write('{}\n'.format(os.getpid()))
+    f.flush()
+    return f
+
+
+def get_phase(serial, scope, interval):
+    """
+    Return the offset, within `interval`, of the runs of `scope`: random
+    but always the same for a server
+    """
+    return random.Random('{}/{}'.format(serial, scope)).random() * interval
+
+
+class Schedule():
+    def __init__(self, serial, intervals, now=None):
+        """
+        `intervals` is the interval of each scope in seconds
+        """
+        now = now or time.time()
+        self.intervals = intervals
+        self.next_run = {}
+        for scope, interval in intervals.items():
+            phase = get_phase(serial, scope, interval)
+            self.next_run[scope] = now + (phase - now) % interval
+
+    def due(self, now=None):
+        """
+        Return the scopes due, and schedule their next run
+        """
+        now = now or time.time()
+        scopes = []
+        for scope, next_run in sorted(self.next_run.items()):
+            if next_run <= now:
+                scopes.append(scope)
+                # skips the runs missed, ie: while suspended
+                interval = self.intervals[scope]
+                self.next_run[scope] = next_run + ((now - next_run) // interval + 1) * interval
+        return scopes
+
+    def delay(self, now=None):
+        """
+        Return the seconds until the next run
+        """
+        now = now or time.time()
+        return max(0, min(self.next_run.values()) - now)
+
+
+def get_intervals(config):
+    intervals = dict(
+        (scope, getattr(config.daemon, '{}_interval'.format(scope))) for scope, _ in SCOPES
+    )
+    if not config.inventory:
+        del intervals['inventory']
+    return intervals
+
+
+def get_run_config(config, scopes):
+    """
+    Return the options to run `scopes` with
+    """
+    run_config = copy.copy(config)
+    for option in cli.SYNC_OPTIONS:
+        setattr(run_config, option, False)
+    for scope, option in SCOPES:
+        setattr(run_config, option, scope in scopes)
+    return run_config
+
+
+def run_scopes(config, scopes):
+    """
+    Sync `scopes` like the one-shot agent, return False if they were
+    spooled
+    """
+    # the collectors run again (ie: a PSU was pulled), the Netbox
+    # references are kept
+    cache.clear(references=False)
+    run_config = get_run_config(config, scopes)
+    server = cli.get_server(dmidecode.parse(), run_config)
+    synced = cli.sync(server, run_config)
+    logging.debug('Ran {commands} commands in {duration:.2f}s ({output_size} bytes, '
+                  '{cache_hits} served from cache)'.format(**command.metrics()))
+    return synced
+
+
+def loop(config, schedule, stop):
+    references_at = time.time()
+    while not stop.wait(schedule.delay()):
+        now = time.time()
+        if now - references_at >= config.daemon.references_ttl:
+            cache.clear()
+            references_at = now
+        scopes = schedule.due(now)
+        if not scopes:
+            continue
+        start = time.time()
+        try:
+            synced = run_scopes(config, scopes)
+        except Exception:
+            # retried on the next run of the scopes
+            logging.exception('Failed to update {}'.format(', '.join(scopes)))
+            continue
+        logging.info('Updated {} in {:.1f}s{}'.format(
+            ', '.join(scopes), time.time() - start, '' if synced else ', spooled',
+        ))
+
+
+def run(config):
+    lock = acquire_lock(config.daemon.lock_file)
+    stop = threading.Event()
+
+    def on_signal(signum, frame):
+        logging.info('Stopping on signal {}'.format(signum))
+        stop.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    try:
+        # the options are parsed once, the runs work on copies
+        config = get_config()
+        # only the serial number is read once, for the schedule
+        server = cli.get_server(dmidecode.parse(), config)
+        # virtual machines have no serial number
+        serial = getattr(server, 'get_service_tag', socket.gethostname)()
+        schedule = Schedule(serial, get_intervals(config))
+        for scope, next_run in sorted(schedule.next_run.items(), key=lambda x: x[1]):
+            logging.info('Updating {} every {}s, next in {:.0f}s'.format(
+                scope, schedule.intervals[scope], next_run - time.time(),
+            ))
+        loop(config, schedule, stop)
+    finally:
+        lock.close()
+    return True
@@ -3,6 +3,7 @@ import re as _re
 import subprocess as _subprocess
 import sys
 
+from netbox_agent.command import CommandError, run
 from netbox_agent.misc import is_tool
 
 _handle_re = _re.compile('^Handle\\s+(.+),\\s+DMI\\s+type\\s+(\\d+),\\s+(\\d+)\\s+bytes$')
@@ -140,7 +141,11 @@ def _execute_cmd():
         logging.error('Dmidecode does not seem to be present on your system. Add it your path or '
                       'check the compatibility of this project with your distro.')
         sys.exit(1)
-    return _subprocess.check_output(['dmidecode', ], stderr=_subprocess.PIPE)
+    try:
+        return run(['dmidecode', ], stderr=_subprocess.PIPE).check().output
+    except CommandError as e:
+        logging.error(e)
+        sys.exit(1)
 
 
 def _parse(buffer):
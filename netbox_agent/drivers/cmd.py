@@ -1,9 +1,10 @@
 import re
-import subprocess
+
+from netbox_agent.command import getoutput
 
 
 def get(value, regex):
-    output = subprocess.getoutput(value)
+    output = getoutput(value)
     r = re.search(regex, output)
     if r and len(r.groups()) > 0:
         return r.groups()[0]
@@ -2,8 +2,10 @@ import re
 
 
 def get(value, regex):
-    for line in open(value, 'r'):
-        r = re.search(regex, line)
-        if r and len(r.groups()) > 0:
-            return r.groups()[0]
+    pattern = re.compile(regex)
+    with open(value, 'r') as f:
+        for line in f:
+            r = pattern.search(line)
+            if r and len(r.groups()) > 0:
+                return r.groups()[0]
     return None
@@ -1,7 +1,8 @@
 import re
-import subprocess
 from shutil import which
 
+from netbox_agent.command import getoutput, getstatusoutput
+
 #  Originally from https://github.com/opencoff/useful-scripts/blob/master/linktest.py
 
 # mapping fields from ethtool output to simple names
@@ -40,7 +41,7 @@ class Ethtool():
         parse ethtool output
         """
 
-        output = subprocess.getoutput('ethtool {}'.format(self.interface))
+        output = getoutput(['ethtool', self.interface])
 
         fields = {}
         field = ''
@@ -64,7 +65,7 @@ class Ethtool():
         return fields
 
     def _parse_ethtool_module_output(self):
-        status, output = subprocess.getstatusoutput('ethtool -m {}'.format(self.interface))
+        status, output = getstatusoutput(['ethtool', '-m', self.interface])
         if status == 0:
             r = re.search(r'Identifier.*\((\w+)\)', output)
             if r and len(r.groups()) > 0:
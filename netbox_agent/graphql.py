@@ -0,0 +1,265 @@
+"""
+GraphQL read path
+
+Netbox 3.0+ exposes a GraphQL API: the device, its interfaces (with their
+LAG, VLANs, cable and cable peer), IP addresses, inventory items and power
+ports are read with a single query instead of a REST request per kind of
+object (and per inventory tag).
+
+The result is hydrated into the same pynetbox records the REST API
+returns, so that the reconcilers work the same way with both. The cable
+peers are read from `link_peers` since Netbox 3.3, from `link_peer`
+before. Any error (older Netbox, schema differences...) falls back to the
+REST API.
+"""
+import logging
+import re
+
+from netbox_agent.cache import run_cache
+from netbox_agent.misc import get_choices
+
+DEVICE_STATE_QUERY = '''
+query DeviceState($serial: [String]) {
+  device_list(serial: $serial) {
+    id
+    name
+    serial
+    interfaces {
+      id
+      name
+      mac_address
+      mgmt_only
+      type
+      mode
+      lag { id name }
+      untagged_vlan { id vid name }
+      tagged_vlans { id vid name }
+      cable { id }
+      link_peers {
+        __typename
+        ... on InterfaceType { id name device { id name } }
+      }
+      ip_addresses { id address role }
+    }
+    inventoryitems {
+      id
+      name
+      serial
+      tags { id name slug }
+    }
+    powerports {
+      id
+      name
+      description
+      maximum_draw
+      allocated_draw
+      link_peers {
+        __typename
+        ... on PowerFeedType { id name }
+      }
+    }
+  }
+}
+'''
+
+
+class GraphQLError(Exception):
+    pass
+
+
+@run_cache(reference=True)
+def get_device_state_query(nb):
+    """
+    Return the query of the device state for the version of Netbox: a
+    single `link_peer` before Netbox 3.3
+    """
+    from packaging import version
+
+    if version.parse(nb.version) < version.parse('3.3'):
+        return DEVICE_STATE_QUERY.replace('link_peers', 'link_peer')
+    return DEVICE_STATE_QUERY
+
+
+def get_graphql_url(nb):
+    return re.sub('/api/?$', '', nb.base_url) + '/graphql/'
+
+
+def query(nb, document, variables=None):
+    """
+    Run a GraphQL query against Netbox and return its data
+    """
+    headers = {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+    }
+    if nb.token:
+        headers['Authorization'] = 'Token {}'.format(nb.token)
+    resp = nb.http_session.post(
+        get_graphql_url(nb),
+        headers=headers,
+        json={'query': document, 'variables': variables or {}},
+    )
+    if not resp.ok:
+        raise GraphQLError('HTTP {}: {}'.format(resp.status_code, resp.text[:200]))
+    result = resp.json()
+    if result.get('errors'):
+        raise GraphQLError('; '.join(e.get('message', '') for e in result['errors']))
+    return result['data']
+
+
+def enum_name(value):
+    """
+    Return the name Netbox' GraphQL schema gives to the choice `value`
+    (ie: `1000base-t` is `A_1000BASE_T`)
+    """
+    name = re.sub(r'[\W|^]+', '_', value).upper()
+    if not re.match('[_A-Za-z]', name):
+        name = 'A_' + name
+    return name
+
+
+class ChoiceMap():
+    """
+    Map the GraphQL enums of an endpoint's choice fields back to the
+    `{value, label}` the REST API returns
+    """
+
+    def __init__(self, choices):
+        self.choices = {}
+        for field, values in choices.items():
+            self.choices[field] = {}
+            for choice in values:
+                value = {'value': choice['value'], 'label': choice['display_name']}
+                self.choices[field][str(choice['value'])] = value
+                self.choices[field][enum_name(str(choice['value']))] = value
+
+    def __call__(self, field, value):
+        if value is None:
+            return None
+        return self.choices.get(field, {}).get(value, {'value': value, 'label': value})
+
+
+def parse_ids(value):
+    """
+    GraphQL returns ids as strings, the REST API as integers
+    """
+    if isinstance(value, list):
+        return [parse_ids(v) for v in value]
+    if isinstance(value, dict):
+        return dict(
+            (k, int(v) if k == 'id' and v is not None else parse_ids(v))
+            for k, v in value.items()
+        )
+    return value
+
+
+def hydrate(endpoint, values):
+    """
+    Return `values` as the record the REST API returns for `endpoint`
+    """
+    values = dict(values, url='{}/{}/'.format(endpoint.url, values['id']))
+    return endpoint.return_obj(values, endpoint.api, endpoint)
+
+
+def link_peer(values, typename):
+    peers = values.pop('link_peers', None) or []
+    if 'link_peer' in values:
+        # Netbox < 3.3
+        peers = [x for x in [values.pop('link_peer')] if x]
+    peers = [x for x in peers if x['__typename'] == typename]
+    if not peers:
+        return None
+    return dict((k, v) for k, v in peers[0].items() if k != '__typename')
+
+
+class DeviceState():
+    """
+    Netbox state of a device, as read at the beginning of the run
+
+    The state doesn't reflect the run's own writes, so every part of it is
+    handed out once by `take()`: later reads go through the REST API.
+    """
+
+    def __init__(self, device, parts):
+        self.device = device
+        self._parts = parts
+        self._taken = set()
+
+    def take(self, name, device_id, default=None):
+        """
+        Return the `name` part of the state of device `device_id`, or
+        None if it isn't known (anymore)
+        """
+        if device_id != self.device.id or name in self._taken:
+            return None
+        self._taken.add(name)
+        return self._parts.get(name, default)
+
+
+def parse_device_state(nb, values):
+    dcim_choices = ChoiceMap(get_choices('dcim', 'interfaces'))
+    ipam_choices = ChoiceMap(get_choices('ipam', 'ip_addresses'))
+    device_ref = {'id': values['id'], 'name': values['name']}
+    device = hydrate(nb.dcim.devices, {
+        'id': values['id'], 'name': values['name'], 'serial': values['serial'],
+    })
+
+    interfaces = []
+    ip_addresses = []
+    cable_peers = {}
+    for interface in values['interfaces']:
+        interface = dict(interface, device=device_ref)
+        interface['type'] = dcim_choices('type', interface['type'])
+        interface['mode'] = dcim_choices('mode', interface['mode'])
+        peer = link_peer(interface, 'InterfaceType')
+        for ip in interface.pop('ip_addresses'):
+            ip_addresses.append(hydrate(nb.ipam.ip_addresses, dict(
+                ip,
+                role=ipam_choices('role', ip['role']),
+                assigned_object_type='dcim.interface',
+                assigned_object_id=interface['id'],
+                assigned_object={'id': interface['id'], 'name': interface['name']},
+            )))
+        interface = hydrate(nb.dcim.interfaces, interface)
+        interfaces.append(interface)
+        if interface.cable is not None and peer is not None:
+            cable_peers[interface.id] = (interface.cable, hydrate(nb.dcim.interfaces, peer))
+
+    inventory_items = {}
+    for item in values['inventoryitems']:
+        item = hydrate(nb.dcim.inventory_items, dict(item, device=device_ref))
+        for tag in item.tags:
+            inventory_items.setdefault('inventory_items:{}'.format(tag.slug), []).append(item)
+
+    power_ports = []
+    for port in values['powerports']:
+        port = dict(port, device=device_ref)
+        feed = link_peer(port, 'PowerFeedType')
+        port['connected_endpoint_type'] = 'dcim.powerfeed' if feed else None
+        port['connected_endpoint'] = feed
+        power_ports.append(hydrate(nb.dcim.power_ports, port))
+
+    parts = dict(
+        interfaces=interfaces,
+        ip_addresses=ip_addresses,
+        cable_peers=cable_peers,
+        power_ports=power_ports,
+    )
+    parts.update(inventory_items)
+    return DeviceState(device, parts)
+
+
+def get_device_state(nb, serial):
+    """
+    Return the `DeviceState` of the device `serial`, None if it can't be
+    read through GraphQL
+    """
+    try:
+        data = parse_ids(query(nb, get_device_state_query(nb), {'serial': [serial]}))
+        devices = data['device_list']
+        if len(devices) != 1:
+            return None
+        return parse_device_state(nb, devices[0])
+    except Exception as e:
+        logging.info('Cannot read the device state with GraphQL, using the REST API: {}'.format(e))
+        return None
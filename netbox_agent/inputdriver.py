@@ -1,9 +1,27 @@
-import os
+import functools
 import importlib
 import importlib.machinery
 
+from netbox_agent.cache import run_cache
 from netbox_agent.config import config
 
+INPUT_TYPES = (
+    'region', 'site', 'location', 'rack', 'position', 'face', 'tenant', 'height', 'cluster',
+)
+
+
+@functools.lru_cache(maxsize=None)
+def load_driver_file(driver_file):
+    """
+    Import a custom driver file, once per process
+    """
+    try:
+        # FIXME: Works with Python 3.3+, support older version?
+        loader = importlib.machinery.SourceFileLoader('driver_file', driver_file)
+        return loader.load_module()
+    except ImportError:
+        raise ImportError("Couldn't import {} as a module".format(driver_file))
+
 
 class InputDriver:
     """
@@ -21,24 +39,8 @@ class InputDriver:
 
     def __init__(self, input_type):
         argument = None
-        if input_type == "region":
-            argument = config.region
-        elif input_type == "site":
-            argument = config.site
-        elif input_type == "location":
-            argument = config.location
-        elif input_type == "rack":
-            argument = config.rack
-        elif input_type == "position":
-            argument = config.position
-        elif input_type == "face":
-            argument = config.face
-        elif input_type == "tenant":
-            argument = config.tenant
-        elif input_type == "height":
-            argument = config.height
-        elif input_type == "cluster":
-            argument = config.cluster
+        if input_type in INPUT_TYPES:
+            argument = getattr(config, input_type, None)
 
         if not argument:
             raise Exception("Invalid input type: {}".format(input_type))
@@ -49,14 +51,11 @@ class InputDriver:
             argument.driver else None
         self.driver_file = argument.driver_file
         self.regex = argument.regex
+        self._resolved = False
+        self._value = None
 
         if self.driver_file:
-            try:
-                # FIXME: Works with Python 3.3+, support older version?
-                loader = importlib.machinery.SourceFileLoader('driver_file', self.driver_file)
-                self.driver = loader.load_module()
-            except ImportError:
-                raise ImportError("Couldn't import {} as a module".format(self.driver_file))
+            self.driver = load_driver_file(self.driver_file)
         else:
             if self.driver:
                 try:
@@ -67,10 +66,35 @@ class InputDriver:
                     raise ImportError("Driver {} doesn't exists".format(self.driver))
 
     def get(self):
+        """
+        Return the driver's value, evaluated on first call only
+        """
+        if not self._resolved:
+            self._value = self._get()
+            self._resolved = True
+        return self._value
+
+    def _get(self):
         if self.driver is None:
             return None
         if not hasattr(self.driver, 'get'):
             raise Exception(
                 "Your driver {} doesn't have a get() function, please fix it".format(self.driver)
             )
-        return getattr(self.driver, 'get')(self.driver_value, self.regex)
\ No newline at end of file
+        return getattr(self.driver, 'get')(self.driver_value, self.regex)
+
+
+@run_cache
+def get_input_driver(input_type):
+    """
+    Return the `InputDriver` of `input_type`, built once per run
+    """
+    return InputDriver(input_type)
+
+
+def get_input(input_type):
+    """
+    Return the value of `input_type` (site, rack, tenant...) as guessed by
+    its driver, evaluated once per run
+    """
+    return get_input_driver(input_type).get()
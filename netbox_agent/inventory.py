@@ -1,15 +1,15 @@
 from netbox_agent.config import config
 from netbox_agent.config import netbox_instance as nb
 from netbox_agent.lshw import LSHW
-from netbox_agent.misc import get_vendor, is_tool
-from netbox_agent.raid.hp import HPRaid
-from netbox_agent.raid.omreport import OmreportRaid
-from netbox_agent.raid.storcli import StorcliRaid
+from netbox_agent.misc import (
+    create_netbox_tags, find_or_create_manufacturer, find_or_create_manufacturers, get_vendor,
+    is_tool, lazy_property,
+)
+from netbox_agent.state import filter_incremental
 import traceback
 import pynetbox
 import logging
 import json
-import re
 
 
 INVENTORY_TAG = {
@@ -48,59 +48,61 @@ class Inventory():
     """
 
     def __init__(self, server, update_expansion=False):
-        self.create_netbox_tags()
         self.server = server
         self.update_expansion = update_expansion
-        netbox_server = self.server.get_netbox_server(update_expansion)
-
-        self.device_id = netbox_server.id if netbox_server else None
         self.raid = None
         self.disks = []
 
-        self.lshw = LSHW()
+    # lshw, the Netbox device and the inventory tags are only looked up
+    # when needed: ie: checking the RAID cards for an expansion slot
+    # needs none of them
 
-    def create_netbox_tags(self):
-        ret = []
-        for key, tag in INVENTORY_TAG.items():
-            nb_tag = nb.extras.tags.get(
-                name=tag['name']
-            )
-            if not nb_tag:
-                nb_tag = nb.extras.tags.create(
-                    name=tag['name'],
-                    slug=tag['slug'],
-                    comments=tag['name'],
-                )
-            ret.append(nb_tag)
-        return ret
+    @lazy_property
+    def lshw(self):
+        return LSHW()
 
-    def find_or_create_manufacturer(self, name):
-        if name is None:
-            return None
+    @lazy_property
+    def device_id(self):
+        netbox_server = self.server.get_netbox_server(self.update_expansion)
+        return netbox_server.id if netbox_server else None
 
-        invalid_manufacturers = ["00CE063200CE", "00CE00B300CE", "00AD069D00AD", "00AD063200AD", "00AD00B380AD",
-                                 "00AD00B300AD", "002C0632002C", "002C04B3002C", "002C00B3002C"]
-        if name in invalid_manufacturers:
-            logging.info("{name} is an invalid manufacturer. Using None value instead.")
-            name = "None"
+    @lazy_property
+    def nb_tags(self):
+        return dict(zip(INVENTORY_TAG, create_netbox_tags([
+            dict(tag, comments=tag['name']) for tag in INVENTORY_TAG.values()
+        ])))
 
-        manufacturer = nb.dcim.manufacturers.get(
-            name=name,
-        )
-        if not manufacturer:
-            logging.info('Creating missing manufacturer {name}'.format(name=name))
-            manufacturer = nb.dcim.manufacturers.create(
-                name=name,
-                slug=re.sub('[^A-Za-z0-9]+', '-', name).lower(),
-            )
+    def create_netbox_tags(self):
+        return list(self.nb_tags.values())
 
-            logging.info('Creating missing manufacturer {name}'.format(name=name))
+    def find_or_create_manufacturer(self, name):
+        return find_or_create_manufacturer(name)
 
-        return manufacturer
+    def get_local_vendors(self):
+        """
+        Return the vendors of the items about to be synced
+        """
+        vendors = [c.get_manufacturer() for c in self.get_raid_cards(filter_cards=True)]
+        vendors += [disk.get('Vendor') for disk in self.get_hw_disks()]
+        vendors += [gpu['vendor'] for gpu in self.lshw.get_hw_linux('gpu')]
+        if self.update_expansion is False:
+            vendors.append(self.lshw.vendor)
+            vendors += [cpu['vendor'] for cpu in self.lshw.get_hw_linux('cpu')]
+            vendors += [memory['vendor'] for memory in self.lshw.memories]
+            vendors += [iface['vendor'] for iface in self.lshw.interfaces]
+        return vendors
 
     def get_netbox_inventory(self, device_id, tag):
+        device_state = getattr(self.server, 'device_state', None)
+        if device_state is not None:
+            items = device_state.take(
+                'inventory_items:{}'.format(tag), device_id, default=[]
+            )
+            if items is not None:
+                return list(items)
         try:
-            items = nb.dcim.inventory_items.filter(
+            items = filter_incremental(
+                nb.dcim.inventory_items,
                 device_id=device_id,
                 tag=tag
             )
@@ -163,7 +165,7 @@ class Inventory():
             if motherboard.get('serial') not in [x.serial for x in nb_motherboards]:
                 self.create_netbox_inventory_item(
                     device_id=self.device_id,
-                    tags=[{'name': INVENTORY_TAG['motherboard']['name']}],
+                    tags=[self.nb_tags['motherboard'].id],
                     vendor='{}'.format(motherboard.get('vendor', 'N/A')),
                     serial='{}'.format(motherboard.get('serial', 'No SN')),
                     name='{}'.format(motherboard.get('name')),
@@ -176,7 +178,7 @@ class Inventory():
             device=self.device_id,
             manufacturer=manufacturer.id,
             discovered=True,
-            tags=[{'name': INVENTORY_TAG['interface']['name']}],
+            tags=[self.nb_tags['interface'].id],
             name="{}".format(iface['product']),
             serial='{}'.format(iface['serial']),
             description='{} {}'.format(iface['description'], iface['name'])
@@ -209,7 +211,7 @@ class Inventory():
                 device=self.device_id,
                 manufacturer=manufacturer.id,
                 discovered=True,
-                tags=[{'name': INVENTORY_TAG['cpu']['name']}],
+                tags=[self.nb_tags['cpu'].id],
                 name=cpu['product'],
                 description='CPU {}'.format(cpu['location']),
                 # asset_tag=cpu['location']
@@ -232,20 +234,22 @@ class Inventory():
             self.create_netbox_cpus()
 
     def get_raid_cards(self, filter_cards=False):
-        raid_class = None
-        if self.server.manufacturer in ('Dell', 'Huawei'):
-            if is_tool('omreport'):
-                raid_class = OmreportRaid
-            if is_tool('storcli'):
-                raid_class = StorcliRaid
-        elif self.server.manufacturer == 'HP':
-            if is_tool('ssacli'):
-                raid_class = HPRaid
-
-        if not raid_class:
-            return []
-
-        self.raid = raid_class()
+        if self.raid is None:
+            # RAID backends are only imported once selected
+            raid_class = None
+            if self.server.manufacturer in ('Dell', 'Huawei'):
+                if is_tool('storcli'):
+                    from netbox_agent.raid.storcli import StorcliRaid as raid_class
+                elif is_tool('omreport'):
+                    from netbox_agent.raid.omreport import OmreportRaid as raid_class
+            elif self.server.manufacturer == 'HP':
+                if is_tool('ssacli'):
+                    from netbox_agent.raid.hp import HPRaid as raid_class
+
+            if not raid_class:
+                return []
+
+            self.raid = raid_class()
 
         if filter_cards and config.expansion_as_device \
                 and self.server.own_expansion_slot():
@@ -267,7 +271,7 @@ class Inventory():
             device=self.device_id,
             discovered=True,
             manufacturer=manufacturer.id if manufacturer else None,
-            tags=[{'name': INVENTORY_TAG['raid_card']['name']}],
+            tags=[self.nb_tags['raid_card'].id],
             name='{}'.format(name),
             serial='{}'.format(serial),
             description='RAID Card',
@@ -395,7 +399,7 @@ class Inventory():
         parms = {
             'device': self.device_id,
             'discovered': True,
-            'tags': [{'name': INVENTORY_TAG['disk']['name']}],
+            'tags': [self.nb_tags['disk'].id],
             'name': name,
             'serial': disk['SN'],
             'part_id': disk['Model'],
@@ -471,7 +475,7 @@ class Inventory():
             device=self.device_id,
             discovered=True,
             manufacturer=manufacturer.id,
-            tags=[{'name': INVENTORY_TAG['memory']['name']}],
+            tags=[self.nb_tags['memory'].id],
             name=name,
             part_id=memory['product'],
             serial=memory['serial'],
@@ -514,7 +518,7 @@ class Inventory():
                 device=self.device_id,
                 manufacturer=manufacturer.id,
                 discovered=True,
-                tags=[{'name': INVENTORY_TAG['gpu']['name']}],
+                tags=[self.nb_tags['gpu'].id],
                 name=gpu['product'],
                 description=gpu['description'],
             )
@@ -558,6 +562,9 @@ class Inventory():
     def create_or_update(self):
         if config.inventory is None or config.update_inventory is None:
             return False
+        self.create_netbox_tags()
+        # every manufacturer is then resolved in memory
+        find_or_create_manufacturers(self.get_local_vendors())
         if self.update_expansion is False:
             self.do_netbox_cpus()
             self.do_netbox_memories()
@@ -1,8 +1,9 @@
 import logging
-import subprocess
 
 from netaddr import IPNetwork
 
+from netbox_agent.command import getstatusoutput
+
 
 class IPMI():
     """
@@ -37,7 +38,7 @@ class IPMI():
     """
 
     def __init__(self):
-        self.ret, self.output = subprocess.getstatusoutput('ipmitool lan print')
+        self.ret, self.output = getstatusoutput(['ipmitool', 'lan', 'print'])
         if self.ret != 0:
             logging.error('Cannot get ipmi info: {}'.format(self.output))
 
@@ -1,6 +1,6 @@
 import logging
-import subprocess
 
+from netbox_agent.command import getoutput
 from netbox_agent.misc import is_tool
 
 
@@ -8,10 +8,10 @@ class LLDP():
     def __init__(self, output=None):
         if not is_tool('lldpctl'):
             logging.debug('lldpd package seems to be missing or daemon not running.')
-        if output:
+        if output is not None:
             self.output = output
         else:
-            self.output = subprocess.getoutput('lldpctl -f keyvalue')
+            self.output = getoutput(['lldpctl', '-f', 'keyvalue'])
         self.data = self.parse()
 
     def parse(self):
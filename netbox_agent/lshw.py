@@ -1,19 +1,24 @@
+from netbox_agent.command import getoutput, run
 from netbox_agent.misc import is_tool
-import subprocess
 import logging
 import json
+import subprocess
 import sys
 
 
 class LSHW():
+    # what is found in the output of lshw, see `to_dict`
+    FIELDS = (
+        'vendor', 'product', 'chassis_serial', 'motherboard_serial', 'motherboard',
+        'memories', 'interfaces', 'cpus', 'disks', 'gpus',
+    )
+
     def __init__(self):
         if not is_tool('lshw'):
             logging.error('lshw does not seem to be installed')
             sys.exit(1)
 
-        data = subprocess.getoutput(
-            'lshw -quiet -json'
-        )
+        data = getoutput(['lshw', '-quiet', '-json'])
         data = data.replace("\"#\\\"", "\"#\\\\\"")
         json_data = json.loads(data)
         # Starting from version 02.18, `lshw -json` wraps its result in a list
@@ -37,6 +42,26 @@ class LSHW():
 
         self.find_inventory_items(self.hw_info)
 
+    def to_dict(self):
+        """
+        Return the hardware found, as JSON serializable values
+        """
+        return dict((name, getattr(self, name)) for name in self.FIELDS)
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Return the `LSHW` of the hardware found by `to_dict()`, without
+        running lshw
+        """
+        lshw = cls.__new__(cls)
+        lshw.hw_info = None
+        lshw.info = {}
+        lshw.power = []
+        for name in cls.FIELDS:
+            setattr(lshw, name, values[name])
+        return lshw
+
     def get_hw_linux(self, hwclass):
         if hwclass == "cpu":
             return self.cpus
@@ -92,9 +117,7 @@ class LSHW():
                 return
             try:
                 nvme = json.loads(
-                    subprocess.check_output(
-                        ["nvme", '-list', '-o', 'json'],
-                        encoding='utf8')
+                    run(["nvme", '-list', '-o', 'json'], stderr=subprocess.PIPE).check().output
                 )
                 for device in nvme["Devices"]:
                     d = {
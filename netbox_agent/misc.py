@@ -1,8 +1,10 @@
+from netbox_agent.cache import register, run_cache
+from netbox_agent.command import getoutput
 from netbox_agent.config import netbox_instance as nb
 from slugify import slugify
 from shutil import which
-import subprocess
 import socket
+import os
 import re
 import logging
 
@@ -12,6 +14,25 @@ def is_tool(name):
     return which(name) is not None
 
 
+class lazy_property():
+    '''
+    Like `functools.cached_property` (python 3.8+): compute the attribute
+    on first access and store it on the instance; assigning it skips the
+    computation
+    '''
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+
+@run_cache(reference=True)
 def get_device_role(role):
     device_role = nb.dcim.device_roles.get(
         name=role
@@ -26,6 +47,7 @@ def get_device_role(role):
     return device_role
 
 
+@run_cache(reference=True)
 def get_device_type(type):
     device_type = nb.dcim.device_types.get(
         model=type
@@ -41,23 +63,30 @@ def get_device_type(type):
     return device_type
 
 
-def get_device_platform(device_platform):
-    if device_platform is None:
+def get_platform_name(device_platform):
+    """
+    Return `device_platform`, or the name of the local distribution if None
+    """
+    if device_platform is not None:
+        return device_platform
+    try:
+        # Python 3.8+ moved linux_distribution() to distro
         try:
-            # Python 3.8+ moved linux_distribution() to distro
-            try:
-                import distro
-                linux_distribution = " ".join(distro.linux_distribution())
-            except ImportError:
-                import platform
-                linux_distribution = " ".join(platform.linux_distribution())
-
-            if not linux_distribution:
-                return None
-        except (ModuleNotFoundError, NameError, AttributeError):
-            return None
-    else:
-        linux_distribution = device_platform
+            import distro
+            linux_distribution = " ".join(distro.linux_distribution())
+        except ImportError:
+            import platform
+            linux_distribution = " ".join(platform.linux_distribution())
+    except (ModuleNotFoundError, NameError, AttributeError):
+        return None
+    return linux_distribution or None
+
+
+@run_cache(reference=True)
+def get_device_platform(device_platform):
+    linux_distribution = get_platform_name(device_platform)
+    if linux_distribution is None:
+        return None
 
     device_platform = nb.dcim.platforms.get(name=linux_distribution)
     if device_platform is None:
@@ -66,67 +95,244 @@ def get_device_platform(device_platform):
         )
     return device_platform
 
+
+# JEDEC manufacturer ids, as reported for DIMMs (ie: 00CE00B300CE), with
+# or without the continuation bit
+JEDEC_VENDORS = {
+    '00CE': 'Samsung',
+    '80CE': 'Samsung',
+    '00AD': 'SK Hynix',
+    '80AD': 'SK Hynix',
+    '002C': 'Micron',
+    '802C': 'Micron',
+    '0198': 'Kingston',
+    '8198': 'Kingston',
+}
+
+VENDOR_PREFIXES = dict({
+    'PERC': 'Dell',
+    'SANDISK': 'SanDisk',
+    'DELL': 'Dell',
+    'ST': 'Seagate',
+    'CRUCIAL': 'Crucial',
+    'MICRON': 'Micron',
+    'INTEL': 'Intel',
+    'SAMSUNG': 'Samsung',
+    'EH0': 'HP',
+    'HGST': 'HGST',
+    'HUH': 'HGST',
+    'MB': 'Toshiba',
+    'MC': 'Toshiba',
+    'MD': 'Toshiba',
+    'MG': 'Toshiba',
+    'WD': 'WDC'
+}, **JEDEC_VENDORS)
+
+
+class PrefixMatcher():
+    """
+    Map names to the value of their longest matching prefix, with a single
+    regex compiled once
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = dict((k.upper(), v) for k, v in prefixes.items())
+        # alternatives are tried in order: longest first
+        self.regex = re.compile('|'.join(
+            re.escape(prefix) for prefix in sorted(self.prefixes, key=len, reverse=True)
+        ))
+
+    def match(self, name):
+        m = self.regex.match(name.upper())
+        return self.prefixes[m.group()] if m else None
+
+
+_vendor_matcher = PrefixMatcher(VENDOR_PREFIXES)
+_jedec_matcher = PrefixMatcher(JEDEC_VENDORS)
+
+
 def get_vendor(name):
-    vendors = {
-        'PERC': 'Dell',
-        'SANDISK': 'SanDisk',
-        'DELL': 'Dell',
-        'ST': 'Seagate',
-        'CRUCIAL': 'Crucial',
-        'MICRON': 'Micron',
-        'INTEL': 'Intel',
-        'SAMSUNG': 'Samsung',
-        'EH0': 'HP',
-        'HGST': 'HGST',
-        'HUH': 'HGST',
-        'MB': 'Toshiba',
-        'MC': 'Toshiba',
-        'MD': 'Toshiba',
-        'MG': 'Toshiba',
-        'WD': 'WDC'
-    }
+    if name is None:
+        return None
+    return _vendor_matcher.match(name) or name
+
+
+def get_manufacturer_name(name):
+    """
+    Return the manufacturer name to use for `name`: JEDEC ids are replaced
+    by their vendor name
+    """
+    return _jedec_matcher.match(name) or name
+
+
+def get_manufacturer_slug(name):
+    return re.sub('[^A-Za-z0-9]+', '-', name).lower()
+
 
+@run_cache(reference=True)
+def get_manufacturer_index():
+    """
+    Return the Netbox manufacturers by name and by slug, fetched once per run
+    """
+    index = {'name': {}, 'slug': {}}
+    for manufacturer in nb.dcim.manufacturers.filter(brief=1):
+        index['name'][manufacturer.name] = manufacturer
+        index['slug'][manufacturer.slug] = manufacturer
+    return index
+
+
+def find_or_create_manufacturers(names):
+    """
+    Return the Netbox manufacturers for `names` by name, creating the
+    missing ones with a single bulk request
+    """
+    index = get_manufacturer_index()
+
+    def lookup(name):
+        name = get_manufacturer_name(name)
+        return index['name'].get(name) or index['slug'].get(get_manufacturer_slug(name))
+
+    missing = {}
+    for name in names:
+        if name is not None and lookup(name) is None:
+            name = get_manufacturer_name(name)
+            missing.setdefault(get_manufacturer_slug(name), {
+                'name': name,
+                'slug': get_manufacturer_slug(name),
+            })
+    if missing:
+        logging.info('Creating missing manufacturer(s) {}'.format(
+            ', '.join(sorted(m['name'] for m in missing.values()))
+        ))
+        for manufacturer in nb.dcim.manufacturers.create(list(missing.values())):
+            index['name'][manufacturer.name] = manufacturer
+            index['slug'][manufacturer.slug] = manufacturer
+    return dict((name, lookup(name)) for name in names if name is not None)
+
+
+def find_or_create_manufacturer(name):
     if name is None:
         return None
+    return find_or_create_manufacturers([name])[name]
+
 
-    for key, value in vendors.items():
-        if name.upper().startswith(key):
-            return value
-    return name
+@run_cache(reference=True)
+def get_choices(app, endpoint):
+    """
+    Return the choices of the fields of a Netbox endpoint, fetched once per
+    run, ie: `get_choices('dcim', 'interfaces')`
+    """
+    return getattr(getattr(nb, app), endpoint).choices()
 
 
 def get_hostname(config):
     if config.hostname_cmd is None:
         return '{}'.format(socket.gethostname())
-    return subprocess.getoutput(config.hostname_cmd)
+    return getoutput(config.hostname_cmd)
+
+
+# Netbox tags by name, for the run
+_netbox_tags = register({}, reference=True)
 
 
 def create_netbox_tags(tags):
-    ret = []
-    for tag in tags:
-        nb_tag = nb.extras.tags.get(
-            name=tag
-        )
-        if not nb_tag:
-            nb_tag = nb.extras.tags.create(
-                name=tag,
-                slug=slugify(tag),
-            )
-        ret.append(nb_tag)
-    return ret
+    """
+    Return the Netbox tags for `tags`, names or dicts holding at least the
+    name (and the slug, comments... to create it with), in the same order
 
+    The tags not seen yet during the run are looked up with a single
+    filter and the missing ones created with a single bulk request.
+    """
+    tags = [tag if isinstance(tag, dict) else {'name': tag} for tag in tags]
+    names = sorted(set(tag['name'] for tag in tags) - set(_netbox_tags))
+    if names:
+        for nb_tag in nb.extras.tags.filter(name=names, brief=1):
+            _netbox_tags[nb_tag.name] = nb_tag
+        missing = {}
+        for tag in tags:
+            if tag['name'] not in _netbox_tags:
+                missing.setdefault(tag['name'], dict(
+                    tag, slug=tag.get('slug') or slugify(tag['name'])
+                ))
+        if missing:
+            logging.info('Creating tag(s) {}'.format(', '.join(sorted(missing))))
+            for nb_tag in nb.extras.tags.create(list(missing.values())):
+                _netbox_tags[nb_tag.name] = nb_tag
+    return [_netbox_tags[tag['name']] for tag in tags]
 
-def get_mount_points():
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+SYS_BLOCK_PATH = '/sys/class/block'
+
+_mountinfo_escape_re = re.compile(r'\\([0-7]{3})')
+
+
+def _unescape_mountinfo(value):
+    """
+    mountinfo escapes spaces, tabs, newlines and backslashes as octal
+    sequences, ie: `/mnt/my\\040disk`
+    """
+    return _mountinfo_escape_re.sub(lambda m: chr(int(m.group(1), 8)), value)
+
+
+def get_parent_disk(device, sys_block_path=SYS_BLOCK_PATH):
+    """
+    Return the whole disk a block device belongs to, ie: `/dev/nvme0n1`
+    for `/dev/nvme0n1p1` or `/dev/sda` for `/dev/sda2`
+
+    Partitions are resolved through sysfs, where a partition's directory
+    lives under its parent disk's one. Devices which aren't partitions
+    (whole disks, device mapper volumes...) are returned as is.
+    """
+    name = os.path.basename(os.path.realpath(device))
+    block_path = os.path.join(sys_block_path, name)
+    if os.path.exists(os.path.join(block_path, 'partition')):
+        name = os.path.basename(os.path.realpath(os.path.join(block_path, '..')))
+    return '/dev/{}'.format(name)
+
+
+def parse_mountinfo(content, sys_block_path=SYS_BLOCK_PATH):
+    """
+    Parse the content of a mountinfo file and return the mount points
+    of each disk, partitions being resolved to their parent disk
+
+    Line format (see proc(5)), optional fields being ended by `-`:
+
+    36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw
+    """
     mount_points = {}
-    output = subprocess.getoutput('mount')
-    for r in output.split("\n"):
-        if not r.startswith("/dev/"):
+    parent_disks = {}
+    for line in content.splitlines():
+        fields = line.split(' ')
+        try:
+            separator = fields.index('-', 6)
+            mount_point = fields[4]
+            source = fields[separator + 2]
+        except (ValueError, IndexError):
+            continue
+        if not source.startswith('/dev/'):
             continue
-        mount_info = r.split()
-        device = mount_info[0]
-        device = re.sub(r'\d+$', '', device)
-        mp = mount_info[2]
-        mount_points.setdefault(device, []).append(mp)
-    return mount_points
+        # thousands of mounts usually share a handful of devices
+        if source not in parent_disks:
+            parent_disks[source] = get_parent_disk(source, sys_block_path)
+        mount_points.setdefault(parent_disks[source], set()).add(
+            _unescape_mountinfo(mount_point)
+        )
+    return dict((k, sorted(v)) for k, v in mount_points.items())
+
 
+@run_cache
+def get_mount_points():
+    """
+    Return the mount points of each disk of the host, ie:
+    {'/dev/sda': ['/', '/boot'], '/dev/nvme0n1': ['/data']}
 
+    Computed once per run and shared by the RAID controllers
+    """
+    try:
+        with open(MOUNTINFO_PATH, 'r') as f:
+            content = f.read()
+    except OSError as e:
+        logging.error('Cannot read mount points: {}'.format(e))
+        return {}
+    return parse_mountinfo(content)
@@ -1,16 +1,41 @@
 import logging
 import os
 import re
-from itertools import chain
+from urllib.parse import urlencode
 
 import netifaces
-from netaddr import IPAddress
+from netaddr import IPAddress, IPNetwork
 
 from netbox_agent.config import config
 from netbox_agent.config import netbox_instance as nb
 from netbox_agent.ethtool import Ethtool
 from netbox_agent.ipmi import IPMI
 from netbox_agent.lldp import LLDP
+from netbox_agent.misc import get_choices
+from netbox_agent.state import filter_incremental, get_mapped
+
+# values per multi-value filter request, keeps the URLs reasonably short
+FILTER_CHUNK_SIZE = 100
+
+# fields read from listed objects: Netbox 4.0+ only returns these, which
+# is lighter and guarantees they are read without lazy fetches
+IP_FIELDS = (
+    'id,address,role,assigned_object_type,assigned_object_id,assigned_object,last_updated'
+)
+VLAN_FIELDS = 'id,name,vid,site'
+
+
+def chunks(values, size=FILTER_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def normalize_ip(address):
+    """
+    Return `address` (ie: `2001:DB8:0::1/64`) as Netbox returns it, to
+    compare local and Netbox addresses
+    """
+    return str(IPNetwork(address))
 
 
 class Network(object):
@@ -20,11 +45,13 @@ class Network(object):
         self.server = server
         self.tenant = self.server.get_netbox_tenant()
 
-        self.lldp = LLDP() if config.network.lldp else None
+        self.lldp = self.get_lldp()
         self.nics = self.scan()
         self.ipmi = None
+        # VLANs by VID, see `prefetch_vlans`
+        self.vlans = {}
         self.dcim_choices = {}
-        dcim_c = nb.dcim.interfaces.choices()
+        dcim_c = get_choices('dcim', 'interfaces')
         for _choice_type in dcim_c:
             key = 'interface:{}'.format(_choice_type)
             self.dcim_choices[key] = {}
@@ -32,7 +59,7 @@ class Network(object):
                 self.dcim_choices[key][choice['display_name']] = choice['value']
 
         self.ipam_choices = {}
-        ipam_c = nb.ipam.ip_addresses.choices()
+        ipam_c = get_choices('ipam', 'ip_addresses')
         for _choice_type in ipam_c:
             key = 'ip-address:{}'.format(_choice_type)
             self.ipam_choices[key] = {}
@@ -42,27 +69,33 @@ class Network(object):
     def get_network_type():
         return NotImplementedError
 
-    def scan(self):
+    def get_lldp(self):
+        return LLDP() if config.network.lldp else None
+
+    @staticmethod
+    def scan():
+        """
+        Return the local interfaces, doesn't contact Netbox
+        """
         nics = []
+        ignore_interfaces = re.compile(config.network.ignore_interfaces) \
+            if config.network.ignore_interfaces else None
+        ignore_ips = re.compile(config.network.ignore_ips) \
+            if config.network.ignore_ips else None
         for interface in os.listdir('/sys/class/net/'):
             # ignore if it's not a link (ie: bonding_masters etc)
             if not os.path.islink('/sys/class/net/{}'.format(interface)):
                 continue
 
-            if config.network.ignore_interfaces and \
-               re.match(config.network.ignore_interfaces, interface):
+            if ignore_interfaces and ignore_interfaces.match(interface):
                 logging.debug('Ignore interface {interface}'.format(interface=interface))
                 continue
 
             ip_addr = netifaces.ifaddresses(interface).get(netifaces.AF_INET, [])
             ip6_addr = netifaces.ifaddresses(interface).get(netifaces.AF_INET6, [])
-            if config.network.ignore_ips:
-                for i, ip in enumerate(ip_addr):
-                    if re.match(config.network.ignore_ips, ip['addr']):
-                        ip_addr.pop(i)
-                for i, ip in enumerate(ip6_addr):
-                    if re.match(config.network.ignore_ips, ip['addr']):
-                        ip6_addr.pop(i)
+            if ignore_ips:
+                ip_addr = [ip for ip in ip_addr if not ignore_ips.match(ip['addr'])]
+                ip6_addr = [ip for ip in ip6_addr if not ignore_ips.match(ip['addr'])]
 
             # netifaces returns a ipv6 netmask that netaddr does not understand.
             # this strips the netmask down to the correct format for netaddr,
@@ -120,48 +153,101 @@ class Network(object):
             nics.append(nic)
         return nics
 
-    def _set_bonding_interfaces(self):
-        bonding_nics = (x for x in self.nics if x['bonding'])
-        for nic in bonding_nics:
-            bond_int = self.get_netbox_network_card(nic)
-            logging.debug('Setting slave interface for {name}'.format(
-                name=bond_int.name
-            ))
-            for slave_int in (
-                    self.get_netbox_network_card(slave_nic)
-                    for slave_nic in self.nics
-                    if slave_nic['name'] in nic['bonding_slaves']):
-                if slave_int.lag is None or slave_int.lag.id != bond_int.id:
-                    logging.debug('Settting interface {name} as slave of {master}'.format(
-                        name=slave_int.name, master=bond_int.name
-                    ))
-                    slave_int.lag = bond_int
-                    slave_int.save()
-        else:
-            return False
-        return True
+    def _set_bonding_interfaces(self, interfaces):
+        """
+        Set the LAG of the interfaces from the local bondings, and reset it
+        on interfaces which aren't slaves anymore
+
+        `interfaces` is the index of the Netbox interfaces by name built
+        while updating them, every change is written in a single bulk PATCH.
+        """
+        lags = {}
+        for nic in self.nics:
+            if nic['bonding'] and nic['name'] in interfaces:
+                for slave in nic['bonding_slaves']:
+                    lags[slave] = interfaces[nic['name']]
+
+        updates = []
+        for name, interface in interfaces.items():
+            bond_int = lags.get(name)
+            lag_id = interface.lag.id if interface.lag is not None else None
+            if lag_id == (bond_int.id if bond_int is not None else None):
+                continue
+            if bond_int is None:
+                logging.info('Interface {name} has no LAG, resetting'.format(name=name))
+            else:
+                logging.debug('Settting interface {name} as slave of {master}'.format(
+                    name=name, master=bond_int.name
+                ))
+            updates.append({
+                'id': interface.id,
+                'lag': bond_int.id if bond_int is not None else None,
+            })
+        if updates:
+            self.nb_net.interfaces.update(updates)
+        return bool(updates)
 
     def get_network_cards(self):
         return self.nics
 
     def get_netbox_network_card(self, nic):
-        if nic['mac'] is None:
-            interface = self.nb_net.interfaces.get(
-                name=nic['name'],
-                **self.custom_arg_id
-            )
-        else:
-            interface = self.nb_net.interfaces.get(
-                mac_address=nic['mac'],
-                name=nic['name'],
-                **self.custom_arg_id
-            )
-        return interface
+        filters = dict(self.custom_arg_id, name=nic['name'])
+        if nic['mac'] is not None:
+            filters['mac_address'] = nic['mac']
+
+        # ie: device_id, checked against the interface's device
+        (device_filter, device_id), = self.custom_arg_id.items()
+        device_field = device_filter[:-len('_id')]
+
+        def check(interface):
+            device = getattr(interface, device_field, None)
+            if getattr(device, 'id', None) != device_id or interface.name != nic['name']:
+                return False
+            return nic['mac'] is None or \
+                (interface.mac_address or '').lower() == nic['mac'].lower()
+
+        return get_mapped(
+            self.nb_net.interfaces,
+            urlencode(sorted(filters.items())),
+            lookup=lambda: self.nb_net.interfaces.get(**filters),
+            check=check,
+        )
+
+    def take_device_state(self, name, default=None):
+        """
+        Return the `name` part of the device state read through GraphQL,
+        None if it isn't available and the REST API must be used
+        """
+        state = getattr(self.server, 'device_state', None)
+        if state is None or self.device is None:
+            return None
+        return state.take(name, self.device.id, default)
 
     def get_netbox_network_cards(self):
-        return self.nb_net.interfaces.filter(
-            **self.custom_arg_id
-        )
+        interfaces = self.take_device_state('interfaces')
+        if interfaces is not None:
+            return interfaces
+        return filter_incremental(self.nb_net.interfaces, **self.custom_arg_id)
+
+    def delete_stale_netbox_network_cards(self):
+        """
+        Delete the Netbox interfaces of the device which aren't present
+        locally, in a single bulk request, and return the remaining ones
+        """
+        local_nics = set(x['name'] for x in self.nics)
+        nb_nics = []
+        stale_nics = []
+        for nic in self.get_netbox_network_cards():
+            if nic.name in local_nics:
+                nb_nics.append(nic)
+            else:
+                logging.info('Deleting netbox interface {name} because not present locally'.format(
+                    name=nic.name
+                ))
+                stale_nics.append(nic)
+        if stale_nics:
+            self.nb_net.interfaces.delete(stale_nics)
+        return nb_nics
 
     def get_netbox_type_for_nic(self, nic):
         if self.get_network_type() == 'virtual':
@@ -195,18 +281,68 @@ class Network(object):
 
         return self.dcim_choices['interface:type']['Other']
 
+    def get_local_vlans(self):
+        """
+        Return the VIDs the interfaces of the host need: their own VLAN and
+        those reported by LLDP
+        """
+        vids = set()
+        for nic in self.nics:
+            if nic.get('vlan'):
+                vids.add(int(nic['vlan']))
+            if config.network.lldp:
+                lldp_vlans = self.lldp.get_switch_vlan(nic['name']) or {}
+                vids.update(int(vid) for vid in lldp_vlans if vid.isdigit())
+        return vids
+
+    def _pick_vlan(self, vlans, site):
+        # the same VID may exist in several sites, prefer the device's site
+        # then global VLANs; Netbox refuses those of other sites
+        for vlan in vlans:
+            if vlan.site is not None and vlan.site.id == site:
+                return vlan
+        for vlan in vlans:
+            if vlan.site is None:
+                return vlan
+        return None
+
+    def prefetch_vlans(self, vids):
+        """
+        Fetch the VLANs with one filter call per chunk of VIDs, create the
+        missing ones with a single bulk request and cache them for the rest
+        of the run
+        """
+        vids = sorted(set(int(vid) for vid in vids) - set(self.vlans))
+        if not vids:
+            return
+        site = getattr(getattr(self.device, 'site', None), 'id', None)
+        found = {}
+        for chunk in chunks(vids):
+            for vlan in nb.ipam.vlans.filter(vid=chunk, fields=VLAN_FIELDS):
+                found.setdefault(vlan.vid, []).append(vlan)
+        for vid, vlans in found.items():
+            vlan = self._pick_vlan(vlans, site)
+            if vlan is not None:
+                self.vlans[vid] = vlan
+
+        missing = [vid for vid in vids if vid not in self.vlans]
+        if missing:
+            logging.info('Creating VLAN(s) {}'.format(', '.join(str(vid) for vid in missing)))
+            new_vlans = []
+            for vid in missing:
+                new_vlan = {'name': 'VLAN {}'.format(vid), 'vid': vid}
+                if vid in found:
+                    # the VID only exists in other sites
+                    new_vlan['site'] = site
+                new_vlans.append(new_vlan)
+            for vlan in nb.ipam.vlans.create(new_vlans):
+                self.vlans[vlan.vid] = vlan
+
     def get_or_create_vlan(self, vlan_id):
-        # FIXME: we may need to specify the site
-        # since users may have same vlan id in multiple dc
-        vlan = nb.ipam.vlans.get(
-            vid=vlan_id,
-        )
-        if vlan is None:
-            vlan = nb.ipam.vlans.create(
-                name='VLAN {}'.format(vlan_id),
-                vid=vlan_id,
-            )
-        return vlan
+        vlan_id = int(vlan_id)
+        if vlan_id not in self.vlans:
+            self.prefetch_vlans([vlan_id])
+        return self.vlans[vlan_id]
 
     def reset_vlan_on_interface(self, nic, interface):
         update = False
@@ -304,21 +440,24 @@ class Network(object):
                     logging.error("Vid {} is not an integer. Skipping vid".format(vid))
             interface.save()
 
-        # cable the interface
-        if not isinstance(self, VirtualNetwork) and config.network.lldp:
-            switch_ip = self.lldp.get_switch_ip(interface.name)
-            switch_interface = self.lldp.get_switch_port(interface.name)
-
-            if switch_ip and switch_interface:
-                nic_update, interface = self.create_or_update_cable(
-                    switch_ip, switch_interface, interface
-                )
-                if nic_update:
-                    interface.save()
         return interface
 
-    def create_or_update_netbox_ip_on_interface(self, ip, interface):
+    def get_netbox_ips(self, addresses):
+        """
+        Return the Netbox IPs matching `addresses`, grouped by normalized
+        address, fetched with one multi-value filter per chunk of addresses
+        """
+        netbox_ips = {}
+        addresses = sorted(set(normalize_ip(x) for x in addresses))
+        for chunk in chunks(addresses):
+            for netbox_ip in nb.ipam.ip_addresses.filter(address=chunk, fields=IP_FIELDS):
+                netbox_ips.setdefault(normalize_ip(netbox_ip.address), []).append(netbox_ip)
+        return netbox_ips
+
+    def create_or_update_netbox_ips(self, ips, assigned_ips=()):
         '''
+        Sync `ips`, a list of (ip, interface), with Netbox
+
         Two behaviors:
         - Anycast IP
         * If IP exists and is in Anycast, create a new Anycast one
@@ -329,113 +468,143 @@ class Network(object):
         * If IP doesn't exist, create it
         * If IP exists and isn't assigned, take it
         * If IP exists and interface is wrong, change interface
+
+        `assigned_ips` are the Netbox IPs already assigned to the device's
+        interfaces: those already on the right interface aren't looked up
+        again. Every other address is looked up at once, the changes are
+        computed in memory and written with one bulk create and one bulk
+        update.
         '''
-        netbox_ips = nb.ipam.ip_addresses.filter(
-            address=ip,
+        assigned = set(
+            (normalize_ip(x.address), x.assigned_object_id) for x in assigned_ips
         )
-        if not netbox_ips:
-            logging.info('Create new IP {ip} on {interface}'.format(
-                ip=ip, interface=interface))
-            query_params = {
-                'address': ip,
-                'status': "active",
-                'assigned_object_type': self.assigned_object_type,
-                'assigned_object_id': interface.id
-            }
+        todo = []
+        for ip, interface in ips:
+            key = (normalize_ip(ip), interface.id)
+            if key not in assigned:
+                assigned.add(key)
+                todo.append((ip, interface))
+        if not todo:
+            return
+
+        netbox_ips = self.get_netbox_ips([ip for ip, _ in todo])
+        creates = []
+        updates = {}
+        for ip, interface in todo:
+            candidates = netbox_ips.get(normalize_ip(ip))
+            if not candidates:
+                logging.info('Create new IP {ip} on {interface}'.format(
+                    ip=ip, interface=interface))
+                creates.append({
+                    'address': ip,
+                    'status': "active",
+                    'assigned_object_type': self.assigned_object_type,
+                    'assigned_object_id': interface.id,
+                })
+                continue
 
-            netbox_ip = nb.ipam.ip_addresses.create(
-                **query_params
-            )
-            return netbox_ip
-
-        netbox_ip = list(netbox_ips)[0]
-        # If IP exists in anycast
-        if netbox_ip.role and netbox_ip.role.label == 'Anycast':
-            logging.debug('IP {} is Anycast..'.format(ip))
-            unassigned_anycast_ip = [x for x in netbox_ips if x.interface is None]
-            assigned_anycast_ip = [x for x in netbox_ips if
-                                   x.interface and x.interface.id == interface.id]
-            # use the first available anycast ip
-            if len(unassigned_anycast_ip):
-                logging.info('Assigning existing Anycast IP {} to interface'.format(ip))
-                netbox_ip = unassigned_anycast_ip[0]
-                netbox_ip.interface = interface
-                netbox_ip.save()
-            # or if everything is assigned to other servers
-            elif not len(assigned_anycast_ip):
-                logging.info('Creating Anycast IP {} and assigning it to interface'.format(ip))
-                query_params = {
-                    "address": ip,
-                    "status": "active",
-                    "role": self.ipam_choices['ip-address:role']['Anycast'],
-                    "tenant": self.tenant.id if self.tenant else None,
-                    "assigned_object_type": self.assigned_object_type,
-                    "assigned_object_id": interface.id
-                }
-                netbox_ip = nb.ipam.ip_addresses.create(**query_params)
-            return netbox_ip
-        else:
-            ip_interface = getattr(netbox_ip, 'interface', None)
-            assigned_object = getattr(netbox_ip, 'assigned_object', None)
-            if not ip_interface or not assigned_object:
+            netbox_ip = candidates[0]
+            # If IP exists in anycast
+            if netbox_ip.role and netbox_ip.role.label == 'Anycast':
+                logging.debug('IP {} is Anycast..'.format(ip))
+                unassigned_anycast_ip = [
+                    x for x in candidates
+                    if x.assigned_object_id is None and x.id not in updates
+                ]
+                # use the first available anycast ip
+                if len(unassigned_anycast_ip):
+                    logging.info('Assigning existing Anycast IP {} to interface'.format(ip))
+                    netbox_ip = unassigned_anycast_ip[0]
+                # or if everything is assigned to other servers
+                else:
+                    logging.info(
+                        'Creating Anycast IP {} and assigning it to interface'.format(ip)
+                    )
+                    creates.append({
+                        "address": ip,
+                        "status": "active",
+                        "role": self.ipam_choices['ip-address:role']['Anycast'],
+                        "tenant": self.tenant.id if self.tenant else None,
+                        "assigned_object_type": self.assigned_object_type,
+                        "assigned_object_id": interface.id,
+                    })
+                    continue
+            elif netbox_ip.assigned_object_id is None:
                 logging.info('Assigning existing IP {ip} to {interface}'.format(
                     ip=ip, interface=interface))
-            elif (ip_interface and ip_interface.id != interface.id) or \
-                 (assigned_object and assigned_object_id != interface.id):
-
-                old_interface = getattr(netbox_ip, "assigned_object", "n/a")
+            else:
                 logging.info(
                     'Detected interface change for ip {ip}: old interface is '
                     '{old_interface} (id: {old_id}), new interface is {new_interface} '
                     ' (id: {new_id})'
                     .format(
-                        old_interface=old_interface, new_interface=interface,
-                        old_id=netbox_ip.id, new_id=interface.id, ip=netbox_ip.address
+                        old_interface=netbox_ip.assigned_object,
+                        new_interface=interface,
+                        old_id=netbox_ip.assigned_object_id,
+                        new_id=interface.id,
+                        ip=netbox_ip.address,
                     ))
-            else:
-                return netbox_ip
 
-            netbox_ip.assigned_object_type = self.assigned_object_type
-            netbox_ip.assigned_object_id = interface.id
-            netbox_ip.save()
+            updates[netbox_ip.id] = {
+                'id': netbox_ip.id,
+                'assigned_object_type': self.assigned_object_type,
+                'assigned_object_id': interface.id,
+            }
+
+        if creates:
+            nb.ipam.ip_addresses.create(creates)
+        if updates:
+            nb.ipam.ip_addresses.update(list(updates.values()))
 
     def create_or_update_netbox_network_cards(self):
         if config.update_all is None or config.update_network is None:
             return None
         logging.debug('Creating/Updating NIC...')
 
-        # delete unknown interface
-        nb_nics = list(self.get_netbox_network_cards())
-        local_nics = [x['name'] for x in self.nics]
-        for nic in nb_nics:
-            if nic.name not in local_nics:
-                logging.info('Deleting netbox interface {name} because not present locally'.format(
-                    name=nic.name
-                ))
-                nb_nics.remove(nic)
-                nic.delete()
+        nb_nics = self.delete_stale_netbox_network_cards()
 
-        # delete IP on netbox that are not known on this server
-        if len(nb_nics):
-            netbox_ips = nb.ipam.ip_addresses.filter(
-                **{self.intf_type: [x.id for x in nb_nics]}
+        # unassign IP on netbox that are not known on this server
+        assigned_ips = []
+        netbox_ips = self.take_device_state('ip_addresses')
+        if netbox_ips is None and len(nb_nics):
+            netbox_ips = filter_incremental(
+                nb.ipam.ip_addresses, fields=IP_FIELDS, **self.custom_arg_id
             )
-
-            netbox_ips = list(netbox_ips)
-            all_local_ips = list(chain.from_iterable([
-                x['ip'] for x in self.nics if x['ip'] is not None
-            ]))
+        if netbox_ips is not None:
+            # the IPs of the device, on the remaining interfaces
+            nb_nics_ids = set(x.id for x in nb_nics)
+            netbox_ips = [x for x in netbox_ips if x.assigned_object_id in nb_nics_ids]
+            all_local_ips = set(
+                normalize_ip(ip) for x in self.nics if x['ip'] is not None for ip in x['ip']
+            )
+            unassigned = []
             for netbox_ip in netbox_ips:
-                if netbox_ip.address not in all_local_ips:
-                    logging.info('Unassigning IP {ip} from {interface}'.format(
-                        ip=netbox_ip.address, interface=netbox_ip.assigned_object))
-                    netbox_ip.assigned_object_type = None
-                    netbox_ip.assigned_object_id = None
-                    netbox_ip.save()
-
-        # update each nic
+                if normalize_ip(netbox_ip.address) in all_local_ips:
+                    assigned_ips.append(netbox_ip)
+                    continue
+                logging.info('Unassigning IP {ip} from {interface}'.format(
+                    ip=netbox_ip.address, interface=netbox_ip.assigned_object))
+                unassigned.append({
+                    'id': netbox_ip.id,
+                    'assigned_object_type': None,
+                    'assigned_object_id': None,
+                })
+            if unassigned:
+                nb.ipam.ip_addresses.update(unassigned)
+
+        self.prefetch_vlans(self.get_local_vlans())
+
+        # update each nic, IPs, cables and LAGs are synced at once afterwards
+        interfaces = {}
+        ips = []
+        links = []
+        nb_nics = dict((x.name, x) for x in nb_nics)
         for nic in self.nics:
-            interface = self.get_netbox_network_card(nic)
+            # the interfaces of the device are already fetched
+            interface = nb_nics.get(nic['name'])
+            if interface is None or nic['mac'] and \
+               (interface.mac_address or '').lower() != nic['mac'].lower():
+                interface = self.get_netbox_network_card(nic)
             if not interface:
                 logging.info('Interface {mac_address} not found, creating..'.format(
                     mac_address=nic['mac'])
@@ -460,24 +629,12 @@ class Network(object):
                     interface.type = _type
                     nic_update += 1
 
-            if hasattr(interface, 'lag') and interface.lag is not None:
-                local_lag_int = next(
-                    item for item in self.nics if item['name'] == interface.lag.name
-                )
-                if nic['name'] not in local_lag_int['bonding_slaves']:
-                    logging.info('Interface has no LAG, resetting')
-                    nic_update += 1
-                    interface.lag = None
-
-            # cable the interface
+            # cable the interface, cables are synced at once afterwards
             if not isinstance(self, VirtualNetwork) and config.network.lldp:
                 switch_ip = self.lldp.get_switch_ip(interface.name)
                 switch_interface = self.lldp.get_switch_port(interface.name)
                 if switch_ip and switch_interface:
-                    ret, interface = self.create_or_update_cable(
-                        switch_ip, switch_interface, interface
-                    )
-                    nic_update += ret
+                    links.append((interface, switch_ip, switch_interface))
 
             if nic['ip']:
                 # sync local IPs
@@ -486,11 +643,18 @@ class Network(object):
                         logging.error("IP {IP} is invalid. Skipping".format(IP=ip))
                         continue
 
-                    self.create_or_update_netbox_ip_on_interface(ip, interface)
+                    ips.append((ip, interface))
             if nic_update > 0:
                 interface.save()
+            interfaces[nic['name']] = interface
 
-        self._set_bonding_interfaces()
+        self.create_or_update_netbox_ips(ips, assigned_ips)
+        if links:
+            self.create_or_update_cables(links)
+
+        # virtual machine interfaces have no LAG
+        if not isinstance(self, VirtualNetwork):
+            self._set_bonding_interfaces(interfaces)
         logging.debug('Finished updating NIC!')
 
 
@@ -507,6 +671,8 @@ class ServerNetwork(Network):
         self.custom_arg_id = {'device_id': getattr(self.device, "id", None)}
         self.intf_type = "interface_id"
         self.assigned_object_type = "dcim.interface"
+        # switches by management IP, see `get_switches`
+        self.switches = {}
 
     def get_network_type(self):
         return 'server'
@@ -515,115 +681,136 @@ class ServerNetwork(Network):
         ipmi = IPMI().parse()
         return ipmi
 
-    def connect_interface_to_switch(self, switch_ip, switch_interface, nb_server_interface):
-        logging.info('Interface {} is not connected to switch, trying to connect..'.format(
-            nb_server_interface.name
-        ))
-        nb_mgmt_ip = nb.ipam.ip_addresses.get(
-            address=switch_ip,
-        )
-        if not nb_mgmt_ip:
-            logging.error('Switch IP {} cannot be found in Netbox'.format(switch_ip))
-            return nb_server_interface
-
-        try:
-            nb_switch = nb_mgmt_ip.assigned_object.device
-            logging.info('Found a switch in Netbox based on LLDP infos: {} (id: {})'.format(
-                switch_ip,
-                nb_switch.id
-            ))
-        except KeyError:
-            logging.error(
-                'Switch IP {} is found but not associated to a Netbox Switch Device'.format(
-                    switch_ip
-                )
-            )
-            return nb_server_interface
-
-        nb_switch_interface = nb.dcim.interfaces.get(
-            device=nb_switch,
-            name=switch_interface,
-        )
-        if nb_switch_interface is None:
-            logging.error('Switch interface {} cannot be found'.format(switch_interface))
-            return nb_server_interface
-
-        logging.info('Found interface {} on switch {}'.format(
-            switch_interface,
-            switch_ip,
-        ))
-        cable = nb.dcim.cables.create(
-            termination_a_id=nb_server_interface.id,
-            termination_a_type="dcim.interface",
-            termination_b_id=nb_switch_interface.id,
-            termination_b_type="dcim.interface",
-        )
-        nb_server_interface.cable = cable
-        logging.info(
-            'Connected interface {interface} with {switch_interface} of {switch_ip}'.format(
-                interface=nb_server_interface.name,
-                switch_interface=switch_interface,
-                switch_ip=switch_ip,
-            )
-        )
-        return nb_server_interface
-
-    def create_or_update_cable(self, switch_ip, switch_interface, nb_server_interface):
-        update = False
-        if nb_server_interface.cable is None:
-            update = True
-            nb_server_interface = self.connect_interface_to_switch(
-                switch_ip, switch_interface, nb_server_interface
-            )
-        else:
-            nb_sw_int = nb_server_interface.cable.termination_b
-            nb_sw = nb_sw_int.device
-
-            try:
-                nb_mgmt_int = nb.dcim.interfaces.get(
-                    device_id=nb_sw.id,
-                    mgmt_only=True
-                )
-                nb_mgmt_ip = nb.ipam.ip_addresses.get(
-                    interface_id=nb_mgmt_int.id
-                )
-            except ValueError:
-                nb_device = nb.dcim.devices.get(
-                    name=nb_sw.name
-                )
-                nb_mgmt_ip = nb_device.primary_ip
-
+    def get_switches(self, switch_ips):
+        """
+        Return the switches by management IP, as reported by LLDP
+
+        Switches are resolved once per run, with a single lookup for all
+        the IPs not resolved yet.
+        """
+        missing = sorted(set(switch_ips) - set(self.switches))
+        nb_mgmt_ips = {}
+        for chunk in chunks(missing):
+            for nb_mgmt_ip in nb.ipam.ip_addresses.filter(address=chunk, fields=IP_FIELDS):
+                # Netbox IP is always IP/Netmask
+                nb_mgmt_ips.setdefault(nb_mgmt_ip.address.split('/')[0], nb_mgmt_ip)
+
+        for switch_ip in missing:
+            nb_switch = None
+            nb_mgmt_ip = nb_mgmt_ips.get(switch_ip)
             if nb_mgmt_ip is None:
+                logging.error('Switch IP {} cannot be found in Netbox'.format(switch_ip))
+            elif getattr(nb_mgmt_ip.assigned_object, 'device', None) is None:
                 logging.error(
-                    'Switch {switch_ip} does not have IP on its management interface'.format(
-                        switch_ip=switch_ip,
+                    'Switch IP {} is found but not associated to a Netbox Switch Device'.format(
+                        switch_ip
                     )
                 )
-                return update, nb_server_interface
+            else:
+                nb_switch = nb_mgmt_ip.assigned_object.device
+                logging.info('Found a switch in Netbox based on LLDP infos: {} (id: {})'.format(
+                    switch_ip,
+                    nb_switch.id
+                ))
+            self.switches[switch_ip] = nb_switch
+        return self.switches
+
+    def get_switch_ports(self, switch_ports):
+        """
+        Return the switch interfaces by (switch id, name) for
+        `switch_ports`, a list of (switch, name), fetched at once
+        """
+        if not switch_ports:
+            return {}
+        nb_switch_interfaces = nb.dcim.interfaces.filter(
+            device_id=sorted(set(switch.id for switch, _ in switch_ports)),
+            name=sorted(set(name for _, name in switch_ports)),
+            brief=1,
+        )
+        return dict(
+            ((x.device.id, x.name), x) for x in nb_switch_interfaces
+        )
+
+    def get_cable_peers(self):
+        """
+        Return the cable and the interface at the other end of it, by
+        interface id, for the cables of the device
+        """
+        peers = self.take_device_state('cable_peers')
+        if peers is not None:
+            return peers
+        peers = {}
+        for cable in nb.dcim.cables.filter(device_id=self.device.id):
+            if cable.termination_a_type != 'dcim.interface' or \
+               cable.termination_b_type != 'dcim.interface':
+                continue
+            peers[cable.termination_a_id] = (cable, cable.termination_b)
+            peers[cable.termination_b_id] = (cable, cable.termination_a)
+        return peers
+
+    def create_or_update_cables(self, links):
+        """
+        Cable the interfaces to the switch ports reported by LLDP
+
+        `links` is a list of (interface, switch ip, switch port). The
+        switches, their ports and the existing cables are looked up once,
+        wrong cables are deleted and missing ones created in bulk.
+        """
+        switches = self.get_switches([switch_ip for _, switch_ip, _ in links])
+        switch_ports = self.get_switch_ports([
+            (switches[switch_ip], switch_interface)
+            for _, switch_ip, switch_interface in links
+            if switches[switch_ip] is not None
+        ])
+        peers = {}
+        if any(interface.cable is not None for interface, _, _ in links):
+            peers = self.get_cable_peers()
+
+        deleted = []
+        created = []
+        for interface, switch_ip, switch_interface in links:
+            nb_switch = switches[switch_ip]
+            if nb_switch is None:
+                continue
+            nb_switch_interface = switch_ports.get((nb_switch.id, switch_interface))
+            if nb_switch_interface is None:
+                logging.error('Switch interface {} cannot be found'.format(switch_interface))
+                continue
 
-            # Netbox IP is always IP/Netmask
-            nb_mgmt_ip = nb_mgmt_ip.address.split('/')[0]
-            if nb_mgmt_ip != switch_ip or \
-               nb_sw_int.name != switch_interface:
+            if interface.cable is not None:
+                cable, nb_sw_int = peers.get(interface.id, (interface.cable, None))
+                if nb_sw_int is not None and nb_sw_int.id == nb_switch_interface.id:
+                    continue
                 logging.info('Netbox cable is not connected to correct ports, fixing..')
-                logging.info(
-                    'Deleting cable {cable_id} from {interface} to {switch_interface} of '
-                    '{switch_ip}'.format(
-                        cable_id=nb_server_interface.cable.id,
-                        interface=nb_server_interface.name,
-                        switch_interface=nb_sw_int.name,
-                        switch_ip=nb_mgmt_ip,
-                    )
-                )
-                cable = nb.dcim.cables.get(
-                    nb_server_interface.cable.id
-                )
-                cable.delete()
-                update = True
-                nb_server_interface = self.connect_interface_to_switch(
-                    switch_ip, switch_interface, nb_server_interface
+                logging.info('Deleting cable {cable_id} from {interface} to {sw_int}'.format(
+                    cable_id=cable.id,
+                    interface=interface.name,
+                    sw_int=getattr(nb_sw_int, 'name', 'n/a'),
+                ))
+                deleted.append(cable.id)
+            else:
+                logging.info('Interface {} is not connected to switch, trying to connect..'.format(
+                    interface.name
+                ))
+
+            logging.info(
+                'Connecting interface {interface} with {switch_interface} of {switch_ip}'.format(
+                    interface=interface.name,
+                    switch_interface=switch_interface,
+                    switch_ip=switch_ip,
                 )
-        return update, nb_server_interface
+            )
+            created.append({
+                'termination_a_id': interface.id,
+                'termination_a_type': 'dcim.interface',
+                'termination_b_id': nb_switch_interface.id,
+                'termination_b_type': 'dcim.interface',
+            })
+
+        if deleted:
+            nb.dcim.cables.delete(deleted)
+        if created:
+            nb.dcim.cables.create(created)
 
 
 class VirtualNetwork(Network):
@@ -637,7 +824,7 @@ class VirtualNetwork(Network):
         self.intf_type = "vminterface_id"
         self.assigned_object_type = "virtualization.vminterface"
 
-        dcim_c = nb.virtualization.interfaces.choices()
+        dcim_c = get_choices('virtualization', 'interfaces')
         for _choice_type in dcim_c:
             key = 'interface:{}'.format(_choice_type)
             self.dcim_choices[key] = {}
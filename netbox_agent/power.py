@@ -2,10 +2,46 @@ import logging
 
 import netbox_agent.dmidecode as dmidecode
 from netbox_agent.config import netbox_instance as nb
+from netbox_agent.state import filter_incremental
 
 PSU_DMI_TYPE = 39
 
 
+def get_local_power_supply(dmi):
+    """
+    Return the PSUs found by dmidecode
+    """
+    power_supply = []
+    for psu in dmidecode.get_by_type(dmi, PSU_DMI_TYPE):
+        if 'Present' not in psu['Status'] or psu['Status'] == 'Not Present':
+            continue
+
+        try:
+            max_power = int(psu.get('Max Power Capacity').split()[0])
+        except ValueError:
+            max_power = None
+        desc = '{} - {}'.format(
+            psu.get('Manufacturer', 'No Manufacturer').strip(),
+            psu.get('Name', 'No name').strip(),
+        )
+
+        sn = psu.get('Serial Number', '').strip()
+        # Let's assume that if no serial and no power reported we skip it
+        invalid_sns = ["", "Not Specified", "To Be Filled By O.E.M."]
+        if (sn in invalid_sns) and max_power is None:
+            logging.info('Skipping unknown power supply. Serial Number: {}'.format(sn))
+            continue
+        if sn == '':
+            sn = 'N/A'
+        power_supply.append({
+            'name': sn,
+            'description': desc,
+            'allocated_draw': None,
+            'maximum_draw': max_power,
+        })
+    return power_supply
+
+
 class PowerSupply():
     def __init__(self, server=None):
         self.server = server
@@ -22,123 +58,135 @@ class PowerSupply():
             self.device_id = self.netbox_server.id if self.netbox_server else None
 
     def get_power_supply(self):
-        power_supply = []
-        for psu in dmidecode.get_by_type(self.server.dmi, PSU_DMI_TYPE):
-            if 'Present' not in psu['Status'] or psu['Status'] == 'Not Present':
-                continue
+        return [
+            dict(psu, device=self.device_id) for psu in get_local_power_supply(self.server.dmi)
+        ]
 
-            try:
-                max_power = int(psu.get('Max Power Capacity').split()[0])
-            except ValueError:
-                max_power = None
-            desc = '{} - {}'.format(
-                psu.get('Manufacturer', 'No Manufacturer').strip(),
-                psu.get('Name', 'No name').strip(),
+    def get_netbox_power_supply(self):
+        device_state = getattr(self.server, 'device_state', None)
+        if device_state is not None:
+            power_ports = device_state.take('power_ports', self.device_id)
+            if power_ports is not None:
+                return power_ports
+        return filter_incremental(nb.dcim.power_ports, device_id=self.device_id)
+
+    def get_power_feeds(self):
+        """
+        Return the power feeds of the server's rack by id
+        """
+        if not self.netbox_server or not self.netbox_server.rack:
+            return {}
+        return dict(
+            (feed.id, feed) for feed in nb.dcim.power_feeds.filter(
+                rack_id=self.netbox_server.rack.id,
+                fields='id,voltage',
             )
+        )
 
-            sn = psu.get('Serial Number', '').strip()
-            # Let's assume that if no serial and no power reported we skip it
-            invalid_sns = ["", "Not Specified", "To Be Filled By O.E.M."]
-            if (sn in invalid_sns) and max_power is None:
-                logging.info('Skipping unknown power supply. Serial Number: {}'.format(sn))
-                continue
-            if sn == '':
-                sn = 'N/A'
-            power_supply.append({
-                'name': sn,
-                'description': desc,
-                'allocated_draw': None,
-                'maximum_draw': max_power,
-                'device': self.device_id,
-            })
-        return power_supply
+    def get_allocated_draws(self, psus, nb_psus):
+        """
+        Return the power drawn by each PSU, in watts, by PSU name
 
-    def get_netbox_power_supply(self):
-        return nb.dcim.power_ports.filter(
-            device_id=self.device_id
-        )
+        The consumption reported by the vendor tool is ordered like the
+        local PSUs. The voltage is the one of the power feed the port is
+        connected to, or of the rack's feeds if they all share the same,
+        230 otherwise.
+        """
+        try:
+            psu_cons = self.server.get_power_consumption()
+        except NotImplementedError:
+            logging.error('Cannot report power consumption for this vendor')
+            return {}
+        if not psu_cons:
+            return {}
+
+        feeds = self.get_power_feeds()
+        voltages = set(feed.voltage for feed in feeds.values())
+        default_voltage = voltages.pop() if len(voltages) == 1 else None
+        if default_voltage is None:
+            logging.info('Could not find power feeds for Rack, defaulting value to 230')
+            default_voltage = 230
+
+        allocated_draws = {}
+        for psu, current in zip(psus, psu_cons):
+            voltage = default_voltage
+            nb_psu = nb_psus.get(psu['name'])
+            if nb_psu is not None and \
+               getattr(nb_psu, 'connected_endpoint_type', None) == 'dcim.powerfeed':
+                feed = feeds.get(nb_psu.connected_endpoint.id)
+                if feed is not None:
+                    voltage = feed.voltage
+            allocated_draw = int(float(current) * voltage)
+            if allocated_draw < 1:
+                logging.info('PSU {} is not connected or in standby mode'.format(psu['name']))
+                continue
+            allocated_draws[psu['name']] = allocated_draw
+        return allocated_draws
 
     def create_or_update_power_supply(self):
-        nb_psus = list(self.get_netbox_power_supply())
+        """
+        Sync the PSUs of the server, and their power consumption, with the
+        power ports of the device
+
+        Ports are fetched once and matched with the local PSUs by name;
+        unknown ones are deleted, and changes written, in bulk.
+        """
+        nb_psus = dict((x.name, x) for x in self.get_netbox_power_supply())
         psus = self.get_power_supply()
+        local_names = set(x['name'] for x in psus)
 
         # Delete unknown PSU
-        delete = False
-        for nb_psu in nb_psus:
-            if nb_psu.name not in [x['name'] for x in psus]:
+        deleted = []
+        for name, nb_psu in list(nb_psus.items()):
+            if name not in local_names:
                 logging.info('Deleting unknown locally PSU {name}'.format(
                     name=nb_psu.name
                 ))
-                nb_psu.delete()
-                delete = True
+                deleted.append(nb_psu.id)
+                del nb_psus[name]
+        if deleted:
+            nb.dcim.power_ports.delete(deleted)
 
-        if delete:
-            nb_psus = self.get_netbox_power_supply()
-
-        # sync existing Netbox PSU with local infos
-        for nb_psu in nb_psus:
-            local_psu = next(
-                item for item in psus if item['name'] == nb_psu.name
-            )
-            update = False
-            if nb_psu.description != local_psu['description']:
-                update = True
-                nb_psu.description = local_psu['description']
-            if nb_psu.maximum_draw != local_psu['maximum_draw']:
-                update = True
-                nb_psu.maximum_draw = local_psu['maximum_draw']
-            if update:
-                nb_psu.save()
+        allocated_draws = self.get_allocated_draws(psus, nb_psus)
 
+        updates = []
+        creates = []
         for psu in psus:
-            if psu['name'] not in [x.name for x in nb_psus]:
+            allocated_draw = allocated_draws.get(psu['name'])
+            nb_psu = nb_psus.get(psu['name'])
+            if nb_psu is None:
                 if psu["maximum_draw"] is None or psu["maximum_draw"] >= 1:
                     logging.info('Creating PSU {name} ({description}), {maximum_draw}W'.format(
                         **psu
                     ))
-                    nb_psu = nb.dcim.power_ports.create(
-                        **psu
-                    )
+                    psu = dict(psu)
+                    if allocated_draw is not None:
+                        psu['allocated_draw'] = allocated_draw
+                    creates.append(psu)
                 else:
                     logging.error('Skipping PSU {name} ({description}), {maximum_draw}W'.format(
                         **psu
                     ))
-
-        return True
-
-    def report_power_consumption(self):
-        try:
-            psu_cons = self.server.get_power_consumption()
-        except NotImplementedError:
-            logging.error('Cannot report power consumption for this vendor')
-            return False
-        nb_psus = self.get_netbox_power_supply()
-
-        if not len(nb_psus) or not len(psu_cons):
-            return False
-
-        # find power feeds for rack or dc
-        pwr_feeds = None
-        if self.netbox_server.rack:
-            pwr_feeds = nb.dcim.power_feeds.filter(
-                rack=self.netbox_server.rack.id
-            )
-
-        if pwr_feeds:
-            voltage = [p['voltage'] for p in pwr_feeds]
-        else:
-            logging.info('Could not find power feeds for Rack, defaulting value to 230')
-            voltage = [230 for _ in nb_psus]
-
-        for i, nb_psu in enumerate(nb_psus):
-            nb_psu.allocated_draw = int(float(psu_cons[i]) * voltage[i])
-            if nb_psu.allocated_draw < 1:
-                logging.info('PSU is not connected or in standby mode')
                 continue
-            nb_psu.save()
-            logging.info('Updated power consumption for PSU {}: {}W'.format(
-                nb_psu.name,
-                nb_psu.allocated_draw,
-            ))
 
+            # sync existing Netbox PSU with local infos
+            update = {}
+            if nb_psu.description != psu['description']:
+                update['description'] = psu['description']
+            if nb_psu.maximum_draw != psu['maximum_draw']:
+                update['maximum_draw'] = psu['maximum_draw']
+            if allocated_draw is not None and nb_psu.allocated_draw != allocated_draw:
+                logging.info('Updated power consumption for PSU {}: {}W'.format(
+                    nb_psu.name,
+                    allocated_draw,
+                ))
+                update['allocated_draw'] = allocated_draw
+            if update:
+                update['id'] = nb_psu.id
+                updates.append(update)
+
+        if updates:
+            nb.dcim.power_ports.update(updates)
+        if creates:
+            nb.dcim.power_ports.create(creates)
         return True
@@ -0,0 +1,335 @@
+"""
+Push mode
+
+`netbox_agent push` syncs with Netbox the snapshots (see `snapshot.py`)
+collected on the servers by `--collect-only`: the writes of the fleet are
+centralized, and throttled, instead of every server contacting Netbox on
+its own.
+
+The snapshots are read from a directory of `.json` files, or from a file
+(`-` for stdin) holding one snapshot per line. Only the newest snapshot of
+each server is synced, so a server is never synced twice at once.
+
+A snapshot is synced by the code of the one-shot agent: the vendor's server
+class, `ServerNetwork`, `Inventory` and `PowerSupply`, their collectors
+replaced by what the snapshot holds. The scopes synced are the requested
+ones (`--update-all`, `--update-network`...), the inventory is only synced
+if the snapshot holds it. The one-shot agent syncs the snapshots it spooled
+the same way, see `spool.py`.
+
+The snapshots are spread over a pool of worker processes
+(`push.workers`). Each worker keeps its reference caches (roles, types,
+platforms, manufacturers, tags, VLANs, switches) warm from a snapshot to
+the next, and all of them share a cap on the number of concurrent Netbox
+requests (`push.max_requests`). The state store (`state.path`) is not used
+by the workers.
+"""
+import copy
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import netbox_agent.dmidecode as dmidecode
+import netbox_agent.state as state
+from netbox_agent.cli import SYNC_OPTIONS, get_host_class
+from netbox_agent.config import config, get_config, limit_concurrent_requests
+from netbox_agent.config import netbox_instance as nb
+from netbox_agent.inventory import Inventory
+from netbox_agent.lldp import LLDP
+from netbox_agent.lshw import LSHW
+from netbox_agent.misc import get_device_platform, lazy_property
+from netbox_agent.network import ServerNetwork
+from netbox_agent.raid.base import Raid, RaidController
+from netbox_agent.server import ServerBase
+from netbox_agent.snapshot import SnapshotError, loads
+
+
+class References():
+    """
+    Netbox objects shared by the servers a worker syncs
+    """
+
+    def __init__(self):
+        # by management IP, see `ServerNetwork.get_switches`
+        self.switches = {}
+        # by VID, by site: the VLAN of a VID depends on the site of the device
+        self.vlans = {}
+
+
+references = References()
+
+
+class StoredRaidController(RaidController):
+    def __init__(self, values):
+        self.values = values
+
+    def get_product_name(self):
+        return self.values['product_name']
+
+    def get_serial_number(self):
+        return self.values['serial_number']
+
+    def get_manufacturer(self):
+        return self.values['manufacturer']
+
+    def get_firmware_version(self):
+        return self.values['firmware_version']
+
+    def get_physical_disks(self):
+        return copy.deepcopy(self.values['physical_disks'])
+
+    def is_external(self):
+        return self.values['external']
+
+
+class StoredRaid(Raid):
+    def __init__(self, raid_cards):
+        self.controllers = [StoredRaidController(x) for x in raid_cards]
+
+    def get_controllers(self):
+        return self.controllers
+
+
+class SnapshotNetwork(ServerNetwork):
+    def __init__(self, server, *args, **kwargs):
+        super(SnapshotNetwork, self).__init__(server, *args, **kwargs)
+        self.switches = references.switches
+        site = getattr(getattr(self.device, 'site', None), 'id', None)
+        self.vlans = references.vlans.setdefault(site, {})
+
+    def get_lldp(self):
+        if not config.network.lldp:
+            return None
+        return LLDP(output=self.server.data['network']['lldp'] or '')
+
+    def scan(self):
+        return copy.deepcopy(self.server.data['network']['nics'])
+
+    def get_ipmi(self):
+        return copy.deepcopy(self.server.data['network']['ipmi'])
+
+
+class SnapshotInventory(Inventory):
+    def __init__(self, server, update_expansion=False):
+        super(SnapshotInventory, self).__init__(server, update_expansion=update_expansion)
+        self.lshw = LSHW.from_dict(server.data['inventory']['lshw'])
+        self.raid = StoredRaid(server.data['inventory']['raid_cards'])
+
+
+class SnapshotHost(ServerBase):
+    """
+    Server described by a snapshot, mixed in its vendor's class (see
+    `get_server`): what the collectors found is read from the snapshot
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.data = snapshot['data']
+        self.identity = self.data['identity']
+        super(SnapshotHost, self).__init__(dmi=self.data['dmi'])
+
+    @lazy_property
+    def device_platform(self):
+        platform = config.device.platform or self.identity['platform']
+        return get_device_platform(platform) if platform else None
+
+    @lazy_property
+    def network(self):
+        return SnapshotNetwork(server=self)
+
+    def get_inventory(self, update_expansion=False):
+        return SnapshotInventory(server=self, update_expansion=update_expansion)
+
+    def get_input(self, input_type):
+        return self.data['location'].get(input_type)
+
+    def get_hostname(self):
+        return self.identity['hostname']
+
+    def get_service_tag(self):
+        return self.identity['service_tag']
+
+    def get_product_name(self):
+        return self.identity['product_name']
+
+    def get_chassis(self):
+        return self.identity['chassis']
+
+    def is_blade(self):
+        return self.identity['is_blade']
+
+    def get_blade_slot(self):
+        return self.identity['blade_slot']
+
+    def get_chassis_name(self):
+        return self.identity['chassis_name']
+
+    def get_chassis_service_tag(self):
+        return self.identity['chassis_service_tag']
+
+    def own_expansion_slot(self):
+        return self.identity['own_expansion_slot']
+
+    def get_expansion_service_tag(self):
+        return self.identity['expansion_service_tag']
+
+    def get_blade_expansion_slot(self):
+        return self.identity['blade_expansion_slot']
+
+    def get_expansion_product(self):
+        return self.identity['expansion_product']
+
+    def get_power_consumption(self):
+        consumption = self.snapshot['measurements'].get('power_consumption')
+        if consumption is None:
+            raise NotImplementedError
+        return consumption
+
+
+@functools.lru_cache(maxsize=None)
+def get_snapshot_host_class(manufacturer):
+    host_class = get_host_class(manufacturer)
+    return type('Snapshot' + host_class.__name__, (SnapshotHost, host_class), {})
+
+
+def get_server(snapshot):
+    """
+    Return the server of `snapshot`, of the class of its vendor
+    """
+    chassis = dmidecode.get_by_type(snapshot['data']['dmi'], 'Chassis')
+    return get_snapshot_host_class(chassis[0].get('Manufacturer'))(snapshot)
+
+
+def read_sources(path):
+    """
+    Yield the snapshots of `path` as (name, content): the content of the
+    files of a directory is None, they are read by the workers
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.json'):
+                yield os.path.join(path, name), None
+        return
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield '{}:{}'.format(path, number), line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def read_snapshot(name, content, verify=True):
+    if content is None:
+        with open(name) as f:
+            content = f.read()
+    return loads(content, verify=verify)
+
+
+def select_snapshots(sources):
+    """
+    Return the sources of the newest snapshot of each server, and the
+    number of invalid ones
+
+    Only the serial and the date of the snapshots are kept, and their
+    hashes are checked by the workers: the parent process doesn't become
+    the bottleneck.
+    """
+    newest = {}
+    invalid = 0
+    for name, content in sources:
+        try:
+            snapshot = read_snapshot(name, content, verify=False)
+        except (OSError, SnapshotError) as e:
+            logging.error('Skipping {}: {}'.format(name, e))
+            invalid += 1
+            continue
+        serial = snapshot['data']['identity']['service_tag']
+        if serial in newest and newest[serial][0] >= snapshot['collected_at']:
+            continue
+        newest[serial] = (snapshot['collected_at'], name, content)
+    return [(name, content) for _, name, content in newest.values()], invalid
+
+
+@functools.lru_cache(maxsize=None)
+def is_netbox_supported():
+    from packaging import version
+    return version.parse(nb.version) >= version.parse('2.9')
+
+
+def get_sync_config(snapshot, scopes=None):
+    """
+    Return the options to sync `snapshot` with: the requested ones, or only
+    the `scopes` given (ie: `update_network`), the inventory only if the
+    snapshot holds it
+    """
+    sync_config = copy.copy(get_config())
+    if scopes is not None:
+        for option in SYNC_OPTIONS:
+            setattr(sync_config, option, option in scopes)
+    sync_config.inventory = config.inventory and snapshot['data']['inventory'] is not None
+    return sync_config
+
+
+def init_worker(semaphore):
+    limit_concurrent_requests(nb.http_session, semaphore)
+    # the state store would hold the objects of every server a worker
+    # syncs and is never saved, the workers would race writing it
+    config.state.path = None
+    state.get_state_store.cache_clear()
+
+
+def sync_snapshot(snapshot, scopes=None):
+    """
+    Sync `snapshot` with Netbox, see `get_sync_config` for `scopes`
+    """
+    server = get_server(snapshot)
+    server.netbox_create_or_update(get_sync_config(snapshot, scopes))
+
+
+def push_snapshot(source):
+    """
+    Sync the snapshot of `source` with Netbox, return its name and the
+    error if it failed
+    """
+    name, content = source
+    try:
+        snapshot = read_snapshot(name, content)
+        if not is_netbox_supported():
+            raise Exception('netbox-agent is not compatible with Netbox prior to verison 2.9')
+        sync_snapshot(snapshot)
+    except Exception as e:
+        logging.exception('Cannot push {}'.format(name))
+        return name, '{}: {}'.format(type(e).__name__, e)
+    return name, None
+
+
+def run(config):
+    start = time.time()
+    sources, failed = select_snapshots(read_sources(config.push.path))
+    logging.info('Pushing {} snapshot(s) with {} worker(s)'.format(
+        len(sources), config.push.workers,
+    ))
+    # created before the workers, which inherit it
+    semaphore = multiprocessing.BoundedSemaphore(config.push.max_requests)
+    pool = multiprocessing.Pool(
+        config.push.workers, initializer=init_worker, initargs=(semaphore,),
+    )
+    try:
+        for name, error in pool.imap_unordered(push_snapshot, sources):
+            if error is not None:
+                logging.error('Failed to push {}: {}'.format(name, error))
+                failed += 1
+            else:
+                logging.debug('Pushed {}'.format(name))
+    finally:
+        pool.close()
+        pool.join()
+    logging.info('Pushed {} snapshot(s), {} failed, in {:.1f}s'.format(
+        len(sources), failed, time.time() - start,
+    ))
+    return failed == 0
@@ -18,6 +18,24 @@ class RaidController():
     def is_external(self):
         return False
 
+    def to_dict(self):
+        """
+        Return what is known about the controller and its disks, as JSON
+        serializable values
+        """
+        try:
+            firmware_version = self.get_firmware_version()
+        except NotImplementedError:
+            firmware_version = None
+        return {
+            'manufacturer': self.get_manufacturer(),
+            'product_name': self.get_product_name(),
+            'serial_number': self.get_serial_number(),
+            'firmware_version': firmware_version,
+            'external': self.is_external(),
+            'physical_disks': self.get_physical_disks(),
+        }
+
 
 class Raid():
     def get_controllers(self):
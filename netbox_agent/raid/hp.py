@@ -1,7 +1,7 @@
 from netbox_agent.raid.base import Raid, RaidController
-from netbox_agent.misc import get_vendor
+from netbox_agent.misc import get_vendor, get_mount_points
+from netbox_agent.command import run
 from netbox_agent.config import config
-import subprocess
 import logging
 import re
 
@@ -13,14 +13,9 @@ class HPRaidControllerError(Exception):
 def ssacli(sub_command):
     command = ["ssacli"]
     command.extend(sub_command.split())
-    p = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    p.wait()
-    stdout = p.stdout.read().decode("utf-8")
-    if p.returncode != 0 and 'does not have any physical' not in stdout:
+    res = run(command)
+    stdout = res.output
+    if res.returncode != 0 and 'does not have any physical' not in stdout:
         mesg = "Failed to execute command '{}':\n{}".format(
             " ".join(command), stdout
         )
@@ -162,16 +157,20 @@ class HPRaidController(RaidController):
     def _get_logical_drives(self):
         lines = ssacli('ctrl slot={} ld all show detail'.format(self.data['Slot']))
         ldrives = _parse_ld_output(lines)
+        mount_points = get_mount_points()
         ret = {}
 
         for array, attrs in ldrives.items():
+            # ssacli reports partitions mount points on its own, prefer the
+            # host's view when it knows the logical drive's disk name
+            mp = mount_points.get(attrs.get('Disk Name'))
             ret[array] = {
                 'vd_array': array,
                 'vd_size': attrs['Size'],
                 'vd_consistency': attrs['Status'],
                 'vd_raid_type': 'RAID {}'.format(attrs['Fault Tolerance']),
                 'vd_device': attrs['LogicalDrive'],
-                'mount_point': attrs['Mount Points']
+                'mount_point': ', '.join(mp) if mp else attrs['Mount Points']
             }
         return ret
 
@@ -193,7 +192,7 @@ class HPRaidController(RaidController):
 
 class HPRaid(Raid):
     def __init__(self):
-        self.output = subprocess.getoutput('ssacli ctrl all show detail')
+        self.output = run(['ssacli', 'ctrl', 'all', 'show', 'detail']).output
         self.controllers = []
         self.convert_to_dict()
 
@@ -1,7 +1,7 @@
 from netbox_agent.raid.base import Raid, RaidController
 from netbox_agent.misc import get_vendor, get_mount_points
+from netbox_agent.command import run
 from netbox_agent.config import config
-import subprocess
 import logging
 import re
 
@@ -13,14 +13,9 @@ class OmreportControllerError(Exception):
 def omreport(sub_command):
     command = ["omreport"]
     command.extend(sub_command.split())
-    p = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    p.wait()
-    stdout = p.stdout.read().decode("utf-8")
-    if p.returncode != 0:
+    res = run(command)
+    stdout = res.output
+    if res.returncode != 0:
         mesg = "Failed to execute command '{}':\n{}".format(
             " ".join(command), stdout
         )
@@ -86,11 +81,11 @@ class OmreportController(RaidController):
         res = omreport('storage vdisk controller={}'.format(
             self.controller_index
         ))
+        mount_points = get_mount_points()
         for vdisk in [d for d in list(res.values())[0]]:
             vdisk_id = vdisk['ID']
             device = vdisk['Device Name']
-            mount_points = get_mount_points()
-            mp = mount_points.get(device, 'n/a')
+            mp = mount_points.get(device, ['n/a'])
             size = re.sub('B .*$', 'B', vdisk['Size'])
             vd = {
                 'vd_array': vdisk_id,
@@ -1,7 +1,7 @@
 from netbox_agent.raid.base import Raid, RaidController
 from netbox_agent.misc import get_vendor, get_mount_points
+from netbox_agent.command import CommandError, run_json
 from netbox_agent.config import config
-import subprocess
 import logging
 import json
 import re
@@ -16,24 +16,20 @@ def storecli(sub_command):
     command = ["storcli"]
     command.extend(sub_command.split())
     command.append("J")
-    p = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    p.wait()
-    stdout = p.stdout.read().decode("utf-8")
-    if p.returncode != 0:
-        mesg = "Failed to execute command '{}':\n{}".format(
-            " ".join(command), stdout
+    try:
+        res = run_json(command, items="Controllers.item")
+    except CommandError as e:
+        raise StorcliControllerError(str(e))
+    if res.returncode != 0:
+        mesg = "Failed to execute command '{}' (rc={}):\n{}".format(
+            " ".join(command), res.returncode, res.stderr or json.dumps(res.data)
         )
         raise StorcliControllerError(mesg)
-    data = json.loads(stdout)
     controllers = dict([
         (
             c['Command Status']['Controller'],
             c['Response Data']
-        ) for c in data['Controllers']
+        ) for c in res.data
         if c['Command Status']['Status'] == 'Success'
     ])
     if not controllers:
@@ -115,7 +111,7 @@ class StorcliController(RaidController):
                 wwn = vd_properties["SCSI NAA Id"]
                 wwn_path = "/dev/disk/by-id/wwn-0x{}".format(wwn)
                 device = os.path.realpath(wwn_path)
-                mp = mount_points.get(device, "n/a")
+                mp = mount_points.get(device, ["n/a"])
                 vds[pd_identifier] = {
                     "vd_array": vd_identifier,
                     "vd_size": vd_attr["Size"],
@@ -0,0 +1,321 @@
+"""
+Snapshot receiver
+
+`netbox_agent serve` receives the snapshots the agents POST (see
+`--collect-only` and `--snapshot-file`) on `/snapshots` and syncs them
+with Netbox by the code of `netbox_agent push`: the agents don't write to
+Netbox themselves anymore.
+
+- a snapshot identical (same hash) to the last one synced, or queued, for
+  the server is acknowledged and dropped
+- the snapshots of a server are coalesced: a snapshot only waits in the
+  queue for `serve.window` seconds and any newer one received meanwhile
+  replaces it
+- due snapshots are synced in batches of `serve.batch_size` by the worker
+  processes (`push.workers`), sharing the cap on the concurrent Netbox
+  requests (`push.max_requests`). Batches run one at a time, so a server
+  is never synced twice at once
+- the queue is bounded (`serve.max_pending`), snapshots are refused with
+  a 503 once it is full
+- a snapshot older than the one queued, being synced or last synced for
+  the server is dropped: a delayed or retried POST doesn't roll it back
+- a snapshot which failed to sync is queued again, for another window,
+  unless a newer one was received meanwhile; it is dropped after
+  `serve.max_attempts` attempts
+- on SIGTERM or SIGINT, the queued snapshots are synced before exiting
+
+The agents authenticate with a shared token (`serve.token`, sent by
+`--snapshot-file` as a bearer token), the receiver refuses to start
+without one: it writes to Netbox whatever it is sent.
+
+The queue depth, the counts of snapshots and the latency between the
+reception of a snapshot and its sync are exported on `/metrics`, in the
+Prometheus text format.
+"""
+import collections
+import hmac
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from netbox_agent.snapshot import SnapshotError, loads
+
+# snapshots are a few hundred KB at most
+MAX_BODY_SIZE = 32 * 2 ** 20
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Receiver():
+    def __init__(self, apply, window=60, batch_size=50, max_pending=10000, max_attempts=3):
+        """
+        `apply` syncs a batch of snapshots, a list of (name, content), and
+        returns a (name, error) for each, see `push.push_snapshot`
+        """
+        self.apply = apply
+        self.window = window
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        # snapshots waiting to be synced by serial, oldest first
+        self.pending = collections.OrderedDict()
+        # (hash, collected_at) of the snapshots being synced, and of the last
+        # synced, by serial
+        self.in_flight = {}
+        self.applied = {}
+        self.counters = collections.Counter()
+        self.latency = {'sum': 0.0, 'count': 0}
+        self.lock = threading.Lock()
+
+    def receive(self, content, now=None):
+        """
+        Queue the snapshot `content`, return `queued`, `coalesced` if it
+        replaced a queued one, `unchanged`, or `outdated` if older than the
+        queued one
+        """
+        now = now or time.time()
+        try:
+            snapshot = loads(content)
+        except SnapshotError:
+            with self.lock:
+                self.counters['invalid'] += 1
+            raise
+        serial = snapshot['data']['identity']['service_tag']
+        new_hash = snapshot['hash']
+        with self.lock:
+            self.counters['received'] += 1
+            entry = self.pending.get(serial)
+            if entry is not None:
+                last = (entry['hash'], entry['collected_at'])
+            else:
+                last = self.in_flight.get(serial, self.applied.get(serial, (None, None)))
+            if last[0] == new_hash:
+                self.counters['unchanged'] += 1
+                return 'unchanged'
+            if last[1] is not None and last[1] > snapshot['collected_at']:
+                self.counters['outdated'] += 1
+                return 'outdated'
+            if entry is not None:
+                # keeps its place and its deadline
+                entry.update(
+                    hash=new_hash,
+                    content=content,
+                    collected_at=snapshot['collected_at'],
+                    received_at=now,
+                )
+                self.counters['coalesced'] += 1
+                return 'coalesced'
+            if len(self.pending) >= self.max_pending:
+                self.counters['rejected'] += 1
+                raise QueueFull('{} snapshots are queued'.format(len(self.pending)))
+            self.pending[serial] = {
+                'hash': new_hash,
+                'content': content,
+                'collected_at': snapshot['collected_at'],
+                'queued_at': now,
+                'received_at': now,
+                'attempts': 0,
+            }
+            self.counters['queued'] += 1
+            return 'queued'
+
+    def take_batch(self, now=None):
+        """
+        Remove and return the snapshots due, by serial, at most `batch_size`
+        """
+        now = now or time.time()
+        batch = []
+        with self.lock:
+            for serial, entry in list(self.pending.items()):
+                if len(batch) >= self.batch_size or entry['queued_at'] + self.window > now:
+                    break
+                del self.pending[serial]
+                self.in_flight[serial] = (entry['hash'], entry['collected_at'])
+                batch.append((serial, entry))
+        return batch
+
+    def run_batch(self, now=None):
+        """
+        Sync a batch of due snapshots, return its size
+        """
+        now = now or time.time()
+        batch = self.take_batch(now)
+        if not batch:
+            return 0
+        try:
+            results = self.apply([(serial, entry['content']) for serial, entry in batch])
+        except Exception as e:
+            logging.exception('Cannot sync a batch of {} snapshots'.format(len(batch)))
+            results = [(serial, str(e)) for serial, _ in batch]
+        done = time.time()
+        with self.lock:
+            for (serial, entry), (_, error) in zip(batch, results):
+                del self.in_flight[serial]
+                if error is not None:
+                    logging.error('Failed to sync {}: {}'.format(serial, error))
+                    entry['attempts'] += 1
+                    # unless superseded by a newer snapshot; the queue may
+                    # then hold a few more than `max_pending`
+                    if serial not in self.pending and entry['attempts'] < self.max_attempts:
+                        entry['queued_at'] = now
+                        self.pending[serial] = entry
+                        self.counters['retried'] += 1
+                    else:
+                        self.counters['failed'] += 1
+                    continue
+                self.applied[serial] = (entry['hash'], entry['collected_at'])
+                self.counters['applied'] += 1
+                self.latency['sum'] += done - entry['received_at']
+                self.latency['count'] += 1
+        return len(batch)
+
+    def dispatch(self, stop, interval=1):
+        """
+        Sync the due snapshots until `stop` is set
+        """
+        while not stop.wait(interval):
+            while self.run_batch():
+                pass
+
+    def drain(self):
+        """
+        Sync all the queued snapshots without waiting for their window,
+        ie: before exiting
+        """
+        while self.run_batch(now=float('inf')):
+            pass
+
+    def metrics(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            oldest = next(iter(self.pending.values()), None)
+            return dict(
+                self.counters,
+                depth=len(self.pending),
+                in_flight=len(self.in_flight),
+                oldest_age=now - oldest['queued_at'] if oldest else 0,
+                latency_sum=self.latency['sum'],
+                latency_count=self.latency['count'],
+            )
+
+    def export_metrics(self, now=None):
+        """
+        Return the metrics in the Prometheus text format
+        """
+        metrics = self.metrics(now)
+        lines = []
+        for name, kind, value in [
+            ('queue_depth', 'gauge', metrics['depth']),
+            ('in_flight', 'gauge', metrics['in_flight']),
+            ('oldest_age_seconds', 'gauge', round(metrics['oldest_age'], 3)),
+            ('latency_seconds_sum', 'counter', round(metrics['latency_sum'], 3)),
+            ('latency_seconds_count', 'counter', metrics['latency_count']),
+        ]:
+            lines.append('# TYPE netbox_agent_serve_{} {}'.format(name, kind))
+            lines.append('netbox_agent_serve_{} {}'.format(name, value))
+        lines.append('# TYPE netbox_agent_serve_snapshots_total counter')
+        for result in (
+                'received', 'queued', 'coalesced', 'unchanged', 'outdated', 'invalid',
+                'rejected', 'applied', 'retried', 'failed'):
+            lines.append('netbox_agent_serve_snapshots_total{{result="{}"}} {}'.format(
+                result, metrics.get(result, 0),
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+class ReceiverServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(receiver, host, port, token):
+    expected = 'Bearer {}'.format(token).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self, status, document, content_type='application/json'):
+            payload = (
+                document if content_type == 'text/plain' else json.dumps(document)
+            ).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                return self.respond(404, {'error': 'Not found'})
+            self.respond(200, receiver.export_metrics(), content_type='text/plain')
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/snapshots':
+                return self.respond(404, {'error': 'Not found'})
+            authorization = self.headers.get('Authorization', '').encode()
+            if not hmac.compare_digest(authorization, expected):
+                return self.respond(401, {'error': 'Invalid token'})
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                return self.respond(400, {'error': 'Invalid Content-Length'})
+            if length > MAX_BODY_SIZE:
+                return self.respond(413, {'error': 'Snapshot too large'})
+            try:
+                status = receiver.receive(self.rfile.read(length).decode())
+            except (SnapshotError, UnicodeDecodeError) as e:
+                return self.respond(400, {'error': str(e)})
+            except QueueFull as e:
+                return self.respond(503, {'error': str(e)})
+            self.respond(202 if status in ('queued', 'coalesced') else 200, {'status': status})
+
+        def log_message(self, format, *args):
+            logging.debug('{} {}'.format(self.address_string(), format % args))
+
+    return ReceiverServer((host, port), Handler)
+
+
+def run(config):
+    from netbox_agent.push import init_worker, push_snapshot
+
+    if not config.serve.token:
+        raise Exception('serve.token is mandatory, the agents authenticate with it')
+
+    # the workers are forked before any thread is started
+    semaphore = multiprocessing.BoundedSemaphore(config.push.max_requests)
+    pool = multiprocessing.Pool(
+        config.push.workers, initializer=init_worker, initargs=(semaphore,),
+    )
+    receiver = Receiver(
+        apply=lambda batch: pool.map(push_snapshot, batch),
+        window=config.serve.window,
+        batch_size=config.serve.batch_size,
+        max_pending=config.serve.max_pending,
+        max_attempts=config.serve.max_attempts,
+    )
+    server = make_server(receiver, config.serve.host, config.serve.port, config.serve.token)
+    stop = threading.Event()
+    dispatcher = threading.Thread(target=receiver.dispatch, args=(stop,), daemon=True)
+    dispatcher.start()
+    # stops `serve_forever` like SIGINT does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logging.info('Receiving snapshots on {}:{}'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop.set()
+        dispatcher.join()
+        logging.info('Syncing {} queued snapshot(s) before exiting'.format(len(receiver.pending)))
+        receiver.drain()
+        pool.close()
+        pool.join()
+    return True
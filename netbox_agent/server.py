@@ -1,20 +1,30 @@
 import netbox_agent.dmidecode as dmidecode
+from netbox_agent.changeset import ChangeSet
+from netbox_agent.command import getoutput
 from netbox_agent.config import config
 from netbox_agent.config import netbox_instance as nb
-from netbox_agent.inventory import Inventory
-from netbox_agent.inputdriver import InputDriver
-from netbox_agent.misc import create_netbox_tags, get_device_role, get_device_type, get_device_platform
-from netbox_agent.network import ServerNetwork
-from netbox_agent.power import PowerSupply
+from netbox_agent.ipmi import IPMI
+from netbox_agent.inputdriver import get_input
+from netbox_agent.misc import (
+    create_netbox_tags, get_device_role, get_device_type, get_device_platform, lazy_property,
+)
+from netbox_agent.state import get_mapped
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-import subprocess
 import logging
 import socket
 import sys
 
 
+NetboxLocation = namedtuple('NetboxLocation', ['site', 'location', 'rack', 'tenant'])
+
+
 class ServerBase():
     def __init__(self, dmi=None):
+        self._netbox_location = None
+        # Netbox devices by serial, see `get_netbox_device`
+        self._netbox_devices = {}
         if dmi:
             self.dmi = dmi
         else:
@@ -31,17 +41,11 @@ class ServerBase():
         if "suncave" in self.get_hostname():
             self.system[0]['Serial Number'] = self.get_hostname()
         elif service_tag in generic_service_tags:
-            self.network = ServerNetwork(server=self)
-            self.system[0]['Serial Number'] = self.network.get_ipmi()['mac']
-
-        self.device_platform = get_device_platform(config.device.platform)
-
-        self.network = None
+            self.system[0]['Serial Number'] = IPMI().parse()['mac']
 
         self.tags = list(set([
             x.strip() for x in config.device.tags.split(',') if x.strip()
         ])) if config.device.tags else []
-        self.nb_tags = list(create_netbox_tags(self.tags))
         config_cf = set([
             f.strip() for f in config.device.custom_fields.split(",")
             if f.strip()
@@ -52,11 +56,88 @@ class ServerBase():
             [f.split("=", 1) for f in config_cf]
         ]))
 
+    # Subsystems are only built (and their modules imported), and their
+    # Netbox lookups and local collectors only run, when a run actually
+    # needs them: ie: updating the PSUs doesn't pay for lshw nor for the
+    # RAID CLIs.
+
+    @lazy_property
+    def device_platform(self):
+        return get_device_platform(config.device.platform)
+
+    @lazy_property
+    def nb_tags(self):
+        return list(create_netbox_tags(self.tags))
+
+    @lazy_property
+    def device_state(self):
+        """
+        Netbox state of the device read with a single GraphQL query, None
+        if disabled or unavailable: the REST API is used instead
+        """
+        if not config.netbox.graphql:
+            return None
+        from netbox_agent.graphql import get_device_state
+        return get_device_state(nb, self.get_service_tag())
+
+    @lazy_property
+    def network(self):
+        from netbox_agent.network import ServerNetwork
+        return ServerNetwork(server=self)
+
+    @lazy_property
+    def inventory(self):
+        return self.get_inventory()
+
+    def get_inventory(self, update_expansion=False):
+        from netbox_agent.inventory import Inventory
+        return Inventory(server=self, update_expansion=update_expansion)
+
+    @lazy_property
+    def power(self):
+        from netbox_agent.power import PowerSupply
+        return PowerSupply(server=self)
+
+    def get_input(self, input_type):
+        """
+        Return the value of `input_type` (site, rack...) for the server
+        """
+        return get_input(input_type)
+
     def get_tenant(self):
-        tenant = InputDriver("tenant")
-        return tenant.get()
+        return self.get_input("tenant")
+
+    def resolve_netbox_location(self):
+        """
+        Resolve the site, location, rack and tenant of the server in Netbox,
+        once per run
+
+        Every consumer gets the same objects instead of issuing its own
+        lookups. The tenant and the site are looked up concurrently, then
+        the location and the rack of the site.
+        """
+        if self._netbox_location is not None:
+            return self._netbox_location
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            tenant = executor.submit(self._get_netbox_tenant)
+            site = self._get_netbox_site()
+            location = executor.submit(self._get_netbox_location, site)
+            rack = executor.submit(self._find_netbox_rack, site)
+            location = location.result()
+            rack = self._get_netbox_rack(site, location, *rack.result())
+            self._netbox_location = NetboxLocation(
+                site=site,
+                location=location,
+                rack=rack,
+                tenant=tenant.result(),
+            )
+        return self._netbox_location
 
     def get_netbox_tenant(self):
+        return self.resolve_netbox_location().tenant
+
+    def _get_netbox_tenant(self):
         tenant = self.get_tenant()
         if tenant is None:
             return None
@@ -67,10 +148,12 @@ class ServerBase():
         return nb_tenant
 
     def get_site(self):
-        site = InputDriver("site")
-        return site.get()
+        return self.get_input("site")
 
     def get_netbox_site(self):
+        return self.resolve_netbox_location().site
+
+    def _get_netbox_site(self):
         site = self.get_site()
         if site is None:
             logging.error("Specifying a Site is mandatory in Netbox")
@@ -86,110 +169,81 @@ class ServerBase():
 
         return nb_site
 
-    def update_netbox_location(self, server):
-        nb_rack = self.get_netbox_rack()
-        nb_site = self.get_netbox_site()
+    def update_netbox_location(self, server, changes):
+        """
+        Stage the site, rack and location changes of `server` in `changes`;
+        the site, rack or location it leaves is deleted once the device is
+        updated if nothing else uses it
+        """
+        nb_site, nb_location, nb_rack, _ = self.resolve_netbox_location()
 
         update = False
-        if server.site != nb_site:
-            old_nb_site = server.site
-
+        if changes.set('site', nb_site.id if nb_site is not None else None):
             logging.info('Site location has changed from {} to {}, updating'.format(
-                server.site.slug,
-                nb_site.slug,
+                server.site.slug if server.site is not None else None,
+                nb_site.slug if nb_site is not None else None,
             ))
             update = True
-            server.site = nb_site
-
-            nb.dcim.devices.update([{
-                "id": server.id,
-                "site": server.site.id if server.site is not None else None
-            }])
-
-            if old_nb_site is not None:
-                old_nb_site = nb.dcim.sites.get(slug=old_nb_site.slug)
-
-                if old_nb_site.device_count == 0:
-                    logging.info("Deleting Site: {name}".format(name=old_nb_site.name))
-                    nb.dcim.sites.delete([old_nb_site.id])
-
-        if server.rack != nb_rack:
-            old_nb_rack = server.rack
+            if server.site is not None:
+                changes.after_flush(lambda old=server.site: self._netbox_delete_unused(
+                    nb.dcim.sites, old, 'Site',
+                ))
 
+        if changes.set('rack', nb_rack.id if nb_rack is not None else None):
             logging.info('Rack location has changed from {} to {}, updating'.format(
                 server.rack,
                 nb_rack,
             ))
             update = True
-            server.rack = nb_rack
-            
             if nb_rack is None:
-                server.face = None
-                server.position = None
-                
-            nb.dcim.devices.update([{
-                "id": server.id,
-                "rack": server.rack.id if server.rack is not None else None
-            }])
-
-            if old_nb_rack is not None:
-                old_nb_rack = nb.dcim.racks.get(
-                    name=old_nb_rack,
-                    site_id=old_nb_rack.site.id,
-                )
-
-                if old_nb_rack.device_count == 0:
-                    logging.info("Deleting Rack: {name}".format(name=old_nb_rack))
-                    nb.dcim.racks.delete([old_nb_rack.id])
-
-        nb_location = self.get_netbox_location()
-        if (
-            nb_rack is None
-            and server.location != nb_location
-        ):
-            old_nb_location = server.location
+                changes.set('face', None)
+                changes.set('position', None)
+            if server.rack is not None:
+                changes.after_flush(lambda old=server.rack: self._netbox_delete_unused(
+                    nb.dcim.racks, old, 'Rack',
+                ))
 
+        # a racked device lives in the rack's location
+        if nb_rack is not None:
+            nb_location = nb_rack.location
+        if changes.set('location', nb_location.id if nb_location is not None else None):
             logging.info('Location has changed from {} to {}'.format(
                 server.location.name if server.location is not None else None,
                 nb_location.name if nb_location is not None else None
             ))
-
             update = True
-            server.location = nb_location
-
-            nb.dcim.devices.update([{
-                "id": server.id,
-                "location": server.location.id if server.location is not None else None
-            }])
-
-            if old_nb_location is not None:
-                old_nb_location = nb.dcim.locations.get(
-                    name=old_nb_location,
-                    site_id=old_nb_location.site.id,
-                )
-
-                if old_nb_location.rack_count == 0 and old_nb_location.device_count == 0:
-                    logging.info("Deleting Location: {name}".format(name=old_nb_location))
-                    nb.dcim.locations.delete([old_nb_location.id])
-
-        device_type = nb.dcim.device_types.get(
-            id=server.device_type.id
-        )
+            if server.location is not None:
+                changes.after_flush(lambda old=server.location: self._netbox_delete_unused(
+                    nb.dcim.locations, old, 'Location', count_racks=True,
+                ))
 
         height = self.get_rack_height()
-        if height and device_type.u_height != height:
-            logging.info("Changing device type {name} height from {old_height} to {new_height}".format(
-                name=device_type.name,
-                old_height=device_type.u_height,
-                new_height=height
-            ))
-            nb.dcim.device_type.update([{
-                "id": device_type.id,
-                "u_height": height
-            }])
+        if height:
+            device_type = nb.dcim.device_types.get(
+                id=server.device_type.id
+            )
+            if device_type.u_height != height:
+                logging.info(
+                    "Changing device type {name} height from {old_height} to {new_height}".format(
+                        name=device_type.name,
+                        old_height=device_type.u_height,
+                        new_height=height
+                    ))
+                nb.dcim.device_types.update([{
+                    "id": device_type.id,
+                    "u_height": height
+                }])
 
+        return update
 
-        return update, server
+    def _netbox_delete_unused(self, endpoint, old, kind, count_racks=False):
+        old = endpoint.get(old.id)
+        if old is None or old.device_count:
+            return
+        if count_racks and old.rack_count:
+            return
+        logging.info("Deleting {kind}: {name}".format(kind=kind, name=old.name))
+        endpoint.delete([old.id])
 
     def update_netbox_expansion_location(self, server, expansion):
         update = False
@@ -205,12 +259,13 @@ class ServerBase():
         return update
 
     def get_location(self):
-        location = InputDriver("location")
-        return location.get()
+        return self.get_input("location")
 
     def get_netbox_location(self):
+        return self.resolve_netbox_location().location
+
+    def _get_netbox_location(self, site):
         location = self.get_location()
-        site = self.get_netbox_site()
         if not location:
             return None
         if location and not site:
@@ -235,14 +290,18 @@ class ServerBase():
         return nb_location
 
     def get_rack(self):
-        rack = InputDriver("rack")
-        return rack.get()
+        return self.get_input("rack")
 
     def get_netbox_rack(self):
+        return self.resolve_netbox_location().rack
+
+    def _find_netbox_rack(self, site):
+        """
+        Return the rack name and the matching Netbox rack, if any
+        """
         rack = self.get_rack()
-        site = self.get_netbox_site()
         if not rack:
-            return None
+            return None, None
         if rack and not site:
             logging.error("Can't get rack if no site is configured or found")
             sys.exit(1)
@@ -253,8 +312,14 @@ class ServerBase():
             name=name,
             site_id=site.id,
         )
+        return name, nb_rack
 
-        nb_location = self.get_netbox_location()
+    def _get_netbox_rack(self, site, nb_location, name, nb_rack):
+        """
+        Create the rack if it doesn't exist or move it to the server's location
+        """
+        if name is None:
+            return None
         if nb_rack is None:
             nb_rack = nb.dcim.racks.create(
                 name=name,
@@ -267,10 +332,8 @@ class ServerBase():
             logging.info("Updating Rack: name = {name}, id = {id}".format(name=nb_rack.name, id=nb_rack.id))
             nb_rack = nb.dcim.racks.update([{"id": nb_rack.id, "location": nb_location.id}])[0]
 
-            old_nb_location = nb.dcim.locations.get(
-                name=old_nb_location,
-                site_id=old_nb_location.site.id,
-            )
+            # for its device and rack counts
+            old_nb_location = nb.dcim.locations.get(old_nb_location.id)
 
             if old_nb_location.rack_count == 0 and old_nb_location.device_count == 0:
                 logging.info("Deleting Location: name = {name}, id = {id}".format(
@@ -282,15 +345,13 @@ class ServerBase():
         return nb_rack
 
     def get_position(self):
-        position = InputDriver("position")
-        return position.get()
+        return self.get_input("position")
 
     def get_face(self):
-        face = InputDriver("face")
-        return face.get()
+        return self.get_input("face")
 
     def get_rack_height(self):
-        height = InputDriver("height").get()
+        height = self.get_input("height")
 
         try:
             height = int(height)
@@ -324,7 +385,7 @@ class ServerBase():
     def get_hostname(self):
         if config.hostname_cmd is None:
             return '{}'.format(socket.gethostname())
-        return subprocess.getoutput(config.hostname_cmd)
+        return getoutput(config.hostname_cmd)
 
     def is_blade(self):
         raise NotImplementedError
@@ -374,7 +435,7 @@ class ServerBase():
             rack=rack.id if rack else None,
             position=position,
             face=face,
-            tags=[{'name': x} for x in self.tags],
+            tags=[x.id for x in self.nb_tags],
             custom_fields=self.custom_fields,
         )
         return new_chassis
@@ -401,7 +462,7 @@ class ServerBase():
             rack=rack.id if rack else None,
             position=position,
             face=face,
-            tags=[{'name': x} for x in self.tags],
+            tags=[x.id for x in self.nb_tags],
             custom_fields=self.custom_fields,
         )
         return new_blade
@@ -428,7 +489,7 @@ class ServerBase():
             rack=rack.id if rack else None,
             position=position,
             face=face,
-            tags=[{'name': x} for x in self.tags],
+            tags=[x.id for x in self.nb_tags],
         )
         return new_blade
 
@@ -470,11 +531,11 @@ class ServerBase():
             rack=rack.id if rack else None,
             position=position,
             face=face,
-            tags=[{'name': x} for x in self.tags],
+            tags=[x.id for x in self.nb_tags],
         )
         return new_server
 
-    def _netbox_update_server(self, server_id, site, tenant):
+    def _netbox_update_server(self, changes, site, tenant):
         device_role = get_device_role(config.device.server_role)
         device_type = get_device_type(self.get_product_name())
         position = self.get_position()
@@ -485,43 +546,46 @@ class ServerBase():
         hostname = self.get_hostname()
         logging.info('Updating server (serial: {serial}) {hostname}'.format(
             serial=serial, hostname=hostname))
-        new_server = nb.dcim.devices.update([{
-            "id": server_id,
-            "name": hostname,
-            "serial": serial,
-            "device_role": device_role.id,
-            "device_type": device_type.id,
-            "platform": self.device_platform,
-            "site": site.id if site else None,
-            "position": position,
-            "face": face,
-            "tenant": tenant.id if tenant else None,
-            "tags": [{'name': x} for x in self.tags]
-        }])
-        return new_server[0]
+        changes.set('name', hostname)
+        changes.set('serial', serial)
+        changes.set('device_role', device_role.id)
+        changes.set('device_type', device_type.id)
+        changes.set('site', site.id if site else None)
+        changes.set('position', position)
+        changes.set('face', face)
+        changes.set('tenant', tenant.id if tenant else None)
+
+    def get_netbox_device(self, serial):
+        """
+        Return the Netbox device `serial`, looked up once per run, and by the
+        id it had during the previous runs when the state store is enabled
+        """
+        if self._netbox_devices.get(serial) is None:
+            self._netbox_devices[serial] = get_mapped(
+                nb.dcim.devices,
+                'serial={}'.format(serial),
+                lookup=lambda: nb.dcim.devices.get(serial=serial),
+                check=lambda device: device.serial == serial,
+            )
+        return self._netbox_devices[serial]
 
     def get_netbox_server(self, expansion=False):
         if expansion is False:
-            return nb.dcim.devices.get(serial=self.get_service_tag())
+            return self.get_netbox_device(self.get_service_tag())
         else:
-            return nb.dcim.devices.get(serial=self.get_expansion_service_tag())
+            return self.get_netbox_device(self.get_expansion_service_tag())
 
     def _netbox_set_or_update_blade_slot(self, server, chassis, site):
-        # before everything check if right chassis
-        actual_device_bay = server.parent_device.device_bay \
-                if server.parent_device else None
-        actual_chassis = actual_device_bay.device \
-                if actual_device_bay else None
+        # before everything check if right chassis, the parent device
+        # holds the chassis and bay ids and names
+        actual_chassis = server.parent_device
+        actual_device_bay = actual_chassis.device_bay if actual_chassis else None
         slot = self.get_blade_slot()
         if actual_chassis and \
-           actual_chassis.serial == chassis.serial and \
+           actual_chassis.id == chassis.id and \
            actual_device_bay.name == slot:
             return
 
-        real_device_bays = nb.dcim.device_bays.filter(
-            device_id=chassis.id,
-            name=slot,
-        )
         real_device_bays = nb.dcim.device_bays.filter(
             device_id=chassis.id,
             name=slot,
@@ -534,16 +598,15 @@ class ServerBase():
                 ))
             # reset actual device bay if set
             if actual_device_bay:
-                # Forces the evaluation of the installed_device attribute to
-                # workaround a bug probably due to lazy loading optimization
-                # that prevents the value change detection
-                actual_device_bay.installed_device
-                actual_device_bay.installed_device = None
-                actual_device_bay.save()
+                nb.dcim.device_bays.update([
+                    {'id': actual_device_bay.id, 'installed_device': None},
+                ])
             # setup new device bay
             real_device_bay = next(real_device_bays)
             real_device_bay.installed_device = server
             real_device_bay.save()
+            # its parent device changed
+            self._netbox_devices.pop(server.serial, None)
         else:
             logging.error('Could not find slot {slot} for chassis'.format(
                 slot=slot
@@ -551,11 +614,11 @@ class ServerBase():
 
     def _netbox_set_or_update_blade_expansion_slot(self, expansion, chassis, site):
         # before everything check if right chassis
-        actual_device_bay = expansion.parent_device.device_bay if expansion.parent_device else None
-        actual_chassis = actual_device_bay.device if actual_device_bay else None
+        actual_chassis = expansion.parent_device
+        actual_device_bay = actual_chassis.device_bay if actual_chassis else None
         slot = self.get_blade_expansion_slot()
         if actual_chassis and \
-           actual_chassis.serial == chassis.serial and \
+           actual_chassis.id == chassis.id and \
            actual_device_bay.name == slot:
             return
 
@@ -575,16 +638,15 @@ class ServerBase():
             ))
         # reset actual device bay if set
         if actual_device_bay:
-            # Forces the evaluation of the installed_device attribute to
-            # workaround a bug probably due to lazy loading optimization
-            # that prevents the value change detection
-            actual_device_bay.installed_device
-            actual_device_bay.installed_device = None
-            actual_device_bay.save()
+            nb.dcim.device_bays.update([
+                {'id': actual_device_bay.id, 'installed_device': None},
+            ])
         # setup new device bay
         real_device_bay = next(real_device_bays)
         real_device_bay.installed_device = expansion
         real_device_bay.save()
+        # its parent device changed
+        self._netbox_devices.pop(expansion.serial, None)
 
     def netbox_create_or_update(self, config):
         """
@@ -598,102 +660,85 @@ class ServerBase():
         * Inventory management
         * PSU management
         """
-        site = self.get_netbox_site()
-        rack = self.get_netbox_rack()
-        tenant = self.get_netbox_tenant()
-
         if config.purge_old_devices:
             self._netbox_deduplicate_server()
 
+        # the location is only resolved when a device is created or moved
+        chassis = None
         if self.is_blade():
-            chassis = nb.dcim.devices.get(
-                serial=self.get_chassis_service_tag()
-            )
+            chassis = self.get_netbox_device(self.get_chassis_service_tag())
             # Chassis does not exist
             if not chassis:
+                site, _, rack, tenant = self.resolve_netbox_location()
                 chassis = self._netbox_create_chassis(site, tenant, rack)
 
-            server = nb.dcim.devices.get(serial=self.get_service_tag())
+            server = self.get_netbox_server()
             if not server:
+                site, _, rack, tenant = self.resolve_netbox_location()
                 server = self._netbox_create_blade(chassis, site, tenant, rack)
+                self._netbox_devices[server.serial] = server
 
             # Set slot for blade
-            self._netbox_set_or_update_blade_slot(server, chassis, site)
+            self._netbox_set_or_update_blade_slot(server, chassis, server.site)
         else:
-            server = nb.dcim.devices.get(serial=self.get_service_tag())
+            server = self.get_netbox_server()
             if not server:
+                site, _, rack, tenant = self.resolve_netbox_location()
                 server = self._netbox_create_server(site, tenant, rack)
-
+                self._netbox_devices[server.serial] = server
 
         logging.debug('Updating Server...')
         # check network cards
         if config.register or config.update_all or config.update_network:
-            self.network = ServerNetwork(server=self)
             self.network.create_or_update_netbox_network_cards()
         update_inventory = config.inventory and (config.register or
                 config.update_all or config.update_inventory)
         # update inventory if feature is enabled
-        self.inventory = Inventory(server=self)
         if update_inventory:
             self.inventory.create_or_update()
         # update psu
         if config.register or config.update_all or config.update_psu:
-            self.power = PowerSupply(server=self)
             self.power.create_or_update_power_supply()
-            self.power.report_power_consumption()
-
-        expansion = nb.dcim.devices.get(serial=self.get_expansion_service_tag())
-        if self.own_expansion_slot() and config.expansion_as_device:
-            logging.debug('Update Server expansion...')
-            if not expansion:
-                expansion = self._netbox_create_blade_expansion(chassis, site, tenant, rack)
-
-            # set slot for blade expansion
-            self._netbox_set_or_update_blade_expansion_slot(expansion, chassis, site)
-            if update_inventory:
-                # Updates expansion inventory
-                inventory = Inventory(server=self, update_expansion=True)
-                inventory.create_or_update()
-        elif self.own_expansion_slot() and expansion:
-            expansion.delete()
-            expansion = None
-
-        update = 0
-        # for every other specs
-        # check hostname
-        if server.name != self.get_hostname():
-            server.name = self.get_hostname()
-            update += 1
-
-        server_tags = sorted(set([x.name for x in server.tags]))
-        tags = sorted(set(self.tags))
-        if server_tags != tags:
-            new_tags_ids = [x.id for x in self.nb_tags]
-            if not config.preserve_tags:
-                server.tags = new_tags_ids
-            else:
-                server_tags_ids = [x.id for x in server.tags]
-                server.tags = sorted(set(new_tags_ids + server_tags_ids))
-            update += 1
 
-        if server.custom_fields != self.custom_fields:
-            server.custom_fields = self.custom_fields
-            update += 1
+        expansion = None
+        if self.own_expansion_slot():
+            expansion = self.get_netbox_server(expansion=True)
+            if config.expansion_as_device:
+                logging.debug('Update Server expansion...')
+                if not expansion:
+                    site, _, rack, tenant = self.resolve_netbox_location()
+                    expansion = self._netbox_create_blade_expansion(chassis, site, tenant, rack)
+
+                # set slot for blade expansion
+                self._netbox_set_or_update_blade_expansion_slot(expansion, chassis, server.site)
+                if update_inventory:
+                    # Updates expansion inventory
+                    self.get_inventory(update_expansion=True).create_or_update()
+            elif expansion:
+                expansion.delete()
+                expansion = None
+
+        # every change to the device is written in a single PATCH
+        changes = ChangeSet(nb.dcim.devices, server)
+        changes.set('name', self.get_hostname())
+
+        tags_ids = [x.id for x in self.nb_tags]
+        if config.preserve_tags:
+            tags_ids += [x.id for x in server.tags]
+        changes.set('tags', sorted(set(tags_ids)))
+
+        changes.set_custom_fields(self.custom_fields)
 
         if config.update_all or config.update_location:
-            ret, server = self.update_netbox_location(server)
-            update += ret
+            self.update_netbox_location(server, changes)
 
         if config.update_all:
-            server = self._netbox_update_server(server.id, site, tenant)
-            update += True
-
-        if server.platform != self.device_platform:
-            server.platform = self.device_platform
-            update += 1
+            site, _, _, tenant = self.resolve_netbox_location()
+            self._netbox_update_server(changes, site, tenant)
 
-        if update:
-            server.save()
+        changes.set('platform', self.device_platform.id if self.device_platform else None)
+        server = changes.flush()
+        self._netbox_devices[server.serial] = server
 
         if expansion:
             update = 0
@@ -708,7 +753,6 @@ class ServerBase():
         logging.debug('Finished updating Server!')
 
     def print_debug(self):
-        self.network = ServerNetwork(server=self)
         print('Site:', self.get_site())
         print('Netbox Site:', self.get_netbox_site())
         print('Rack:', self.get_rack())
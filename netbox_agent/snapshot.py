@@ -0,0 +1,259 @@
+"""
+Snapshots
+
+`--collect-only` runs the collectors (dmidecode, ipmitool, lldpctl, the
+network interfaces, lshw, the RAID CLIs, the vendor tools...) without
+contacting Netbox and writes what they found to a snapshot, a compact
+JSON document:
+
+    {
+      "schema": "netbox-agent/snapshot",
+      "version": 1,
+      "agent_version": "0.7.1",        # null if unknown
+      "collected_at": 1700000000.0,    # unix time
+      "hash": "sha256:...",            # of the canonical JSON of `data`
+      "data": {
+        "manufacturer": "Dell",        # as the vendor module names it
+        "dmi": [...],                  # dmidecode, the service tag fixed up
+        "identity": {
+          "hostname": "...", "service_tag": "...", "product_name": "...",
+          "platform": "...",           # `device.platform` or the distribution
+          "chassis": "...", "is_blade": false, "own_expansion_slot": false,
+          # of blades, null otherwise
+          "blade_slot": "...", "chassis_name": "...", "chassis_service_tag": "...",
+          # of servers owning an expansion slot, null otherwise
+          "expansion_service_tag": "...", "blade_expansion_slot": "...",
+          "expansion_product": "..."
+        },
+        "location": {                  # as guessed by the input drivers
+          "tenant": ..., "site": ..., "location": ..., "rack": ...,
+          "position": ..., "face": ..., "height": ...
+        },
+        "network": {
+          "nics": [...],               # local interfaces, see `Network.scan`
+          "ipmi": {...},               # empty if unavailable
+          "lldp": "..."                # `lldpctl -f keyvalue` but the ages,
+                                       # null if disabled
+        },
+        "inventory": {                 # null if the inventory is disabled
+          "lshw": {...},               # see `LSHW.to_dict`
+          "raid_cards": [...]          # see `RaidController.to_dict`
+        },
+        "power": {
+          "psus": [...]                # see `get_local_power_supply`
+        }
+      },
+      "measurements": {                # not hashed
+        "power_consumption": [...]     # amperage by PSU, null if unsupported
+      }
+    }
+
+The hash only covers `data`: two snapshots of a machine which didn't change
+have the same hash. What changes on every run (the power consumption) is
+kept apart, in `measurements`, so a snapshot differing only by them counts
+as unchanged (ie: `netbox_agent serve` drops it). The age of the LLDP
+neighbors, which the sync doesn't read, isn't kept at all. A new version of the
+schema bumps `version`.
+
+Snapshots are synced with Netbox by `netbox_agent push`, see `push.py`, or
+POSTed to `netbox_agent serve`, see `serve.py`.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from netbox_agent.config import config
+
+SCHEMA = 'netbox-agent/snapshot'
+SNAPSHOT_VERSION = 1
+
+LOCATION_INPUTS = ('tenant', 'site', 'location', 'rack', 'position', 'face', 'height')
+
+# `lldp.<interface>.age=...` lines of `lldpctl -f keyvalue`, changing every second
+LLDP_AGE = re.compile(r'^lldp\.[^=\n]+\.age=.*(\n|$)', re.MULTILINE)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def call(method):
+    """
+    Return what `method` returns, None if the vendor doesn't implement it
+    """
+    try:
+        return method()
+    except NotImplementedError:
+        return None
+
+
+def collect_identity(server):
+    from netbox_agent.misc import get_platform_name
+
+    identity = {
+        'hostname': server.get_hostname(),
+        'service_tag': server.get_service_tag(),
+        'product_name': server.get_product_name(),
+        'platform': get_platform_name(config.device.platform),
+        'chassis': call(server.get_chassis),
+        'is_blade': bool(call(server.is_blade)),
+        'own_expansion_slot': bool(server.own_expansion_slot()),
+        'blade_slot': None,
+        'chassis_name': None,
+        'chassis_service_tag': None,
+        'expansion_service_tag': None,
+        'blade_expansion_slot': None,
+        'expansion_product': None,
+    }
+    # only what the sync reads for the kind of server
+    if identity['is_blade']:
+        identity['blade_slot'] = call(server.get_blade_slot)
+        identity['chassis_name'] = call(server.get_chassis_name)
+        identity['chassis_service_tag'] = call(server.get_chassis_service_tag)
+    if identity['own_expansion_slot']:
+        identity['expansion_service_tag'] = server.get_expansion_service_tag()
+        identity['blade_expansion_slot'] = call(server.get_blade_expansion_slot)
+        identity['expansion_product'] = call(server.get_expansion_product)
+    return identity
+
+
+def collect_network(server):
+    from netbox_agent.ipmi import IPMI
+    from netbox_agent.lldp import LLDP
+    from netbox_agent.network import Network
+
+    lldp = None
+    if config.network.lldp:
+        lldp = LLDP_AGE.sub('', LLDP().output)
+    return {
+        'nics': Network.scan(),
+        'ipmi': IPMI().parse(),
+        'lldp': lldp,
+    }
+
+
+def collect_inventory(server):
+    if not config.inventory:
+        return None
+    return {
+        'lshw': server.inventory.lshw.to_dict(),
+        'raid_cards': [x.to_dict() for x in server.inventory.get_raid_cards()],
+    }
+
+
+def collect_power(server):
+    from netbox_agent.power import get_local_power_supply
+
+    return {
+        'psus': get_local_power_supply(server.dmi),
+    }
+
+
+def collect_measurements(server):
+    return {
+        'power_consumption': call(server.get_power_consumption),
+    }
+
+
+def collect(server):
+    """
+    Return the `data` of the snapshot of `server`
+    """
+    return {
+        'manufacturer': server.manufacturer,
+        'dmi': server.dmi,
+        'identity': collect_identity(server),
+        'location': dict((x, server.get_input(x)) for x in LOCATION_INPUTS),
+        'network': collect_network(server),
+        'inventory': collect_inventory(server),
+        'power': collect_power(server),
+    }
+
+
+def get_hash(data):
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return 'sha256:' + hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def build(data, now=None, measurements=None):
+    """
+    Return the snapshot of the collected `data` and `measurements`
+    """
+    import netbox_agent
+
+    return {
+        'schema': SCHEMA,
+        'version': SNAPSHOT_VERSION,
+        'agent_version': getattr(netbox_agent, '__version__', None),
+        'collected_at': now or time.time(),
+        'hash': get_hash(data),
+        'data': data,
+        'measurements': measurements or {},
+    }
+
+
+def dumps(snapshot):
+    return json.dumps(snapshot, separators=(',', ':'), default=str)
+
+
+def loads(content, verify=True):
+    """
+    Parse and check a snapshot: its schema, the serial and the date the
+    sync and the receivers read, its hash too unless not `verify`
+    """
+    try:
+        snapshot = json.loads(content)
+    except ValueError as e:
+        raise SnapshotError('Invalid snapshot: {}'.format(e))
+    if not isinstance(snapshot, dict) or snapshot.get('schema') != SCHEMA:
+        raise SnapshotError('Not a netbox-agent snapshot')
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError('Unsupported snapshot version {}'.format(snapshot.get('version')))
+    identity = (snapshot.get('data') or {}).get('identity') or {}
+    if not isinstance(identity.get('service_tag'), str) or not identity['service_tag']:
+        raise SnapshotError('Snapshot without a service tag')
+    if not isinstance(snapshot.get('collected_at'), (int, float)):
+        raise SnapshotError('Snapshot without a collection date')
+    if verify and snapshot.get('hash') != get_hash(snapshot.get('data')):
+        raise SnapshotError('Snapshot hash mismatch, the snapshot is corrupted')
+    if not isinstance(snapshot.setdefault('measurements', {}), dict):
+        raise SnapshotError('Invalid snapshot measurements')
+    return snapshot
+
+
+def write(snapshot, path=None, token=None):
+    """
+    Write `snapshot` to `path`, atomically, or to stdout if None or `-`,
+    or POST it with the bearer `token` if `path` is an URL (ie: to
+    `netbox_agent serve`)
+    """
+    from netbox_agent.spool import write_atomic
+
+    content = dumps(snapshot)
+    if path is None or path == '-':
+        sys.stdout.write(content + '\n')
+        return
+    if path.startswith(('http://', 'https://')):
+        import requests
+
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+        resp = requests.post(path, data=content, headers=headers, timeout=60)
+        resp.raise_for_status()
+        logging.info('Snapshot {}: {}'.format(snapshot['hash'], resp.json().get('status')))
+        return
+    write_atomic(os.path.abspath(path), content)
+
+
+def collect_only(server, config):
+    """
+    Write the snapshot of `server` without contacting Netbox
+    """
+    snapshot = build(collect(server), measurements=collect_measurements(server))
+    write(snapshot, config.snapshot_file, token=config.serve.token)
+    return snapshot
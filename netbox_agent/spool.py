@@ -0,0 +1,219 @@
+"""
+Offline spool
+
+When Netbox is unreachable (connection errors, timeouts, 5xx, or an error
+page instead of the API), the scopes the run was meant to sync (network,
+inventory...) are written to a local on-disk queue (`spool.path`) instead
+of being forgotten by the next runs, along with the snapshot of what was
+collected (see `snapshot.py`).
+
+The queue holds one entry per scope, a newer entry replacing the older one
+but keeping when the scope was first queued, and the newest snapshot of
+the server. The snapshots are bounded by `spool.max_size` bytes, the
+oldest being dropped. A run replaying the queue syncs the spooled snapshot
+by the code of `netbox_agent push` for the queued scopes it doesn't sync
+itself: what was collected while Netbox was unreachable reaches it. The
+scopes are replayed on the live server when no snapshot could be spooled
+(ie: for virtual machines).
+
+Retries are spaced with an exponential, randomized, backoff shared by the
+entries: while it runs, new runs queue their scopes instead of contacting
+Netbox, so agents don't all retry at once when Netbox comes back. Once a
+run succeeds, the queued scopes it synced are removed.
+
+The depth and age of the queue are logged and, with `spool.metrics_file`,
+exported in the Prometheus text format (ie: for the node exporter's
+textfile collector).
+"""
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+
+SUFFIX = '.json'
+SNAPSHOTS = 'snapshots'
+
+
+def is_unreachable(error):
+    """
+    Return True if `error` means Netbox couldn't be reached or is failing,
+    rather than rejecting a request
+    """
+    import pynetbox
+    import requests
+
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, pynetbox.RequestError):
+        return error.req.status_code >= 500
+    # ie: the maintenance page of a proxy
+    return isinstance(error, pynetbox.ContentError)
+
+
+def write_atomic(path, content):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class Spool():
+    def __init__(self, path, backoff=60, max_backoff=3600, max_size=64 * 2 ** 20):
+        self.path = path
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_size = max_size
+        self.snapshots_path = os.path.join(path, SNAPSHOTS)
+        os.makedirs(self.snapshots_path, exist_ok=True)
+
+    def _entry_path(self, scope):
+        return os.path.join(self.path, scope + SUFFIX)
+
+    def _snapshot_path(self, serial):
+        return os.path.join(self.snapshots_path, re.sub(r'[^\w.-]', '_', serial) + SUFFIX)
+
+    def entries(self):
+        """
+        Return the queued entries, oldest first
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning('Dropping unreadable spool entry {}: {}'.format(name, e))
+                os.unlink(os.path.join(self.path, name))
+        return sorted(entries, key=lambda x: x['queued_at'])
+
+    def retry_at(self):
+        """
+        Return when the queued entries can be retried, None if the queue
+        is empty
+        """
+        return max((x['retry_at'] for x in self.entries()), default=None)
+
+    def is_due(self, now=None):
+        retry_at = self.retry_at()
+        return retry_at is not None and retry_at <= (now or time.time())
+
+    def put(self, scope, now=None):
+        """
+        Queue `scope`, replacing its previous entry
+        """
+        now = now or time.time()
+        previous = next((x for x in self.entries() if x['scope'] == scope), None)
+        entry = {
+            'scope': scope,
+            'queued_at': previous['queued_at'] if previous else now,
+            'updated_at': now,
+            'attempts': previous['attempts'] if previous else 0,
+            'retry_at': previous['retry_at'] if previous else now,
+        }
+        write_atomic(self._entry_path(scope), json.dumps(entry))
+
+    def remove(self, scope):
+        try:
+            os.unlink(self._entry_path(scope))
+        except FileNotFoundError:
+            pass
+
+    def put_snapshot(self, snapshot):
+        """
+        Spool `snapshot`, replacing the previous one of the server, and drop
+        the oldest snapshots beyond `max_size` bytes
+        """
+        from netbox_agent.snapshot import dumps
+
+        content = dumps(snapshot)
+        if len(content) > self.max_size:
+            logging.warning('Not spooling a snapshot of {} bytes, over spool.max_size'.format(
+                len(content),
+            ))
+            return
+        write_atomic(self._snapshot_path(snapshot['data']['identity']['service_tag']), content)
+        paths = [
+            os.path.join(self.snapshots_path, x) for x in os.listdir(self.snapshots_path)
+            if x.endswith(SUFFIX)
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        size = 0
+        for path in paths:
+            size += os.path.getsize(path)
+            if size > self.max_size:
+                logging.warning('Dropping spooled snapshot {}, over spool.max_size'.format(path))
+                os.unlink(path)
+
+    def snapshots(self):
+        """
+        Return the spooled snapshots, oldest first
+        """
+        from netbox_agent.snapshot import SnapshotError, loads
+
+        snapshots = []
+        for name in os.listdir(self.snapshots_path):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.snapshots_path, name)
+            try:
+                with open(path) as f:
+                    snapshots.append(loads(f.read()))
+            except (OSError, SnapshotError) as e:
+                logging.warning('Dropping unreadable spooled snapshot {}: {}'.format(name, e))
+                os.unlink(path)
+        return sorted(snapshots, key=lambda x: x['collected_at'])
+
+    def remove_snapshots(self):
+        for name in os.listdir(self.snapshots_path):
+            if name.endswith(SUFFIX):
+                os.unlink(os.path.join(self.snapshots_path, name))
+
+    def failed(self, now=None):
+        """
+        Delay the next attempt of every entry: the delay doubles with each
+        failed attempt, up to `max_backoff`, randomized by up to 50%
+        """
+        now = now or time.time()
+        for entry in self.entries():
+            entry['attempts'] += 1
+            delay = min(self.backoff * 2 ** (entry['attempts'] - 1), self.max_backoff)
+            entry['retry_at'] = now + delay * random.uniform(0.5, 1)
+            write_atomic(self._entry_path(entry['scope']), json.dumps(entry))
+
+    def metrics(self, now=None):
+        """
+        Return counters about the queue
+        """
+        now = now or time.time()
+        entries = self.entries()
+        return {
+            'depth': len(entries),
+            'oldest_age': now - entries[0]['queued_at'] if entries else 0,
+            'attempts': max((x['attempts'] for x in entries), default=0),
+            'retry_in': max(0, max((x['retry_at'] for x in entries), default=now) - now),
+        }
+
+    def export_metrics(self, path, now=None):
+        """
+        Write the metrics to `path` in the Prometheus text format
+        """
+        metrics = self.metrics(now)
+        write_atomic(path, ''.join(
+            '# TYPE netbox_agent_spool_{name} gauge\n'
+            'netbox_agent_spool_{name} {value}\n'.format(name=name, value=value)
+            for name, value in [
+                ('depth', metrics['depth']),
+                ('oldest_age_seconds', round(metrics['oldest_age'], 3)),
+                ('attempts', metrics['attempts']),
+                ('retry_in_seconds', round(metrics['retry_in'], 3)),
+            ]
+        ))
@@ -0,0 +1,165 @@
+"""
+Local state store
+
+The agent keeps, in a local JSON file (`state.path`), what it read from
+Netbox during the previous successful run. The store is loaded once,
+updated in memory during the run and only written back by `save()` once
+the run succeeded.
+
+Incremental reads: `filter_incremental()` keeps the objects matching a
+filter (ie: the interfaces of the device) with the highest `last_updated`
+seen, the watermark. The next run only fetches the objects updated since
+the watermark and merges them into the stored ones. Every change to an
+object updates its `last_updated`, and an object leaving the filter or
+deleted leaves more stored objects than Netbox counts: the objects are
+then all fetched again, as they are every `state.max_age` seconds.
+
+ID map: `get_mapped()` maps stable local keys (ie: the serial number of
+the device) to the id of the Netbox object found for them, which the next
+runs fetch directly by id. An object which is gone or doesn't match its
+key anymore is looked up again and the map repaired.
+"""
+import functools
+import json
+import logging
+import os
+import tempfile
+import time
+from urllib.parse import urlencode, urlsplit
+
+from netbox_agent.config import config
+
+STATE_VERSION = 1
+
+
+class StateStore():
+    def __init__(self, path):
+        self.path = path
+        self.data = {'version': STATE_VERSION}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('version') == STATE_VERSION:
+                self.data = data
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning('Ignoring unreadable state file {}: {}'.format(path, e))
+
+    def section(self, name):
+        return self.data.setdefault(name, {})
+
+    def save(self):
+        """
+        Write the state atomically: a crash never leaves a truncated file
+
+        Views not fully fetched for `state.max_age` seconds aren't used
+        anymore (ie: the device changed), they are dropped.
+        """
+        views = self.section('views')
+        for key, view in list(views.items()):
+            if time.time() - view['pulled_at'] > config.state.max_age:
+                del views[key]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.state-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+@functools.lru_cache(maxsize=None)
+def get_state_store():
+    """
+    Return the state store, None if `state.path` isn't configured
+    """
+    if not config.state.path:
+        return None
+    return StateStore(config.state.path)
+
+
+def save():
+    store = get_state_store()
+    if store is not None:
+        store.save()
+
+
+def get_view_key(endpoint, filters):
+    path = urlsplit(endpoint.url).path
+    return '{}?{}'.format(path, urlencode(sorted(filters.items()), doseq=True))
+
+
+def to_values(record):
+    """
+    Return a copy of the values of `record`, as the REST API returned them
+    """
+    return json.loads(json.dumps(dict(record)))
+
+
+def get_watermark(values):
+    return max((v['last_updated'] for v in values if v.get('last_updated')), default=None)
+
+
+def filter_incremental(endpoint, **filters):
+    """
+    Return the records of `endpoint` matching `filters`, like
+    `endpoint.filter(**filters)`, only fetching those updated since the
+    previous run when the state store is enabled
+    """
+    store = get_state_store()
+    if store is None:
+        return list(endpoint.filter(**filters))
+
+    key = get_view_key(endpoint, filters)
+    views = store.section('views')
+    view = views.get(key)
+    now = time.time()
+    if view is not None and view['watermark'] is not None and \
+       now - view['pulled_at'] < config.state.max_age:
+        count = endpoint.count(**filters)
+        values = dict(view['records'])
+        for record in endpoint.filter(last_updated__gte=view['watermark'], **filters):
+            values[str(record.id)] = to_values(record)
+        if len(values) == count:
+            view['records'] = values
+            view['watermark'] = get_watermark(values.values())
+            return [
+                endpoint.return_obj(v, endpoint.api, endpoint) for v in values.values()
+            ]
+        logging.debug('{} changed since the previous run, fetching it all'.format(key))
+
+    records = list(endpoint.filter(**filters))
+    values = dict((str(record.id), to_values(record)) for record in records)
+    views[key] = {
+        'pulled_at': now,
+        'watermark': get_watermark(values.values()),
+        'records': values,
+    }
+    return records
+
+
+def get_mapped(endpoint, key, lookup, check):
+    """
+    Return the object of `endpoint` for the local `key`: fetched by the id
+    it was mapped to, or returned by `lookup()` if unknown, gone, or not
+    passing `check(record)` anymore
+    """
+    store = get_state_store()
+    if store is None:
+        return lookup()
+
+    ids = store.section('ids')
+    key = '{}#{}'.format(urlsplit(endpoint.url).path, key)
+    if key in ids:
+        record = endpoint.get(ids[key])
+        if record is not None and check(record):
+            return record
+        logging.debug('{} is not {} anymore, looking it up'.format(ids.pop(key), key))
+    record = lookup()
+    if record is not None:
+        ids[key] = record.id
+    return record
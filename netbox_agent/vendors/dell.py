@@ -1,6 +1,6 @@
 import logging
-import subprocess
 
+from netbox_agent.command import getoutput
 from netbox_agent.misc import is_tool
 from netbox_agent.server import ServerBase
 
@@ -52,7 +52,7 @@ class DellHost(ServerBase):
             logging.error('omreport does not seem to be installed, please debug')
             return value
 
-        data = subprocess.getoutput('omreport chassis pwrmonitoring')
+        data = getoutput(['omreport', 'chassis', 'pwrmonitoring'])
         amperage = False
         for line in data.splitlines():
             if line.startswith('Amperage'):
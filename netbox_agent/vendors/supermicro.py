@@ -1,4 +1,3 @@
-from netbox_agent.inputdriver import InputDriver
 from netbox_agent.server import ServerBase
 
 
@@ -40,8 +39,7 @@ class SupermicroHost(ServerBase):
         if self.is_blade():
             # Some Supermicro servers don't report the slot in dmidecode
             # let's use a regex
-            slot = InputDriver("position")
-            return slot.get()
+            return self.get_input("position")
         # No supermicro on hands
         return None
 
@@ -3,10 +3,9 @@ import os
 import netbox_agent.dmidecode as dmidecode
 from netbox_agent.config import config
 from netbox_agent.config import netbox_instance as nb
-from netbox_agent.inputdriver import InputDriver
-from netbox_agent.logging import logging  # NOQA
-from netbox_agent.misc import create_netbox_tags, get_hostname, get_device_platform
-from netbox_agent.network import VirtualNetwork
+from netbox_agent.inputdriver import get_input
+from netbox_agent.logging import logging
+from netbox_agent.misc import create_netbox_tags, get_hostname, get_device_platform, lazy_property
 
 
 def is_vm(dmi):
@@ -31,11 +30,16 @@ class VirtualMachine(object):
         else:
             self.dmi = dmidecode.parse()
         self.network = None
-        self.device_platform = get_device_platform(config.device.platform)
 
         self.tags = list(set(config.device.tags.split(','))) if config.device.tags else []
-        if self.tags and len(self.tags):
-            create_netbox_tags(self.tags)
+
+    @lazy_property
+    def device_platform(self):
+        return get_device_platform(config.device.platform)
+
+    @lazy_property
+    def nb_tags(self):
+        return create_netbox_tags(self.tags)
 
     def get_memory(self):
         mem_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')  # e.g. 4015976448
@@ -65,8 +69,7 @@ class VirtualMachine(object):
         return None
 
     def get_tenant(self):
-        tenant = InputDriver("tenant")
-        return tenant.get()
+        return get_input("tenant")
 
     def get_netbox_tenant(self):
         tenant = self.get_tenant()
@@ -100,10 +103,12 @@ class VirtualMachine(object):
                 vcpus=vcpus,
                 memory=memory,
                 tenant=tenant.id if tenant else None,
-                tags=self.tags,
+                tags=[x.id for x in self.nb_tags],
             )
             created = True
 
+        from netbox_agent.network import VirtualNetwork
+
         self.network = VirtualNetwork(server=self)
         self.network.create_or_update_netbox_network_cards()
 
@@ -114,8 +119,8 @@ class VirtualMachine(object):
             if vm.memory != memory:
                 vm.memory = memory
                 updated += 1
-            if sorted(set(vm.tags)) != sorted(set(self.tags)):
-                vm.tags = self.tags
+            if sorted(set(x.name for x in vm.tags)) != sorted(set(self.tags)):
+                vm.tags = [x.id for x in self.nb_tags]
                 updated += 1
             if vm.platform != self.device_platform:
                 vm.platform = self.device_platform
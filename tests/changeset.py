@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from pynetbox.core.response import Record
+
+from netbox_agent.changeset import ChangeSet
+
+
+class FakeEndpoint():
+    name = 'devices'
+
+    def __init__(self):
+        self.updates = []
+
+    def update(self, objects):
+        self.updates.append(objects)
+        return [SimpleNamespace(**obj) for obj in objects]
+
+
+def device():
+    api = SimpleNamespace(base_url='http://netbox/api')
+    return Record({
+        'id': 42,
+        'name': 'server1',
+        'face': {'value': 'front', 'label': 'Front'},
+        'position': 12.0,
+        'site': {'id': 1, 'name': 'dc1'},
+        'rack': None,
+        'tags': [{'id': 3, 'name': 'b'}, {'id': 2, 'name': 'a'}],
+        'custom_fields': {'owner': 'ops', 'env': 'prod'},
+    }, api, None)
+
+
+def test_changeset_unchanged():
+    endpoint = FakeEndpoint()
+    record = device()
+    changes = ChangeSet(endpoint, record)
+    assert not changes.set('name', 'server1')
+    assert not changes.set('face', 'front')
+    assert not changes.set('position', '12')
+    assert not changes.set('site', 1)
+    assert not changes.set('rack', None)
+    assert not changes.set('tags', [2, 3])
+    assert not changes.set_custom_fields({'owner': 'ops'})
+    assert changes.flush() is record
+    assert endpoint.updates == []
+
+
+def test_changeset_single_patch():
+    endpoint = FakeEndpoint()
+    changes = ChangeSet(endpoint, device())
+    deleted = []
+    assert changes.set('name', 'server2')
+    assert changes.set('site', 2)
+    assert changes.set('tags', [1, 2, 3])
+    assert changes.set_custom_fields({'owner': 'ops', 'env': 'dev'})
+    # reverting a field drops it from the patch
+    assert not changes.set('name', 'server1')
+    changes.after_flush(lambda: deleted.append(endpoint.updates[:]))
+    server = changes.flush()
+    assert endpoint.updates == [[{
+        'id': 42,
+        'site': 2,
+        'tags': [1, 2, 3],
+        'custom_fields': {'env': 'dev'},
+    }]]
+    assert server.site == 2
+    # callbacks run once the patch is sent
+    assert deleted == [endpoint.updates]
+
+
+def test_changeset_keeps_other_custom_fields():
+    endpoint = FakeEndpoint()
+    changes = ChangeSet(endpoint, device())
+    # Netbox merges the custom fields: others are left untouched
+    assert changes.set_custom_fields({'owner': 'dev'})
+    changes.flush()
+    assert endpoint.updates == [[{'id': 42, 'custom_fields': {'owner': 'dev'}}]]
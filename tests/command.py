@@ -0,0 +1,86 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+import netbox_agent.command as command
+from netbox_agent.command import CommandError, CommandTimeout, run, run_json
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_run_large_output():
+    # more than a pipe buffer, would deadlock if waiting before reading
+    res = run(python('import sys; sys.stdout.write("x" * 1024 * 1024)'))
+    assert res.returncode == 0
+    assert res.size == 1024 * 1024
+    assert res.output == 'x' * 1024 * 1024
+    assert res in command.history
+
+
+def test_run_shell_command_line():
+    res = run('echo foo; echo bar >&2; exit 3')
+    assert res.returncode == 3
+    assert res.output == 'foo\nbar\n'
+
+
+def test_run_stderr_apart():
+    res = run('echo foo; echo bar >&2', stderr=subprocess.PIPE)
+    assert (res.output, res.stderr) == ('foo\n', 'bar\n')
+    assert run('echo foo; echo bar >&2').output == 'foo\nbar\n'
+    with pytest.raises(CommandError) as e:
+        run('echo foo; echo oops >&2; exit 1', stderr=subprocess.PIPE).check()
+    assert 'oops' in str(e.value)
+
+
+def test_run_timeout():
+    with pytest.raises(CommandTimeout):
+        run(python('import time; time.sleep(30)'), timeout=0.5)
+
+
+def test_run_timeout_kills_children():
+    # the children of the shell would keep the pipe open
+    start = time.monotonic()
+    with pytest.raises(CommandTimeout):
+        run("sh -c 'sleep 10 & wait'", timeout=0.5, cache=False)
+    with pytest.raises(CommandTimeout):
+        run_json("sh -c 'sleep 10 & wait'", timeout=0.5, cache=False)
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.parametrize('ijson', [command.ijson, None])
+def test_run_json_items(ijson, monkeypatch):
+    monkeypatch.setattr(command, 'ijson', ijson)
+    res = run_json(python(
+        'import json; print(json.dumps({"Controllers": [{"id": i} for i in range(5000)]}))'
+    ), items='Controllers.item')
+    assert res.returncode == 0
+    assert res.data == [{'id': i} for i in range(5000)]
+    assert res.size > 65536
+
+
+def test_run_json_invalid_output():
+    with pytest.raises(CommandError) as e:
+        run_json(python('import sys; print("oops"); sys.stderr.write("broken")'))
+    assert 'broken' in str(e.value)
+    assert command.history[-1].stderr == 'broken'
+
+
+def test_run_json_timeout():
+    with pytest.raises(CommandTimeout):
+        run_json(python('import time; time.sleep(30)'), timeout=0.5)
+
+
+def test_run_cache():
+    cmd = python('import random; print(random.random())')
+    commands = command.metrics()['commands']
+    first = run(cmd)
+    assert run(list(cmd)) is first
+    assert command.getoutput(cmd) == first.output.rstrip('\n')
+    assert run(cmd, cache=False).output != first.output
+    metrics = command.metrics()
+    assert metrics['commands'] == commands + 2
+    assert metrics['cache_hits'] >= 2
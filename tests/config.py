@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pynetbox
+from pynetbox.core.response import Record
+
+import netbox_agent.config as config
+from tests.conftest import StubNetbox
+
+
+def test_count_lazy_fetches(monkeypatch):
+    monkeypatch.setattr(Record, 'full_details', Record.full_details)
+    config.lazy_fetches.clear()
+    config.count_lazy_fetches(Record)
+    # installed once
+    config.count_lazy_fetches(Record)
+
+    with StubNetbox({}) as stub:
+        stub.routes[('GET', '/api/dcim/interfaces')] = {
+            'count': 1, 'next': None, 'previous': None, 'results': [{
+                'id': 1, 'name': 'eth0', 'lag': {
+                    'id': 2, 'name': 'bond0', 'url': stub.url + '/api/dcim/interfaces/2/',
+                },
+            }],
+        }
+        stub.routes[('GET', '/api/dcim/interfaces/2')] = {
+            'id': 2, 'name': 'bond0', 'description': 'uplink',
+        }
+        nb = pynetbox.api(stub.url, token='secret')
+        eth0, = nb.dcim.interfaces.filter(device_id=1)
+        assert eth0.lag.name == 'bond0'
+        assert config.metrics()['lazy_fetches'] == 0
+        assert eth0.lag.description == 'uplink'
+        assert eth0.lag.description == 'uplink'
+        assert len(stub.requests) == 2
+
+    assert config.metrics() == {
+        'lazy_fetches': 1,
+        'lazy_fetches_by_endpoint': {'interfaces': 1},
+    }
+    config.lazy_fetches.clear()
+
+
+def test_limit_concurrent_requests():
+    running = []
+    peak = []
+
+    class Session():
+        def request(self, method, url):
+            running.append(url)
+            peak.append(len(running))
+            time.sleep(0.01)
+            running.remove(url)
+            return url
+
+    session = Session()
+    config.limit_concurrent_requests(session, threading.BoundedSemaphore(2))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: session.request('GET', i), range(16)))
+    assert results == list(range(16))
+    assert max(peak) == 2
+
+
+def test_get_config_args(monkeypatch):
+    monkeypatch.setattr(config, '_config', {})
+    assert repr(config.config) == '<unresolved get_config>'
+    monkeypatch.setattr('sys.argv', ['netbox_agent', '--not-an-option'])
+    options = config.get_config(args=['--update-network', '--netbox.url', 'http://netbox'])
+    assert config.config.update_network is True
+    assert config.config.netbox.url == 'http://netbox'
+    assert config.get_config() is options
+    assert 'update_network=True' in repr(config.config)
@@ -1,7 +1,19 @@
+import json
 import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 
+import netbox_agent.config
+
+
+def pytest_configure(config):
+    # the options of the agent, not those of pytest
+    netbox_agent.config.get_config(args=[])
+
 
 def get_fixture_paths(path):
     if not os.path.isdir(path):
@@ -31,3 +43,163 @@ def parametrize_with_fixtures(path, base_path='tests/fixtures',
     def _decorator(test_function):
         return pytest.mark.parametrize(argname, argvalues)(test_function)
     return _decorator
+
+
+# query parameters shaping the returned records, not filters
+QUERY_OPTIONS = ('brief', 'fields')
+
+
+class FakeEndpoint():
+    """
+    In-memory stand-in for a pynetbox endpoint, recording the requests it
+    would send; filters match record attributes, list values match any
+    """
+
+    def __init__(self, name, records=()):
+        self.name = name
+        self.records = {}
+        self.requests = []
+        for values in records:
+            self._add(values)
+
+    def _add(self, values):
+        values = dict(values)
+        values.setdefault('id', max(self.records, default=0) + 1)
+        record = SimpleNamespace(**values)
+        self.records[record.id] = record
+        return record
+
+    def _filter(self, filters):
+        return [
+            r for r in self.records.values()
+            if all(
+                getattr(r, k, None) in (v if isinstance(v, list) else [v])
+                for k, v in filters.items() if k not in QUERY_OPTIONS
+            )
+        ]
+
+    def methods(self):
+        return [method for method, _ in self.requests]
+
+    def all(self):
+        self.requests.append(('GET', {}))
+        return list(self.records.values())
+
+    def filter(self, **filters):
+        self.requests.append(('GET', filters))
+        return self._filter(filters)
+
+    def get(self, *args, **filters):
+        self.requests.append(('GET', filters or args))
+        if args:
+            return self.records.get(args[0])
+        records = self._filter(filters)
+        return records[0] if records else None
+
+    def create(self, *args, **kwargs):
+        objects = args[0] if args else kwargs
+        self.requests.append(('POST', objects))
+        if isinstance(objects, list):
+            return [self._add(o) for o in objects]
+        return self._add(objects)
+
+    def update(self, objects):
+        self.requests.append(('PATCH', objects))
+        for o in objects:
+            vars(self.records[o['id']]).update(o)
+        return [self.records[o['id']] for o in objects]
+
+    def delete(self, objects):
+        ids = [getattr(o, 'id', o) for o in objects]
+        self.requests.append(('DELETE', ids))
+        for i in ids:
+            del self.records[i]
+        return True
+
+
+class StubNetbox():
+    """
+    Local HTTP server standing in for Netbox: `routes` maps (method, path
+    without trailing slash) to the JSON document to answer, or to a
+    callable receiving the request body and query parameters and returning
+    (status, document); requests are recorded. The answers tell the API
+    `version`, as Netbox does
+    """
+
+    def __init__(self, routes, version='3.5'):
+        self.routes = routes
+        self.version = version
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                url = urlsplit(self.path)
+                path = url.path.rstrip('/')
+                query = parse_qs(url.query)
+                stub.requests.append((self.command, path, body, dict(self.headers), query))
+                route = stub.routes.get((self.command, path))
+                status, document = 404, {'detail': 'Not found.'}
+                if callable(route):
+                    status, document = route(body, query)
+                elif route is not None:
+                    status, document = 200, route
+                payload = json.dumps(document).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('API-Version', stub.version)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = do_OPTIONS = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def page(results):
+    return {'count': len(results), 'next': None, 'previous': None, 'results': results}
+
+
+@pytest.fixture
+def push_netbox(monkeypatch):
+    """
+    Stub Netbox holding the device of the snapshots of
+    `tests.push.get_server_data`, used by `netbox_agent push`
+    """
+    import pynetbox
+
+    import netbox_agent.cache as cache
+    import netbox_agent.push as push
+
+    device = {'id': 1, 'serial': '4242', 'name': 'srv-4242', 'tags': [], 'custom_fields': {}}
+    with StubNetbox({
+        ('GET', '/api'): {},
+        ('GET', '/api/dcim/devices'): page([device]),
+        ('GET', '/api/dcim/platforms'): page([{'id': 3, 'name': 'Debian 12'}]),
+        ('PATCH', '/api/dcim/devices'): [device],
+    }) as stub:
+        monkeypatch.setitem(
+            netbox_agent.config.netbox_instance.__dict__, '_factory',
+            lambda: pynetbox.api(stub.url, token='t'),
+        )
+        cache.clear()
+        push.is_netbox_supported.cache_clear()
+        yield stub
+    cache.clear()
+    push.is_netbox_supported.cache_clear()
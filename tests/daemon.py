@@ -0,0 +1,111 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import netbox_agent.cache as cache
+import netbox_agent.cli as cli
+import netbox_agent.daemon as daemon
+
+INTERVALS = {'network': 300, 'location': 3600, 'psu': 86400}
+
+
+def test_schedule():
+    now = 1700000000
+    schedule = daemon.Schedule('4242', INTERVALS, now=now)
+    for scope, interval in INTERVALS.items():
+        assert now <= schedule.next_run[scope] < now + interval
+    # the same for a server, spread over the fleet
+    assert schedule.next_run == daemon.Schedule('4242', INTERVALS, now=now).next_run
+    assert schedule.next_run != daemon.Schedule('4343', INTERVALS, now=now).next_run
+
+    first = schedule.next_run['network']
+    assert schedule.delay(now) == min(schedule.next_run.values()) - now
+    assert 'network' not in schedule.due(first - 1)
+    assert 'network' in schedule.due(first)
+    assert schedule.next_run['network'] == first + 300
+    # the runs missed are skipped
+    assert 'network' in schedule.due(first + 1000)
+    assert schedule.next_run['network'] == first + 1200
+    assert schedule.delay(first + 2000000) == 0
+
+
+def test_acquire_lock(tmpdir):
+    path = str(tmpdir.join('netbox_agent.lock'))
+    lock = daemon.acquire_lock(path)
+    with pytest.raises(daemon.LockError):
+        daemon.acquire_lock(path)
+    lock.close()
+    daemon.acquire_lock(path).close()
+
+
+class FakeServer():
+    def __init__(self, runs):
+        self.runs = runs
+
+    def netbox_create_or_update(self, config):
+        self.runs.append(sorted(x for x in cli.SYNC_OPTIONS if getattr(config, x)))
+
+
+def test_run_scopes(monkeypatch):
+    # the function below isn't left in the registry
+    monkeypatch.setattr(cache, '_reference_clearers', list(cache._reference_clearers))
+    calls = []
+
+    @cache.run_cache(reference=True)
+    def get_reference(name):
+        calls.append(name)
+        return name
+
+    runs = []
+    monkeypatch.setattr(cli, 'nb', SimpleNamespace(version='3.5'))
+    monkeypatch.setattr(cli.state, 'save', lambda: None)
+    dmis = []
+
+    def parse():
+        dmis.append([])
+        return dmis[-1]
+
+    monkeypatch.setattr(daemon.dmidecode, 'parse', parse)
+    monkeypatch.setattr(cli, 'get_server', lambda dmi, config: FakeServer(runs))
+    config = SimpleNamespace(
+        spool=SimpleNamespace(path=None),
+        **dict((x, x == 'update_all') for x in cli.SYNC_OPTIONS)
+    )
+
+    get_reference('role')
+    assert daemon.run_scopes(config, ['network', 'psu']) is True
+    assert daemon.run_scopes(config, ['location']) is True
+    assert runs == [['update_network', 'update_psu'], ['update_location']]
+    # dmidecode runs again, ie: for the PSUs
+    assert len(dmis) == 2
+    # the options are left untouched
+    assert config.update_all is True
+
+    # the references are kept between the runs
+    get_reference('role')
+    assert calls == ['role']
+    cache.clear()
+    get_reference('role')
+    assert calls == ['role', 'role']
+
+
+def test_loop(monkeypatch):
+    stop = threading.Event()
+    schedule = daemon.Schedule('4242', INTERVALS)
+    runs = []
+
+    def run_scopes(config, scopes):
+        runs.append(scopes)
+        if len(runs) == 1:
+            schedule.next_run['network'] = 0
+            raise Exception('boom')
+        stop.set()
+        return False
+
+    monkeypatch.setattr(daemon, 'run_scopes', run_scopes)
+    schedule.next_run['network'] = schedule.next_run['location'] = 0
+    config = SimpleNamespace(daemon=SimpleNamespace(references_ttl=3600))
+    daemon.loop(config, schedule, stop)
+    # a failed run doesn't stop the daemon
+    assert runs == [['location', 'network'], ['network']]
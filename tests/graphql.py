@@ -0,0 +1,207 @@
+import copy
+from types import SimpleNamespace
+
+import pynetbox
+import pytest
+
+import netbox_agent.network as network
+import netbox_agent.misc as misc
+from netbox_agent import cache
+from netbox_agent.graphql import enum_name, get_device_state
+from netbox_agent.inventory import Inventory
+from netbox_agent.network import ServerNetwork
+from netbox_agent.power import PowerSupply
+from tests.conftest import StubNetbox
+
+CHOICES = {
+    '/api/dcim/interfaces': {'actions': {'POST': {
+        'type': {'choices': [
+            {'value': '1000base-t', 'display_name': '1000BASE-T (1GE)'},
+            {'value': 'lag', 'display_name': 'Link Aggregation Group (LAG)'},
+        ]},
+        'mode': {'choices': [
+            {'value': 'access', 'display_name': 'Access'},
+            {'value': 'tagged', 'display_name': 'Tagged'},
+        ]},
+    }}},
+    '/api/ipam/ip-addresses': {'actions': {'POST': {
+        'role': {'choices': [
+            {'value': 'anycast', 'display_name': 'Anycast'},
+        ]},
+    }}},
+}
+
+DEVICE = {
+    'id': '1',
+    'name': 'server1',
+    'serial': 'ABC123',
+    'interfaces': [
+        {
+            'id': '10', 'name': 'bond0', 'mac_address': None, 'mgmt_only': False,
+            'type': 'LAG', 'mode': None, 'lag': None, 'untagged_vlan': None,
+            'tagged_vlans': [], 'cable': None, 'link_peers': [], 'ip_addresses': [
+                {'id': '100', 'address': '10.0.0.1/24', 'role': None},
+                {'id': '101', 'address': '10.0.0.10/32', 'role': 'ANYCAST'},
+            ],
+        },
+        {
+            'id': '11', 'name': 'eth0', 'mac_address': '00:11:22:33:44:55',
+            'mgmt_only': False, 'type': 'A_1000BASE_T', 'mode': 'TAGGED',
+            'lag': {'id': '10', 'name': 'bond0'}, 'untagged_vlan': None,
+            'tagged_vlans': [{'id': '5', 'vid': 300, 'name': 'VLAN 300'}],
+            'cable': {'id': '7'},
+            'link_peers': [{
+                '__typename': 'InterfaceType', 'id': '501', 'name': 'xe-0/0/1',
+                'device': {'id': '50', 'name': 'sw1'},
+            }],
+            'ip_addresses': [],
+        },
+    ],
+    'inventoryitems': [
+        {'id': '20', 'name': 'Xeon', 'serial': 'N/A', 'tags': [
+            {'id': '3', 'name': 'hw:cpu', 'slug': 'hw-cpu'},
+        ]},
+        {'id': '21', 'name': 'SSD', 'serial': 'S1', 'tags': [
+            {'id': '4', 'name': 'hw:disk', 'slug': 'hw-disk'},
+        ]},
+    ],
+    'powerports': [
+        {
+            'id': '30', 'name': 'PSU1', 'description': 'PSU', 'maximum_draw': 500,
+            'allocated_draw': None,
+            'link_peers': [{'__typename': 'PowerFeedType', 'id': '7', 'name': 'A'}],
+        },
+    ],
+}
+
+
+@pytest.fixture
+def stub_netbox():
+    cache.clear()
+    routes = {('OPTIONS', path): choices for path, choices in CHOICES.items()}
+    routes[('GET', '/api')] = {}
+    routes[('POST', '/graphql')] = {'data': {'device_list': [DEVICE]}}
+    with StubNetbox(routes) as stub:
+        yield stub
+    cache.clear()
+
+
+def test_enum_name():
+    assert enum_name('1000base-t') == 'A_1000BASE_T'
+    assert enum_name('tagged') == 'TAGGED'
+    assert enum_name('ieee802.11ac') == 'IEEE802_11AC'
+
+
+def test_get_device_state(stub_netbox, monkeypatch):
+    nb = pynetbox.api(stub_netbox.url, token='secret')
+    monkeypatch.setattr(misc, 'nb', nb)
+    state = get_device_state(nb, 'ABC123')
+
+    # the whole state is read in a single query
+    graphql = [r for r in stub_netbox.requests if r[1] == '/graphql']
+    assert len(graphql) == 1
+    assert graphql[0][2]['variables'] == {'serial': ['ABC123']}
+    assert graphql[0][3]['Authorization'] == 'Token secret'
+
+    assert state.device.id == 1
+    bond0, eth0 = state.take('interfaces', 1)
+    # records are those the REST API would return
+    assert isinstance(eth0, pynetbox.models.dcim.Interfaces)
+    assert eth0.id == 11 and eth0.device.id == 1
+    assert eth0.type.value == '1000base-t'
+    assert eth0.mode.value == 'tagged'
+    assert eth0.lag.id == 10
+    assert eth0.tagged_vlans[0].vid == 300
+    assert bond0.type.value == 'lag' and bond0.mode is None
+    assert eth0.serialize()['type'] == '1000base-t'
+
+    ips = state.take('ip_addresses', 1)
+    assert [(x.address, x.assigned_object_id) for x in ips] == [
+        ('10.0.0.1/24', 10), ('10.0.0.10/32', 10),
+    ]
+    assert ips[0].role is None
+    assert ips[1].role.label == 'Anycast'
+
+    cable, peer = state.take('cable_peers', 1)[11]
+    assert cable.id == 7
+    assert (peer.id, peer.name, peer.device.name) == (501, 'xe-0/0/1', 'sw1')
+
+    assert [x.serial for x in state.take('inventory_items:hw-disk', 1)] == ['S1']
+    assert state.take('inventory_items:hw-gpu', 1, default=[]) == []
+    psu, = state.take('power_ports', 1)
+    assert psu.connected_endpoint_type == 'dcim.powerfeed'
+    assert psu.connected_endpoint.id == 7
+
+    # parts are handed out once, and for the device only
+    assert state.take('interfaces', 1) is None
+    assert state.take('inventory_items:hw-cpu', 2) is None
+    # no REST request other than the version and the choices
+    assert sorted(r[1] for r in stub_netbox.requests if r[0] != 'POST') == [
+        '/api', '/api/dcim/interfaces', '/api/ipam/ip-addresses',
+    ]
+
+
+def test_get_device_state_link_peer(stub_netbox, monkeypatch):
+    nb = pynetbox.api(stub_netbox.url, token='secret')
+    monkeypatch.setattr(misc, 'nb', nb)
+    stub_netbox.version = '3.2'
+
+    def answer(body, query):
+        # the schema of Netbox 3.0 to 3.2: a single peer
+        if 'link_peers' in body['query']:
+            return 200, {'errors': [{
+                'message': 'Cannot query field "link_peers" on type "InterfaceType".',
+            }]}
+        device = copy.deepcopy(DEVICE)
+        for x in device['interfaces'] + device['powerports']:
+            x['link_peer'] = (x.pop('link_peers') or [None])[0]
+        return 200, {'data': {'device_list': [device]}}
+
+    stub_netbox.routes[('POST', '/graphql')] = answer
+    state = get_device_state(nb, 'ABC123')
+    graphql, = [r for r in stub_netbox.requests if r[1] == '/graphql']
+    assert 'link_peer {' in graphql[2]['query']
+    cable, peer = state.take('cable_peers', 1)[11]
+    assert (cable.id, peer.id, peer.device.name) == (7, 501, 'sw1')
+    psu, = state.take('power_ports', 1)
+    assert psu.connected_endpoint.id == 7
+
+
+def test_get_device_state_fallback(stub_netbox, monkeypatch):
+    nb = pynetbox.api(stub_netbox.url, token='secret')
+    monkeypatch.setattr(misc, 'nb', nb)
+    # ie: a schema the query doesn't match
+    stub_netbox.routes[('POST', '/graphql')] = {'errors': [{
+        'message': 'Cannot query field "link_peers" on type "InterfaceType".',
+    }]}
+    assert get_device_state(nb, 'ABC123') is None
+    # ie: Netbox < 3.0
+    del stub_netbox.routes[('POST', '/graphql')]
+    assert get_device_state(nb, 'ABC123') is None
+
+
+def test_reconcilers_read_device_state(stub_netbox, monkeypatch):
+    nb = pynetbox.api(stub_netbox.url, token='secret')
+    monkeypatch.setattr(misc, 'nb', nb)
+    server = SimpleNamespace(device_state=get_device_state(nb, 'ABC123'))
+    device = SimpleNamespace(id=1)
+
+    net = ServerNetwork.__new__(ServerNetwork)
+    net.server = server
+    net.device = device
+    net.nics = [{'name': 'eth0'}]
+    monkeypatch.setattr(network, 'nb', None)
+    assert [x.name for x in net.get_netbox_network_cards()] == ['bond0', 'eth0']
+    assert list(net.get_cable_peers()) == [11]
+
+    inventory = Inventory(server)
+    assert [x.name for x in inventory.get_netbox_inventory(1, 'hw-cpu')] == ['Xeon']
+    assert inventory.get_netbox_inventory(1, 'hw-gpu') == []
+
+    psu = PowerSupply.__new__(PowerSupply)
+    psu.server = server
+    psu.device_id = 1
+    assert [x.name for x in psu.get_netbox_power_supply()] == ['PSU1']
+
+    # only the version, the choices and the query were requested
+    assert len(stub_netbox.requests) == 4
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import netbox_agent.cache as cache
+import netbox_agent.drivers.file as file_driver
+import netbox_agent.inputdriver as inputdriver
+from netbox_agent.inputdriver import get_input
+
+
+def location_config(**kwargs):
+    config = SimpleNamespace()
+    for input_type, (driver, regex) in kwargs.items():
+        setattr(config, input_type, SimpleNamespace(
+            driver=driver, driver_file=None, regex=regex,
+        ))
+    return config
+
+
+def test_file_driver(tmp_path, monkeypatch):
+    inventory = tmp_path / 'inventory'
+    inventory.write_text(''.join(
+        'host{0} dc{0} rack{0}\n'.format(i) for i in range(10000)
+    ))
+    monkeypatch.setattr(inputdriver, 'config', location_config(
+        site=('file:{}'.format(inventory), r'^host9999 (dc\d+)'),
+        rack=('file:{}'.format(inventory), r'^host9999 dc\d+ (rack\d+)$'),
+    ))
+    cache.clear()
+    reads = []
+    get = file_driver.get
+
+    def counting_get(value, regex):
+        reads.append(value)
+        return get(value, regex)
+
+    monkeypatch.setattr(file_driver, 'get', counting_get)
+    for _ in range(5):
+        assert get_input('site') == 'dc9999'
+        assert get_input('rack') == 'rack9999'
+    assert len(reads) == 2
+
+    cache.clear()
+    assert get_input('site') == 'dc9999'
+    assert len(reads) == 3
+    cache.clear()
+
+
+def test_cmd_driver(monkeypatch):
+    monkeypatch.setattr(inputdriver, 'config', location_config(
+        site=('cmd:echo "SysName: sw-dist-a1.dc42"', r'SysName: .*\.([A-Za-z0-9]+)'),
+        tenant=('cmd:echo "SysName: sw-dist-a1.dc42"', r'nomatch (.*)'),
+    ))
+    cache.clear()
+    assert get_input('site') == 'dc42'
+    assert get_input('tenant') is None
+    cache.clear()
@@ -0,0 +1,120 @@
+import os
+from types import SimpleNamespace
+
+import netbox_agent.cache as cache
+import netbox_agent.misc as misc
+from netbox_agent.misc import (
+    PrefixMatcher, create_netbox_tags, find_or_create_manufacturer, find_or_create_manufacturers,
+    get_vendor, parse_mountinfo,
+)
+from tests.conftest import FakeEndpoint, parametrize_with_fixtures
+
+
+def make_sys_block(path, disks):
+    """
+    Mimic /sys/class/block: partitions live under their parent disk and
+    own a `partition` file
+    """
+    block = path / 'block'
+    block.mkdir()
+    for disk, partitions in disks.items():
+        disk_path = path / 'devices' / disk
+        disk_path.mkdir(parents=True)
+        os.symlink(str(disk_path), str(block / disk))
+        for part in partitions:
+            part_path = disk_path / part
+            part_path.mkdir()
+            (part_path / 'partition').write_text('1')
+            os.symlink(str(part_path), str(block / part))
+    return str(block)
+
+
+@parametrize_with_fixtures(
+    'mountinfo/', only_filenames=[
+        'nvme.txt',
+    ])
+def test_parse_mountinfo(fixture, tmp_path):
+    sys_block = make_sys_block(tmp_path, {
+        'nvme0n1': ['nvme0n1p1', 'nvme0n1p2'],
+        'sda': [],
+        'sdb': ['sdb1'],
+        'mmcblk0': ['mmcblk0p1'],
+    })
+    assert parse_mountinfo(fixture, sys_block) == {
+        '/dev/nvme0n1': ['/', '/boot/efi', '/var/lib/kubelet'],
+        '/dev/sda': ['/srv/raw'],
+        '/dev/sdb': ['/srv/my data'],
+        '/dev/mmcblk0': ['/mnt/sd'],
+    }
+
+
+def test_create_netbox_tags(monkeypatch):
+    tags = FakeEndpoint('tags', [
+        {'name': 'prod', 'slug': 'prod'},
+        {'name': 'hw:cpu', 'slug': 'hw-cpu'},
+    ])
+    monkeypatch.setattr(misc, 'nb', SimpleNamespace(extras=SimpleNamespace(tags=tags)))
+    cache.clear()
+
+    nb_tags = create_netbox_tags(['prod', 'k8s node', {'name': 'hw:cpu'}, {
+        'name': 'hw:gpu', 'slug': 'hw-gpu', 'comments': 'hw:gpu',
+    }])
+    assert [x.name for x in nb_tags] == ['prod', 'k8s node', 'hw:cpu', 'hw:gpu']
+    assert tags.requests == [
+        ('GET', {'name': ['hw:cpu', 'hw:gpu', 'k8s node', 'prod'], 'brief': 1}),
+        ('POST', [
+            {'name': 'k8s node', 'slug': 'k8s-node'},
+            {'name': 'hw:gpu', 'slug': 'hw-gpu', 'comments': 'hw:gpu'},
+        ]),
+    ]
+    # known for the rest of the run
+    assert create_netbox_tags(['k8s node', 'prod']) == [nb_tags[1], nb_tags[0]]
+    assert len(tags.requests) == 2
+    cache.clear()
+
+
+def test_prefix_matcher():
+    matcher = PrefixMatcher({'M': 'short', 'MG': 'long', 'mga': 'longest'})
+    assert matcher.match('MX500') == 'short'
+    assert matcher.match('MG04ACA') == 'long'
+    assert matcher.match('mgas') == 'longest'
+    assert matcher.match('ST4000') is None
+
+
+def test_get_vendor():
+    assert get_vendor(None) is None
+    assert get_vendor('ST4000NM0035') == 'Seagate'
+    assert get_vendor('HUH721010AL') == 'HGST'
+    assert get_vendor('MG04ACA400N') == 'Toshiba'
+    assert get_vendor('Micron_5200') == 'Micron'
+    assert get_vendor('00CE00B300CE') == 'Samsung'
+    assert get_vendor('Foo 42') == 'Foo 42'
+
+
+def test_find_or_create_manufacturers(monkeypatch):
+    manufacturers = FakeEndpoint('manufacturers', [
+        {'name': 'Intel', 'slug': 'intel'},
+        {'name': 'Samsung', 'slug': 'samsung'},
+    ])
+    monkeypatch.setattr(misc, 'nb', SimpleNamespace(
+        dcim=SimpleNamespace(manufacturers=manufacturers),
+    ))
+    cache.clear()
+
+    names = ['Intel', 'intel', '00CE00B300CE', 'Toshiba', 'N/A', None, 'Toshiba']
+    found = find_or_create_manufacturers(names)
+    assert dict((k, v.name) for k, v in found.items()) == {
+        'Intel': 'Intel',
+        'intel': 'Intel',
+        '00CE00B300CE': 'Samsung',
+        'Toshiba': 'Toshiba',
+        'N/A': 'N/A',
+    }
+    assert manufacturers.requests == [
+        ('GET', {'brief': 1}),
+        ('POST', [{'name': 'Toshiba', 'slug': 'toshiba'}, {'name': 'N/A', 'slug': 'n-a'}]),
+    ]
+    assert find_or_create_manufacturer('002C0632002C').name == 'Micron'
+    assert find_or_create_manufacturer('Toshiba') is found['Toshiba']
+    assert manufacturers.methods() == ['GET', 'POST', 'POST']
+    cache.clear()
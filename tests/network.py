@@ -1,5 +1,9 @@
+from types import SimpleNamespace
+
+import netbox_agent.network as network
 from netbox_agent.lldp import LLDP
-from tests.conftest import parametrize_with_fixtures
+from netbox_agent.network import Network, ServerNetwork
+from tests.conftest import FakeEndpoint, parametrize_with_fixtures
 
 
 @parametrize_with_fixtures(
@@ -27,4 +31,237 @@ def test_lldp_parse_without_ifname(fixture):
 def test_lldp_parse_with_vlan(fixture):
     lldp = LLDP(fixture)
     assert lldp.get_switch_vlan('eth0') == {'300': {'pvid': True}}
-    assert lldp.get_switch_vlan('eth1') == {'300': {}}
\ No newline at end of file
+    assert lldp.get_switch_vlan('eth1') == {'300': {}}
+
+
+def netbox_ip(address, interface_id=None, anycast=False, **kwargs):
+    return dict(
+        address=address,
+        assigned_object_id=interface_id,
+        assigned_object=interface_id,
+        role=SimpleNamespace(label='Anycast') if anycast else None,
+        **kwargs
+    )
+
+
+def test_create_or_update_netbox_ips(monkeypatch):
+    ip_addresses = FakeEndpoint('ip-addresses', [
+        netbox_ip('10.0.0.1/24', 1),
+        netbox_ip('10.0.0.2/24'),
+        netbox_ip('10.0.0.3/24', 9),
+        netbox_ip('10.0.0.5/32', 9, anycast=True),
+        netbox_ip('10.0.0.6/32', 9, anycast=True),
+        netbox_ip('10.0.0.6/32', anycast=True),
+        netbox_ip('2001:db8::1/64', 9),
+    ])
+    monkeypatch.setattr(network, 'nb', SimpleNamespace(
+        ipam=SimpleNamespace(ip_addresses=ip_addresses),
+    ))
+    net = Network.__new__(Network)
+    net.assigned_object_type = 'dcim.interface'
+    net.tenant = None
+    net.ipam_choices = {'ip-address:role': {'Anycast': 'anycast'}}
+
+    eth0 = SimpleNamespace(id=1, name='eth0')
+    vips = ['10.1.{}.{}/32'.format(i // 250, i % 250) for i in range(250)]
+    net.create_or_update_netbox_ips([
+        (ip, eth0) for ip in [
+            '10.0.0.1/24', '10.0.0.2/24', '10.0.0.3/24', '10.0.0.4/24',
+            '10.0.0.5/32', '10.0.0.6/32', '2001:DB8:0::1/64',
+        ] + vips
+    ], assigned_ips=[ip_addresses.records[1]])
+
+    # the already assigned IP isn't looked up, the others in 3 chunks
+    assert ip_addresses.methods() == ['GET', 'GET', 'GET', 'POST', 'PATCH']
+    assert '10.0.0.1/24' not in ip_addresses.requests[0][1]['address']
+    assert sorted(r['id'] for r in ip_addresses.requests[-1][1]) == [2, 3, 6, 7]
+    assigned = [r.address for r in ip_addresses.records.values() if r.assigned_object_id == 1]
+    assert sorted(assigned) == sorted([
+        '10.0.0.1/24', '10.0.0.2/24', '10.0.0.3/24', '10.0.0.4/24',
+        '10.0.0.5/32', '10.0.0.6/32', '2001:db8::1/64',
+    ] + vips)
+    # a new anycast IP is created when every existing one is taken
+    assert [r for r in ip_addresses.requests[-2][1] if r['address'] == '10.0.0.5/32'] == [{
+        'address': '10.0.0.5/32',
+        'status': 'active',
+        'role': 'anycast',
+        'tenant': None,
+        'assigned_object_type': 'dcim.interface',
+        'assigned_object_id': 1,
+    }]
+
+    # nothing to do the second time
+    ip_addresses.requests = []
+    net.create_or_update_netbox_ips(
+        [(ip, eth0) for ip in vips],
+        assigned_ips=list(ip_addresses.records.values()),
+    )
+    assert ip_addresses.requests == []
+
+
+def test_prefetch_vlans(monkeypatch):
+    vlans = FakeEndpoint('vlans', [
+        {'vid': 10, 'site': SimpleNamespace(id=2)},
+        {'vid': 10, 'site': SimpleNamespace(id=1)},
+        {'vid': 10, 'site': None},
+        {'vid': 20, 'site': None},
+        {'vid': 40, 'site': SimpleNamespace(id=2)},
+    ])
+    monkeypatch.setattr(network, 'nb', SimpleNamespace(ipam=SimpleNamespace(vlans=vlans)))
+    monkeypatch.setattr(network, 'config', SimpleNamespace(
+        network=SimpleNamespace(lldp=None),
+    ))
+    net = Network.__new__(Network)
+    net.device = SimpleNamespace(id=1, site=SimpleNamespace(id=1))
+    net.vlans = {}
+    net.nics = [
+        {'name': 'eth0', 'vlan': None},
+        {'name': 'eth0.10', 'vlan': 10},
+        {'name': 'eth0.20', 'vlan': 20},
+        {'name': 'eth0.30', 'vlan': 30},
+        {'name': 'eth0.31', 'vlan': '31'},
+        {'name': 'eth0.40', 'vlan': 40},
+    ]
+
+    net.prefetch_vlans(net.get_local_vlans())
+    assert vlans.methods() == ['GET', 'POST']
+    assert vlans.requests[0][1] == {'vid': [10, 20, 30, 31, 40], 'fields': 'id,name,vid,site'}
+    # the VLAN of another site can't be used, one is created in the device's
+    assert vlans.requests[1][1] == [
+        {'name': 'VLAN 30', 'vid': 30},
+        {'name': 'VLAN 31', 'vid': 31},
+        {'name': 'VLAN 40', 'vid': 40, 'site': 1},
+    ]
+    # the VLAN of the device's site wins, then the global one
+    assert net.get_or_create_vlan(10).id == 2
+    assert net.get_or_create_vlan('20').id == 4
+    assert net.get_or_create_vlan(31).vid == 31
+    assert net.get_or_create_vlan(40).site == 1
+    assert len(vlans.requests) == 2
+
+
+class FakeIPAddresses(FakeEndpoint):
+    def _filter(self, filters):
+        # Netbox matches addresses without netmask on the host part
+        return [
+            r for r in self.records.values()
+            if r.address.split('/')[0] in filters['address']
+        ]
+
+
+def test_create_or_update_cables(monkeypatch):
+    sw1 = SimpleNamespace(id=50, name='sw1')
+    sw2 = SimpleNamespace(id=60, name='sw2')
+    ip_addresses = FakeIPAddresses('ip-addresses', [
+        {'address': '10.0.0.1/24', 'assigned_object': SimpleNamespace(device=sw1)},
+        {'address': '10.0.0.2/24', 'assigned_object': SimpleNamespace(device=sw2)},
+    ])
+    interfaces = FakeEndpoint('interfaces', [
+        {'id': 101, 'name': 'xe-0/0/1', 'device_id': 50, 'device': sw1},
+        {'id': 102, 'name': 'xe-0/0/2', 'device_id': 50, 'device': sw1},
+        {'id': 109, 'name': 'xe-0/0/9', 'device_id': 50, 'device': sw1},
+        {'id': 201, 'name': 'et-1', 'device_id': 60, 'device': sw2},
+    ])
+    cables = FakeEndpoint('cables', [
+        {
+            'id': cable_id, 'device_id': 1,
+            'termination_a_type': 'dcim.interface', 'termination_a_id': a.id,
+            'termination_a': a,
+            'termination_b_type': 'dcim.interface', 'termination_b_id': b.id,
+            'termination_b': b,
+        } for cable_id, a, b in [
+            (7, SimpleNamespace(id=2), interfaces.records[102]),
+            (8, SimpleNamespace(id=3), interfaces.records[109]),
+        ]
+    ])
+    monkeypatch.setattr(network, 'nb', SimpleNamespace(
+        ipam=SimpleNamespace(ip_addresses=ip_addresses),
+        dcim=SimpleNamespace(interfaces=interfaces, cables=cables),
+    ))
+    net = ServerNetwork.__new__(ServerNetwork)
+    net.server = SimpleNamespace(device_state=None)
+    net.device = SimpleNamespace(id=1)
+    net.switches = {}
+
+    def interface(interface_id, cable=None):
+        return SimpleNamespace(
+            id=interface_id,
+            name='eth{}'.format(interface_id),
+            cable=SimpleNamespace(id=cable) if cable else None,
+        )
+
+    net.create_or_update_cables([
+        (interface(1), '10.0.0.1', 'xe-0/0/1'),
+        (interface(2, cable=7), '10.0.0.1', 'xe-0/0/2'),
+        (interface(3, cable=8), '10.0.0.2', 'et-1'),
+        (interface(4), '10.0.0.3', 'eth0'),
+        (interface(5), '10.0.0.1', 'xe-0/0/5'),
+    ])
+    assert ip_addresses.requests == [('GET', {
+        'address': ['10.0.0.1', '10.0.0.2', '10.0.0.3'],
+        'fields': network.IP_FIELDS,
+    })]
+    assert interfaces.requests == [('GET', {
+        'device_id': [50, 60],
+        'name': ['et-1', 'xe-0/0/1', 'xe-0/0/2', 'xe-0/0/5'],
+        'brief': 1,
+    })]
+    assert cables.methods() == ['GET', 'DELETE', 'POST']
+    assert cables.requests[1][1] == [8]
+    assert [(c['termination_a_id'], c['termination_b_id']) for c in cables.requests[2][1]] == [
+        (1, 101), (3, 201),
+    ]
+
+    # switches are resolved once per run
+    assert net.get_switches(['10.0.0.1', '10.0.0.3']) == {
+        '10.0.0.1': sw1, '10.0.0.2': sw2, '10.0.0.3': None,
+    }
+    assert len(ip_addresses.requests) == 1
+
+
+def test_set_bonding_interfaces():
+    interfaces = FakeEndpoint('interfaces', [
+        {'id': 1, 'name': 'bond0', 'lag': None},
+        {'id': 2, 'name': 'eth0', 'lag': None},
+        {'id': 3, 'name': 'eth1', 'lag': SimpleNamespace(id=1)},
+        {'id': 4, 'name': 'eth2', 'lag': SimpleNamespace(id=1)},
+        {'id': 5, 'name': 'eth3', 'lag': SimpleNamespace(id=2)},
+    ])
+    net = Network.__new__(Network)
+    net.nb_net = SimpleNamespace(interfaces=interfaces)
+    net.nics = [
+        {'name': 'bond0', 'bonding': True, 'bonding_slaves': ['eth0', 'eth1']},
+        {'name': 'eth0', 'bonding': False, 'bonding_slaves': []},
+        {'name': 'eth1', 'bonding': False, 'bonding_slaves': []},
+        {'name': 'eth2', 'bonding': False, 'bonding_slaves': []},
+        {'name': 'eth3', 'bonding': False, 'bonding_slaves': []},
+    ]
+    index = dict((x.name, x) for x in interfaces.records.values())
+
+    assert net._set_bonding_interfaces(index) is True
+    assert interfaces.requests == [('PATCH', [
+        {'id': 2, 'lag': 1},
+        {'id': 4, 'lag': None},
+        {'id': 5, 'lag': None},
+    ])]
+
+
+def test_delete_stale_netbox_network_cards():
+    interfaces = FakeEndpoint('interfaces', [
+        {'name': 'eth0', 'device_id': 1},
+        {'name': 'veth1', 'device_id': 1},
+        {'name': 'veth2', 'device_id': 1},
+        {'name': 'eth1', 'device_id': 1},
+        {'name': 'tap0', 'device_id': 1},
+        {'name': 'eth9', 'device_id': 2},
+    ])
+    net = Network.__new__(Network)
+    net.server = SimpleNamespace(device_state=None)
+    net.nb_net = SimpleNamespace(interfaces=interfaces)
+    net.custom_arg_id = {'device_id': 1}
+    net.nics = [{'name': 'eth0'}, {'name': 'eth1'}]
+
+    # consecutive stale interfaces are all deleted, at once
+    assert [x.name for x in net.delete_stale_netbox_network_cards()] == ['eth0', 'eth1']
+    assert interfaces.requests[1:] == [('DELETE', [2, 3, 5])]
+    assert sorted(x.name for x in interfaces.records.values()) == ['eth0', 'eth1', 'eth9']
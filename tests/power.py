@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import netbox_agent.power as power
+from netbox_agent.dmidecode import parse
+from netbox_agent.power import PowerSupply
+from tests.conftest import FakeEndpoint, parametrize_with_fixtures
+
+
+@parametrize_with_fixtures(
+    'dmidecode/', only_filenames=[
+        'SM_SYS-6018R'
+    ])
+def test_create_or_update_power_supply(fixture, monkeypatch):
+    description = 'SUPERMICRO - PWS-504P-1R'
+    power_ports = FakeEndpoint('power-ports', [
+        {
+            'name': 'P5041CG52ST0021', 'device_id': 1, 'description': description,
+            'maximum_draw': 500, 'allocated_draw': None,
+            'connected_endpoint_type': 'dcim.powerfeed',
+            'connected_endpoint': SimpleNamespace(id=7),
+        },
+        {
+            'name': 'P5041CG52ST0001', 'device_id': 1, 'description': description,
+            'maximum_draw': 500, 'allocated_draw': None,
+            'connected_endpoint_type': None, 'connected_endpoint': None,
+        },
+    ])
+    power_feeds = FakeEndpoint('power-feeds', [
+        {'id': 7, 'rack_id': 3, 'voltage': 120},
+        {'id': 8, 'rack_id': 3, 'voltage': 230},
+    ])
+    monkeypatch.setattr(power, 'nb', SimpleNamespace(dcim=SimpleNamespace(
+        power_ports=power_ports, power_feeds=power_feeds,
+    )))
+    psu = PowerSupply.__new__(PowerSupply)
+    psu.server = SimpleNamespace(
+        dmi=parse(fixture),
+        # ordered like the local PSUs
+        get_power_consumption=lambda: ['1.0', '0.5'],
+    )
+    psu.netbox_server = SimpleNamespace(id=1, rack=SimpleNamespace(id=3))
+    psu.device_id = 1
+
+    assert psu.create_or_update_power_supply() is True
+    assert power_ports.methods() == ['GET', 'DELETE', 'PATCH', 'POST']
+    assert power_feeds.methods() == ['GET']
+    assert power_ports.requests[1][1] == [2]
+    # the feeds have different voltages, the port connected to a feed uses its own
+    assert power_ports.requests[2][1] == [{'id': 1, 'allocated_draw': 60}]
+    assert power_ports.requests[3][1] == [{
+        'name': 'P5041CG52ST0022',
+        'description': description,
+        'allocated_draw': 230,
+        'maximum_draw': 500,
+        'device': 1,
+    }]
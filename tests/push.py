@@ -0,0 +1,210 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import netbox_agent.command as command
+import netbox_agent.push as push
+import netbox_agent.snapshot as snapshot
+from netbox_agent.dmidecode import parse
+from netbox_agent.vendors.dell import DellHost
+from tests.conftest import parametrize_with_fixtures
+from tests.snapshot import LSHW_VALUES
+
+
+def get_data(dmi, serial='4242'):
+    return {
+        'manufacturer': 'Dell',
+        'dmi': dmi,
+        'identity': {
+            'hostname': 'srv-{}'.format(serial),
+            'service_tag': serial,
+            'product_name': 'PowerEdge M630',
+            'platform': 'Debian 12',
+            'chassis': 'PowerEdge M1000e',
+            'is_blade': True,
+            'own_expansion_slot': False,
+            'blade_slot': 'Slot 03',
+            'chassis_name': 'Chassis 4242',
+            'chassis_service_tag': 'CH4242',
+            'expansion_service_tag': None,
+            'blade_expansion_slot': None,
+            'expansion_product': None,
+        },
+        'location': {'site': 'dc1', 'rack': 'r1', 'height': '2'},
+        'network': {
+            'nics': [{'name': 'eth0', 'mac': '00:11:22:33:44:55', 'ip': None, 'vlan': None}],
+            'ipmi': {},
+            'lldp': None,
+        },
+        'inventory': {
+            'lshw': LSHW_VALUES,
+            'raid_cards': [{
+                'manufacturer': 'Dell',
+                'product_name': 'PERC H730',
+                'serial_number': 'RAID42',
+                'firmware_version': '25.5',
+                'external': False,
+                'physical_disks': [{'Model': 'SSD', 'SN': 'D1', 'Vendor': 'Intel'}],
+            }],
+        },
+        'power': {'psus': []},
+    }
+
+
+@parametrize_with_fixtures('dmidecode/', only_filenames=['Dell_PowerEdge_M630'])
+def test_snapshot_host(fixture, monkeypatch):
+    def no_command(*args, **kwargs):
+        raise AssertionError('No collector must run')
+    monkeypatch.setattr(command, 'run', no_command)
+    monkeypatch.setattr(push, 'config', SimpleNamespace(
+        network=SimpleNamespace(lldp=True),
+    ))
+
+    server = push.get_server(snapshot.build(get_data(parse(fixture))))
+    assert isinstance(server, DellHost)
+    assert server.get_service_tag() == '4242'
+    assert server.get_hostname() == 'srv-4242'
+    assert server.is_blade() is True
+    assert server.get_blade_slot() == 'Slot 03'
+    assert server.get_site() == 'dc1'
+    assert server.get_rack_height() == 2
+    assert server.get_tenant() is None
+    with pytest.raises(NotImplementedError):
+        server.get_power_consumption()
+    measured = push.get_server(snapshot.build(
+        get_data(parse(fixture)), measurements={'power_consumption': ['1.2']},
+    ))
+    assert measured.get_power_consumption() == ['1.2']
+
+    net = push.SnapshotNetwork.__new__(push.SnapshotNetwork)
+    net.server = server
+    assert net.scan() == server.data['network']['nics']
+    assert net.scan() is not server.data['network']['nics']
+    assert net.get_ipmi() == {}
+    assert net.get_lldp().get_switch_port('eth0') is None
+
+    inventory = server.get_inventory()
+    assert inventory.lshw.cpus == LSHW_VALUES['cpus']
+    cards = inventory.get_raid_cards()
+    assert [(c.get_serial_number(), c.get_firmware_version()) for c in cards] == [
+        ('RAID42', '25.5'),
+    ]
+    assert [d['SN'] for d in inventory.get_hw_disks()] == ['D1']
+
+
+@parametrize_with_fixtures('dmidecode/', only_filenames=['Dell_PowerEdge_M630'])
+def test_select_snapshots(fixture, tmpdir):
+    dmi = parse(fixture)
+    old = snapshot.build(get_data(dmi), now=100)
+    new = snapshot.build(dict(get_data(dmi), location={'site': 'dc2'}), now=200)
+    other = snapshot.build(get_data(dmi, serial='4343'), now=100)
+    tmpdir.join('a.json').write(snapshot.dumps(new))
+    tmpdir.join('b.json').write(snapshot.dumps(old))
+    tmpdir.join('c.json').write(snapshot.dumps(other))
+    tmpdir.join('d.json').write('{')
+    # the hashes are checked by the workers
+    tmpdir.join('e.json').write(snapshot.dumps(dict(other, hash='sha256:0', collected_at=50)))
+    no_serial = get_data(dmi)
+    no_serial['identity']['service_tag'] = None
+    tmpdir.join('f.json').write(snapshot.dumps(snapshot.build(no_serial)))
+    tmpdir.join('notes.txt').write('ignored')
+
+    sources, invalid = push.select_snapshots(push.read_sources(str(tmpdir)))
+    assert invalid == 2
+    assert sorted(name for name, _ in sources) == [
+        str(tmpdir.join('a.json')), str(tmpdir.join('c.json')),
+    ]
+    # files are read again by the workers
+    assert [content for _, content in sources] == [None, None]
+
+    stream = tmpdir.join('stream')
+    stream.write('\n'.join(snapshot.dumps(x) for x in [old, new, other]) + '\n\n')
+    sources, invalid = push.select_snapshots(push.read_sources(str(stream)))
+    assert invalid == 0
+    selected = [json.loads(content) for _, content in sources]
+    assert sorted((x['data']['identity']['service_tag'], x['collected_at']) for x in selected) == [
+        ('4242', 200), ('4343', 100),
+    ]
+
+
+def get_server_data(hostname='srv-4242'):
+    """
+    Return the data of a snapshot of a rack server
+    """
+    with open('tests/fixtures/dmidecode/Dell_PowerEdge_M630') as f:
+        data = get_data(parse(f.read()))
+    data['identity'].update(hostname=hostname, is_blade=False)
+    return data
+
+
+def test_push_snapshot(push_netbox):
+    content = snapshot.dumps(snapshot.build(get_server_data(hostname='new')))
+    assert push.push_snapshot(('new.json', content)) == ('new.json', None)
+    assert [(x[0], x[1], x[2]) for x in push_netbox.requests] == [
+        ('GET', '/api', None),
+        ('GET', '/api/dcim/devices', None),
+        ('GET', '/api/dcim/platforms', None),
+        ('PATCH', '/api/dcim/devices', [{'id': 1, 'name': 'new', 'platform': 3}]),
+    ]
+    assert push_netbox.requests[1][4]['serial'] == ['4242']
+
+    name, error = push.push_snapshot(('bad.json', '{'))
+    assert error.startswith('SnapshotError')
+
+
+def test_get_sync_config():
+    data = snapshot.build(get_data([]))
+    assert push.get_sync_config(data).update_network is False
+    # ie: the scopes replayed from the spool
+    sync_config = push.get_sync_config(data, scopes=['update_network'])
+    assert sync_config.update_network is True
+    assert (sync_config.update_all, sync_config.register) == (False, False)
+
+
+def fake_init_worker(semaphore):
+    pass
+
+
+def fake_push_snapshot(source):
+    name, content = source
+    error = 'boom' if json.loads(content)['data']['identity']['service_tag'] == '4343' else None
+    return name, error
+
+
+@parametrize_with_fixtures('dmidecode/', only_filenames=['Dell_PowerEdge_M630'])
+def test_run(fixture, tmpdir, monkeypatch):
+    dmi = parse(fixture)
+    stream = tmpdir.join('stream')
+    stream.write('\n'.join(
+        snapshot.dumps(snapshot.build(get_data(dmi, serial=serial))) for serial in ['4242', '4343']
+    ) + '\n')
+    monkeypatch.setattr(push, 'init_worker', fake_init_worker)
+    monkeypatch.setattr(push, 'push_snapshot', fake_push_snapshot)
+    config = SimpleNamespace(push=SimpleNamespace(path=str(stream), workers=2, max_requests=2))
+    assert push.run(config) is False
+
+
+def test_init_worker(monkeypatch, tmpdir):
+    requests = []
+    session = SimpleNamespace(request=lambda *args, **kwargs: requests.append(args))
+    monkeypatch.setattr(push, 'nb', SimpleNamespace(http_session=session))
+    monkeypatch.setattr(push, 'config', SimpleNamespace(
+        state=SimpleNamespace(path=str(tmpdir.join('state.json'))),
+    ))
+    monkeypatch.setattr(push.state, 'config', push.config)
+    semaphore = threading.BoundedSemaphore(1)
+    push.init_worker(semaphore)
+    assert push.state.get_state_store() is None
+    push.state.get_state_store.cache_clear()
+
+    # a request waits while the requests of other workers hold the semaphore
+    semaphore.acquire()
+    thread = threading.Thread(target=session.request, args=('GET', '/api/'))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive() and requests == []
+    semaphore.release()
+    thread.join(5)
+    assert requests == [('GET', '/api/')]
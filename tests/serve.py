@@ -0,0 +1,192 @@
+import http.client
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import netbox_agent.push as push
+import netbox_agent.serve as serve
+import netbox_agent.snapshot as snapshot
+from tests.push import get_data, get_server_data
+
+
+def get_snapshot(serial='4242', hostname=None, now=100):
+    data = get_data([], serial=serial)
+    if hostname:
+        data['identity']['hostname'] = hostname
+    return snapshot.dumps(snapshot.build(data, now=now))
+
+
+class Recorder():
+    def __init__(self, errors=()):
+        self.batches = []
+        self.errors = errors
+
+    def __call__(self, batch):
+        self.batches.append(batch)
+        return [(name, 'boom' if name in self.errors else None) for name, _ in batch]
+
+
+def test_receiver_coalesces():
+    apply = Recorder()
+    receiver = serve.Receiver(apply, window=60, batch_size=10)
+    assert receiver.receive(get_snapshot(), now=1000) == 'queued'
+    assert receiver.receive(get_snapshot(), now=1001) == 'unchanged'
+    assert receiver.receive(get_snapshot(hostname='new', now=200), now=1010) == 'coalesced'
+    # an older snapshot doesn't replace a newer one
+    assert receiver.receive(get_snapshot(hostname='old', now=150), now=1011) == 'outdated'
+    assert receiver.receive(get_snapshot(serial='4343'), now=1020) == 'queued'
+
+    # nothing is due before the window of the first snapshot is over
+    assert receiver.run_batch(now=1059) == 0
+    assert receiver.run_batch(now=1060) == 1
+    name, content = apply.batches[0][0]
+    assert name == '4242'
+    assert json.loads(content)['data']['identity']['hostname'] == 'new'
+    assert receiver.run_batch(now=1080) == 1
+
+    # the last synced snapshot is known
+    assert receiver.receive(get_snapshot(hostname='new', now=200), now=1100) == 'unchanged'
+    # a delayed older snapshot doesn't roll the synced one back
+    assert receiver.receive(get_snapshot(hostname='old', now=150), now=1100) == 'outdated'
+    metrics = receiver.metrics(now=1100)
+    assert (metrics['depth'], metrics['in_flight'], metrics['applied']) == (0, 0, 2)
+    assert metrics['received'] == 7 and metrics['unchanged'] == 2
+    assert metrics['outdated'] == 2
+
+
+def test_receiver_bounds():
+    apply = Recorder(errors=['4343'])
+    receiver = serve.Receiver(apply, window=0, batch_size=1, max_pending=2)
+    receiver.receive(get_snapshot(serial='4242'), now=1000)
+    receiver.receive(get_snapshot(serial='4343'), now=1001)
+    with pytest.raises(serve.QueueFull):
+        receiver.receive(get_snapshot(serial='4444'), now=1002)
+    with pytest.raises(snapshot.SnapshotError):
+        receiver.receive('{}', now=1002)
+
+    assert receiver.metrics(now=1010)['oldest_age'] == 10
+    assert receiver.run_batch(now=1010) == 1
+    assert receiver.run_batch(now=1010) == 1
+    # a failed snapshot is queued again
+    assert list(receiver.pending) == ['4343']
+    assert receiver.run_batch(now=1010) == 1
+    assert receiver.receive(get_snapshot(serial='4343'), now=1020) == 'unchanged'
+    # and dropped once it failed `max_attempts` times
+    receiver.drain()
+    assert [x[0][0] for x in apply.batches] == ['4242', '4343', '4343', '4343']
+    assert receiver.pending == {}
+    # it is synced again when received again
+    assert receiver.receive(get_snapshot(serial='4343'), now=1030) == 'queued'
+
+    exported = receiver.export_metrics(now=1030)
+    assert '# TYPE netbox_agent_serve_queue_depth gauge\nnetbox_agent_serve_queue_depth 1\n' \
+        in exported
+    for result, count in [
+            ('applied', 1), ('retried', 2), ('failed', 1), ('rejected', 1), ('invalid', 1)]:
+        assert 'netbox_agent_serve_snapshots_total{{result="{}"}} {}\n'.format(
+            result, count,
+        ) in exported
+
+
+def test_receiver_retries():
+    def apply(batch):
+        # a newer snapshot is received while syncing
+        receiver.receive(get_snapshot(hostname='new', now=200), now=1001)
+        return [(name, 'boom') for name, _ in batch]
+
+    receiver = serve.Receiver(apply, window=60)
+    receiver.receive(get_snapshot(now=100), now=1000)
+    assert receiver.run_batch(now=1060) == 1
+    # the failed snapshot isn't queued again over the newer one
+    entry = receiver.pending['4242']
+    assert json.loads(entry['content'])['data']['identity']['hostname'] == 'new'
+    assert (entry['attempts'], entry['queued_at']) == (0, 1001)
+    assert receiver.metrics(now=1060)['failed'] == 1
+
+    # the queue is drained without waiting for the window
+    receiver.apply = Recorder()
+    receiver.drain()
+    assert receiver.pending == {} and receiver.applied['4242'][1] == 200
+
+
+def test_serve(push_netbox):
+    def apply(batch):
+        # as the workers of `serve.run`, in this process
+        return [push.push_snapshot(source) for source in batch]
+
+    def server_snapshot(hostname, now):
+        return snapshot.dumps(snapshot.build(get_server_data(hostname=hostname), now=now))
+
+    receiver = serve.Receiver(apply, window=60)
+    server = serve.make_server(receiver, '127.0.0.1', 0, 'secret')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://{}:{}'.format(*server.server_address)
+    try:
+        first = snapshot.loads(server_snapshot('srv-4242', now=100))
+        # the agents must authenticate
+        with pytest.raises(requests.HTTPError):
+            snapshot.write(first, url + '/snapshots')
+        with pytest.raises(requests.HTTPError):
+            snapshot.write(first, url + '/snapshots', token='wrong')
+        assert receiver.metrics().get('received', 0) == 0
+        snapshot.write(first, url + '/snapshots', token='secret')
+
+        def post(content):
+            return requests.post(url + '/snapshots', data=content, headers={
+                'Authorization': 'Bearer secret',
+            })
+        resp = post(server_snapshot('new', now=200))
+        assert (resp.status_code, resp.json()) == (202, {'status': 'coalesced'})
+        resp = post(server_snapshot('new', now=200))
+        assert (resp.status_code, resp.json()) == (200, {'status': 'unchanged'})
+        assert post('{').status_code == 400
+        # a snapshot the receiver can't queue
+        no_serial = get_server_data()
+        no_serial['identity']['service_tag'] = None
+        assert post(snapshot.dumps(snapshot.build(no_serial))).status_code == 400
+        for length in ['-1', 'x']:
+            # as sent, `requests` would fix it
+            connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+            connection.putrequest('POST', '/snapshots')
+            connection.putheader('Authorization', 'Bearer secret')
+            connection.putheader('Content-Length', length)
+            connection.endheaders()
+            resp = connection.getresponse()
+            assert (resp.status, json.loads(resp.read())) == (
+                400, {'error': 'Invalid Content-Length'},
+            )
+            connection.close()
+        assert requests.get(url + '/nowhere').status_code == 404
+
+        resp = requests.get(url + '/metrics')
+        assert resp.headers['Content-Type'] == 'text/plain'
+        assert 'netbox_agent_serve_queue_depth 1\n' in resp.text
+        # nothing is written to Netbox before the window is over
+        assert push_netbox.requests == []
+
+        receiver.run_batch(now=receiver.pending['4242']['queued_at'] + 60)
+        resp = requests.get(url + '/metrics')
+        assert 'netbox_agent_serve_queue_depth 0\n' in resp.text
+        assert 'netbox_agent_serve_latency_seconds_count 1\n' in resp.text
+        assert 'netbox_agent_serve_snapshots_total{result="applied"} 1\n' in resp.text
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # the coalesced snapshot only
+    assert [(x[0], x[1], x[2]) for x in push_netbox.requests] == [
+        ('GET', '/api', None),
+        ('GET', '/api/dcim/devices', None),
+        ('GET', '/api/dcim/platforms', None),
+        ('PATCH', '/api/dcim/devices', [{'id': 1, 'name': 'new', 'platform': 3}]),
+    ]
+
+
+def test_run_requires_token():
+    config = SimpleNamespace(serve=SimpleNamespace(token=None))
+    with pytest.raises(Exception, match='serve.token'):
+        serve.run(config)
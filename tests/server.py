@@ -1,3 +1,7 @@
+import netbox_agent.inventory
+import netbox_agent.network
+import netbox_agent.power
+import netbox_agent.server
 from netbox_agent.dmidecode import parse
 from netbox_agent.server import ServerBase
 from netbox_agent.vendors.hp import HPHost
@@ -107,3 +111,29 @@ def test_hp_blade_with_gpu_expansion(fixture):
     assert server.is_blade() is True
     assert server.own_expansion_slot() is True
     assert server.get_expansion_service_tag() == '4242 expansion'
+
+
+@parametrize_with_fixtures(
+    'dmidecode/', only_filenames=[
+        'Dell_PowerEdge_M630'
+    ])
+def test_lazy_subsystems(fixture, monkeypatch):
+    built = []
+
+    def subsystem(name):
+        def build(server):
+            built.append(name)
+            return name
+        return build
+
+    monkeypatch.setattr(netbox_agent.network, 'ServerNetwork', subsystem('network'))
+    monkeypatch.setattr(netbox_agent.inventory, 'Inventory', subsystem('inventory'))
+    monkeypatch.setattr(netbox_agent.power, 'PowerSupply', subsystem('power'))
+    monkeypatch.setattr(netbox_agent.server, 'get_device_platform', subsystem('platform'))
+    server = ServerBase(parse(fixture))
+    assert built == []
+    assert server.power == 'power'
+    assert server.power == 'power'
+    assert built == ['power']
+    assert server.device_platform == 'platform'
+    assert built == ['power', 'platform']
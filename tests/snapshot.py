@@ -0,0 +1,153 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import netbox_agent.config
+import netbox_agent.snapshot as snapshot
+from netbox_agent.dmidecode import parse
+from netbox_agent.lldp import LLDP
+from netbox_agent.lshw import LSHW
+from netbox_agent.raid.base import RaidController
+from netbox_agent.vendors.dell import DellHost
+from tests.conftest import parametrize_with_fixtures
+
+LSHW_VALUES = {
+    'vendor': 'Dell Inc.',
+    'product': 'PowerEdge M630',
+    'chassis_serial': '4242',
+    'motherboard_serial': 'MB4242',
+    'motherboard': '0R10KG',
+    'memories': [{'slot': 'A1', 'serial': 'M1', 'vendor': 'Samsung', 'size': 16.0}],
+    'interfaces': [],
+    'cpus': [{'product': 'Xeon', 'vendor': 'Intel Corp.', 'location': 'CPU1'}],
+    'disks': [],
+    'gpus': [],
+}
+
+
+class FakeController(RaidController):
+    def get_manufacturer(self):
+        return 'Dell'
+
+    def get_product_name(self):
+        return 'PERC H730'
+
+    def get_serial_number(self):
+        return 'RAID42'
+
+    def get_physical_disks(self):
+        return [{'Model': 'SSD', 'SN': 'D1', 'Vendor': 'Intel'}]
+
+
+@pytest.fixture
+def no_netbox(monkeypatch):
+    def fail():
+        raise AssertionError('Netbox must not be contacted')
+    monkeypatch.setitem(netbox_agent.config.netbox_instance.__dict__, '_factory', fail)
+
+
+@parametrize_with_fixtures('dmidecode/', only_filenames=['Dell_PowerEdge_M630'])
+def test_collect_only(fixture, no_netbox, monkeypatch, tmpdir):
+    monkeypatch.setattr(snapshot, 'config', SimpleNamespace(
+        device=SimpleNamespace(platform='Debian 12'),
+        network=SimpleNamespace(lldp=None),
+        inventory=True,
+    ))
+    monkeypatch.setattr('netbox_agent.network.Network.scan', staticmethod(lambda: [
+        {'name': 'eth0', 'mac': '00:11:22:33:44:55', 'ip': ['10.0.0.1/24'], 'vlan': None},
+    ]))
+    monkeypatch.setattr('netbox_agent.ipmi.IPMI.__init__', lambda self: None)
+    monkeypatch.setattr('netbox_agent.ipmi.IPMI.parse', lambda self: {})
+    server = DellHost(dmi=parse(fixture))
+    monkeypatch.setattr(server, 'get_hostname', lambda: 'srv1')
+    monkeypatch.setattr(server, 'get_input', lambda x: 'dc1' if x == 'site' else None)
+    monkeypatch.setattr(server, 'get_power_consumption', lambda: ['1.2', '0.8'])
+    server.inventory.lshw = LSHW.from_dict(LSHW_VALUES)
+    server.inventory.raid = SimpleNamespace(get_controllers=lambda: [FakeController()])
+
+    path = tmpdir.join('snapshot.json')
+    written = snapshot.collect_only(server, SimpleNamespace(
+        snapshot_file=str(path), serve=SimpleNamespace(token=None),
+    ))
+    content = path.read()
+    assert '\n' not in content
+    loaded = snapshot.loads(content)
+    assert loaded == written
+    assert loaded['schema'] == 'netbox-agent/snapshot'
+    assert loaded['version'] == snapshot.SNAPSHOT_VERSION
+
+    data = loaded['data']
+    assert data['manufacturer'] == 'Dell'
+    assert data['identity']['service_tag'] == server.get_service_tag()
+    assert data['identity']['hostname'] == 'srv1'
+    assert data['identity']['platform'] == 'Debian 12'
+    assert data['identity']['is_blade'] is True
+    assert data['identity']['blade_slot'] == server.get_blade_slot()
+    assert data['location']['site'] == 'dc1'
+    assert data['network']['nics'][0]['name'] == 'eth0'
+    assert data['inventory']['lshw'] == LSHW_VALUES
+    assert data['inventory']['raid_cards'] == [{
+        'manufacturer': 'Dell',
+        'product_name': 'PERC H730',
+        'serial_number': 'RAID42',
+        'firmware_version': None,
+        'external': False,
+        'physical_disks': [{'Model': 'SSD', 'SN': 'D1', 'Vendor': 'Intel'}],
+    }]
+    assert loaded['measurements'] == {'power_consumption': ['1.2', '0.8']}
+
+    # the hash only depends on what was collected
+    again = snapshot.build(json.loads(json.dumps(data)), now=1)
+    assert again['hash'] == loaded['hash']
+    assert again['collected_at'] != loaded['collected_at']
+
+    # not on the measurements, which change on every run
+    monkeypatch.setattr(server, 'get_power_consumption', lambda: ['1.4', '0.6'])
+    again = snapshot.collect_only(server, SimpleNamespace(
+        snapshot_file=str(path), serve=SimpleNamespace(token=None),
+    ))
+    assert again['measurements'] == {'power_consumption': ['1.4', '0.6']}
+    assert again['hash'] == loaded['hash']
+
+
+@parametrize_with_fixtures('lldp/', only_filenames=['cumulus.txt'])
+def test_lldp_age_not_hashed(fixture, monkeypatch):
+    monkeypatch.setattr(snapshot, 'config', SimpleNamespace(network=SimpleNamespace(lldp=True)))
+    monkeypatch.setattr('netbox_agent.network.Network.scan', staticmethod(lambda: []))
+    monkeypatch.setattr('netbox_agent.ipmi.IPMI.__init__', lambda self: None)
+    monkeypatch.setattr('netbox_agent.ipmi.IPMI.parse', lambda self: {})
+    outputs = [fixture, fixture.replace('age=35 days, 08:24:00', 'age=35 days, 08:24:01')]
+    assert outputs[0] != outputs[1]
+
+    hashes = []
+    for output in outputs:
+        monkeypatch.setattr('netbox_agent.lldp.getoutput', lambda command: output)
+        network = snapshot.collect_network(None)
+        hashes.append(snapshot.get_hash(network))
+        assert '.age=' not in network['lldp']
+        assert LLDP(output=network['lldp']).get_switch_port('eno1') == 'swp46'
+    assert hashes[0] == hashes[1]
+
+
+def test_loads_rejects_invalid_snapshots():
+    valid = snapshot.build({'identity': {'service_tag': '4242'}})
+    assert snapshot.loads(snapshot.dumps(valid)) == valid
+
+    with pytest.raises(snapshot.SnapshotError, match='Invalid'):
+        snapshot.loads('{')
+    with pytest.raises(snapshot.SnapshotError, match='version'):
+        snapshot.loads(snapshot.dumps(dict(valid, version=99)))
+    # what the sync and the receivers read first
+    for invalid in [dict(valid, data={}), dict(valid, data=None), dict(valid, collected_at=None)]:
+        with pytest.raises(snapshot.SnapshotError, match='without'):
+            snapshot.loads(snapshot.dumps(invalid), verify=False)
+    tampered = dict(valid, data={'identity': {'service_tag': '4243'}})
+    with pytest.raises(snapshot.SnapshotError, match='hash'):
+        snapshot.loads(snapshot.dumps(tampered))
+
+
+def test_lshw_round_trip():
+    lshw = LSHW.from_dict(LSHW_VALUES)
+    assert lshw.to_dict() == LSHW_VALUES
+    assert lshw.get_hw_linux('cpu') == LSHW_VALUES['cpus']
@@ -0,0 +1,212 @@
+import os
+from types import SimpleNamespace
+
+import pynetbox
+import pytest
+import requests
+
+import netbox_agent.cli as cli
+import netbox_agent.push as push
+import netbox_agent.snapshot as snapshot
+from netbox_agent.spool import Spool, is_unreachable
+
+
+def test_spool_coalesce(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.put('update_network', now=100)
+    spool.put('update_network', now=110)
+    entries = spool.entries()
+    assert len(entries) == 1
+    # the newest entry, queued since the first
+    assert (entries[0]['queued_at'], entries[0]['updated_at']) == (100, 110)
+
+    spool.put('update_psu', now=120)
+    assert [x['scope'] for x in spool.entries()] == ['update_network', 'update_psu']
+    spool.remove('update_network')
+    assert [x['scope'] for x in spool.entries()] == ['update_psu']
+
+
+def test_spool_backoff(tmpdir, monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda a, b: b)
+    spool = Spool(str(tmpdir), backoff=60, max_backoff=200)
+    assert spool.retry_at() is None
+    spool.put('update_network', now=1000)
+    assert spool.is_due(now=1000)
+    retries = []
+    for _ in range(4):
+        spool.failed(now=1000)
+        retries.append(spool.retry_at() - 1000)
+    assert retries == [60, 120, 200, 200]
+    assert not spool.is_due(now=1100)
+
+    metrics_file = tmpdir.join('spool.prom')
+    spool.export_metrics(str(metrics_file), now=1050)
+    assert spool.metrics(now=1050) == {
+        'depth': 1, 'oldest_age': 50, 'attempts': 4, 'retry_in': 150,
+    }
+    assert 'netbox_agent_spool_depth 1\n' in metrics_file.read()
+    assert 'netbox_agent_spool_oldest_age_seconds 50\n' in metrics_file.read()
+
+
+def get_snapshot(serial, run=0, size=0):
+    return snapshot.build({'identity': {'service_tag': serial}, 'run': run, 'pad': 'x' * size})
+
+
+def test_spool_snapshots(tmpdir):
+    spool = Spool(str(tmpdir), max_size=3000)
+    spool.put_snapshot(get_snapshot('4242', run=1))
+    spool.put_snapshot(get_snapshot('4242', run=2))
+    # the newest snapshot of each server
+    assert [x['data']['run'] for x in spool.snapshots()] == [2]
+    # not taken for queued scopes
+    assert spool.entries() == []
+
+    os.utime(spool._snapshot_path('4242'), (100, 100))
+    spool.put_snapshot(get_snapshot('4343/A', size=1000))
+    os.utime(spool._snapshot_path('4343/A'), (200, 200))
+    spool.put_snapshot(get_snapshot('4444', size=2000))
+    # the oldest are dropped beyond max_size
+    assert [x['data']['identity']['service_tag'] for x in spool.snapshots()] == ['4444']
+    spool.put_snapshot(get_snapshot('4545', size=4000))
+    assert [x['data']['identity']['service_tag'] for x in spool.snapshots()] == ['4444']
+
+    tmpdir.join('snapshots', 'broken.json').write('{')
+    assert len(spool.snapshots()) == 1
+    assert not tmpdir.join('snapshots', 'broken.json').exists()
+    spool.remove_snapshots()
+    assert spool.snapshots() == []
+
+
+def test_is_unreachable():
+    assert is_unreachable(requests.exceptions.ConnectionError())
+    assert is_unreachable(requests.exceptions.ReadTimeout())
+    assert not is_unreachable(ValueError())
+    error_page = SimpleNamespace(request=SimpleNamespace(body=None), url='http://netbox/api/')
+    assert is_unreachable(pynetbox.ContentError(error_page))
+
+
+class FakeServer():
+    def __init__(self):
+        self.runs = []
+        self.error = None
+
+    def netbox_create_or_update(self, config):
+        self.runs.append(sorted(x for x in cli.SYNC_OPTIONS if getattr(config, x)))
+        if self.error:
+            raise self.error
+
+
+@pytest.fixture
+def config(tmpdir):
+    return SimpleNamespace(
+        spool=SimpleNamespace(
+            path=str(tmpdir.join('spool')),
+            backoff=60,
+            max_backoff=3600,
+            max_size=2 ** 20,
+            metrics_file=str(tmpdir.join('spool.prom')),
+        ),
+        **dict((x, False) for x in cli.SYNC_OPTIONS)
+    )
+
+
+def test_sync_spools_when_unreachable(config, monkeypatch):
+    monkeypatch.setattr(cli, 'nb', SimpleNamespace(version='3.5'))
+    monkeypatch.setattr(cli.state, 'save', lambda: None)
+    # ie: a virtual machine
+    monkeypatch.setattr(cli, 'get_snapshot', lambda server: None)
+    server = FakeServer()
+    spool = cli.get_spool(config)
+
+    config.update_inventory = True
+    server.error = requests.exceptions.ConnectionError('Connection refused')
+    assert cli.sync(server, config) is False
+    assert [x['scope'] for x in spool.entries()] == ['update_inventory']
+    assert 'netbox_agent_spool_depth 1' in open(config.spool.metrics_file).read()
+
+    # during the backoff, the next run doesn't contact Netbox
+    config.update_inventory = False
+    config.update_network = True
+    assert cli.sync(server, config) is False
+    assert len(server.runs) == 1
+    assert sorted(x['scope'] for x in spool.entries()) == ['update_inventory', 'update_network']
+
+    # then the queued scopes are replayed with the requested one
+    config.update_network = False
+    config.update_psu = True
+    server.error = None
+    monkeypatch.setattr(spool.__class__, 'is_due', lambda self: True)
+    assert cli.sync(server, config) is True
+    assert server.runs[-1] == ['update_inventory', 'update_network', 'update_psu']
+    assert spool.entries() == []
+    # on a copy of the options
+    assert (config.update_inventory, config.update_network) == (False, False)
+
+
+def test_sync_replays_snapshots(config, monkeypatch):
+    monkeypatch.setattr(cli, 'nb', SimpleNamespace(version='3.5'))
+    monkeypatch.setattr(cli.state, 'save', lambda: None)
+    collected = iter(range(1, 10))
+    monkeypatch.setattr(cli, 'get_snapshot', lambda server: get_snapshot('4242', next(collected)))
+    replays = []
+
+    def sync_snapshot(snapshot, scopes=None):
+        replays.append((snapshot['data']['run'], scopes))
+        if len(replays) == 2:
+            raise ValueError('rejected')
+    monkeypatch.setattr(push, 'sync_snapshot', sync_snapshot)
+    server = FakeServer()
+    spool = cli.get_spool(config)
+
+    server.error = requests.exceptions.ConnectionError('Connection refused')
+    config.update_inventory = True
+    assert cli.sync(server, config) is False
+    config.update_inventory = False
+    config.update_network = True
+    assert cli.sync(server, config) is False
+    # the newest snapshot only
+    assert [x['data']['run'] for x in spool.snapshots()] == [2]
+
+    # the queued scopes the run doesn't sync are synced from the snapshot
+    monkeypatch.setattr(Spool, 'is_due', lambda self: True)
+    server.error = None
+    assert cli.sync(server, config) is True
+    assert replays == [(2, ['update_inventory'])]
+    assert server.runs[-1] == ['update_network']
+    assert spool.entries() == [] and spool.snapshots() == []
+
+    # a snapshot Netbox rejects is dropped rather than retried forever
+    server.error = requests.exceptions.ConnectionError('Connection refused')
+    assert cli.sync(server, config) is False
+    server.error = None
+    config.update_network = False
+    config.update_psu = True
+    assert cli.sync(server, config) is True
+    assert replays[-1] == (3, ['update_network'])
+    assert server.runs[-1] == ['update_psu']
+    assert spool.entries() == [] and spool.snapshots() == []
+
+
+def test_sync_raises_other_errors(config, monkeypatch):
+    monkeypatch.setattr(cli, 'nb', SimpleNamespace(version='3.5'))
+    server = FakeServer()
+    server.error = ValueError('bug')
+    config.update_network = True
+    with pytest.raises(ValueError):
+        cli.sync(server, config)
+    assert cli.get_spool(config).entries() == []
+
+
+def test_run_with_options(tmpdir, monkeypatch):
+    # through the proxy to the parsed options, as the agent runs
+    import netbox_agent.config
+
+    monkeypatch.setattr(netbox_agent.config, '_config', {})
+    netbox_agent.config.get_config(args=['--update-network', '--spool.path', str(tmpdir)])
+    monkeypatch.setattr(cli, 'nb', SimpleNamespace(version='3.5'))
+    monkeypatch.setattr(cli.state, 'save', lambda: None)
+    monkeypatch.setattr(cli.dmidecode, 'parse', lambda: [])
+    server = FakeServer()
+    monkeypatch.setattr(cli, 'get_server', lambda dmi, config: server)
+    assert cli.run(cli.config) is True
+    assert server.runs == [['update_network']]
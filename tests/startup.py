@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+# imported lazily, once a run needs them
+HEAVY_MODULES = (
+    'jsonargparse',
+    'pynetbox',
+    'requests',
+    'netifaces',
+    'pkg_resources',
+    'netbox_agent.inventory',
+    'netbox_agent.network',
+    'netbox_agent.raid',
+    'netbox_agent.server',
+    'netbox_agent.vendors',
+)
+
+# generous, only meant to catch a heavy import sneaking back in
+MAX_IMPORT_TIME = 1.0
+
+
+def importtime(module):
+    """
+    Return the cumulative import time of every module imported by
+    `python -X importtime -c 'import <module>'`, in seconds
+    """
+    p = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative) / 1e6
+    return modules
+
+
+def test_cli_startup():
+    modules = importtime('netbox_agent.cli')
+    heavy = [
+        m for m in modules
+        if any(m == h or m.startswith(h + '.') for h in HEAVY_MODULES)
+    ]
+    assert heavy == []
+    assert modules['netbox_agent.cli'] < MAX_IMPORT_TIME
@@ -0,0 +1,119 @@
+from types import SimpleNamespace
+
+import pynetbox
+
+import netbox_agent.state as state
+from netbox_agent.state import filter_incremental, get_mapped, get_state_store
+from tests.conftest import FakeEndpoint, StubNetbox
+
+
+def interface(interface_id, name, last_updated):
+    return {
+        'id': interface_id,
+        'name': name,
+        'device': {'id': 1, 'name': 'server1'},
+        'mode': {'value': 'tagged', 'label': 'Tagged'},
+        'last_updated': last_updated,
+    }
+
+
+def test_filter_incremental(tmpdir, monkeypatch):
+    monkeypatch.setattr(state, 'config', SimpleNamespace(state=SimpleNamespace(
+        path=str(tmpdir.join('state.json')), max_age=3600,
+    )))
+    get_state_store.cache_clear()
+    interfaces = {
+        1: interface(1, 'eth0', '2023-01-01T10:00:00.000000Z'),
+        2: interface(2, 'eth1', '2023-01-02T10:00:00.000000Z'),
+    }
+
+    def list_interfaces(body, query):
+        results = [
+            x for x in interfaces.values()
+            if x['last_updated'] >= query.get('last_updated__gte', [''])[0]
+        ]
+        return 200, {'count': len(results), 'next': None, 'previous': None, 'results': results}
+
+    def run():
+        # every run starts from the state saved by the previous one
+        get_state_store.cache_clear()
+        stub.requests = []
+        records = filter_incremental(nb.dcim.interfaces, device_id=1)
+        state.save()
+        return sorted((x.id, x.name, x.mode.value) for x in records)
+
+    with StubNetbox({('GET', '/api/dcim/interfaces'): list_interfaces}) as stub:
+        nb = pynetbox.api(stub.url, token='secret')
+
+        assert run() == [(1, 'eth0', 'tagged'), (2, 'eth1', 'tagged')]
+        assert [r[4] for r in stub.requests] == [{'device_id': ['1'], 'limit': ['0']}]
+
+        # nothing changed: the count and an empty page
+        assert run() == [(1, 'eth0', 'tagged'), (2, 'eth1', 'tagged')]
+        assert [r[4] for r in stub.requests] == [
+            {'device_id': ['1'], 'limit': ['1']},
+            {
+                'device_id': ['1'], 'limit': ['0'],
+                'last_updated__gte': ['2023-01-02T10:00:00.000000Z'],
+            },
+        ]
+
+        # only the updated interface is fetched
+        interfaces[1] = interface(1, 'eth2', '2023-01-03T10:00:00.000000Z')
+        assert run() == [(1, 'eth2', 'tagged'), (2, 'eth1', 'tagged')]
+        assert len(stub.requests[1][4]) == 3
+
+        # a deleted interface is noticed by the count, all are fetched again
+        del interfaces[2]
+        assert run() == [(1, 'eth2', 'tagged')]
+        assert [r[4] for r in stub.requests][-1] == {'device_id': ['1'], 'limit': ['0']}
+        assert len(stub.requests) == 3
+
+    get_state_store.cache_clear()
+
+
+def test_get_mapped(tmpdir, monkeypatch):
+    monkeypatch.setattr(state, 'config', SimpleNamespace(state=SimpleNamespace(
+        path=str(tmpdir.join('state.json')), max_age=3600,
+    )))
+    devices = FakeEndpoint('devices', [
+        {'id': 1, 'serial': 'ABC'},
+        {'id': 2, 'serial': 'DEF'},
+    ])
+    devices.url = 'http://netbox/api/dcim/devices'
+
+    def get_device(serial):
+        # every run starts from the state saved by the previous one
+        get_state_store.cache_clear()
+        devices.requests = []
+        device = get_mapped(
+            devices,
+            'serial={}'.format(serial),
+            lookup=lambda: devices.get(serial=serial),
+            check=lambda device: device.serial == serial,
+        )
+        state.save()
+        return device
+
+    assert get_device('ABC').id == 1
+    assert devices.requests == [('GET', {'serial': 'ABC'})]
+    # then fetched by id
+    assert get_device('ABC').id == 1
+    assert devices.requests == [('GET', (1,))]
+
+    # the serial changed: looked up again, and mapped to the new device
+    devices.records[1].serial = 'XYZ'
+    devices.records[2].serial = 'ABC'
+    assert get_device('ABC').id == 2
+    assert devices.requests == [('GET', (1,)), ('GET', {'serial': 'ABC'})]
+    assert get_device('ABC').id == 2
+    assert devices.requests == [('GET', (2,))]
+
+    # the device was deleted (404)
+    devices.delete([2])
+    devices.requests = []
+    assert get_device('ABC') is None
+    assert devices.requests == [('GET', (2,)), ('GET', {'serial': 'ABC'})]
+    assert get_state_store().section('ids') == {}
+
+    get_state_store.cache_clear()